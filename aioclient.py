@@ -0,0 +1,248 @@
+import asyncio
+from collections import deque
+from typing import Deque, List, Optional, Sequence
+
+from client import Reply, reconnect_delay
+from config import client_config, server_config
+from logger import logger
+from protocol import ReplyError, encode_reply, read_reply
+
+HOST = server_config.host
+PORT = server_config.port
+RECONNECT_ATTEMPTS = client_config.reconnect_attempts
+TIMEOUT = client_config.heartbeat_interval
+
+MAX_CONNECTIONS = 4
+"""连接池的最大连接数"""
+
+
+class _Connection:
+    """
+    连接池中的一个连接
+
+    请求不等待响应直接发送，服务器按顺序返回响应，依次交给等待队列中最早的请求，
+    因此一个连接可以同时承载任意多个并发请求
+    """
+
+    def __init__(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        self._writer = writer
+        self._pending: Deque[asyncio.Future] = deque()
+        self.closed = False
+        self._read_task = asyncio.create_task(self._read_loop(reader))
+
+    @property
+    def load(self) -> int:
+        """
+        尚未收到响应的请求数量
+        """
+        return len(self._pending)
+
+    async def send(self, commands: Sequence[Sequence[str]]) -> List[asyncio.Future]:
+        """
+        一次写入多条指令，返回按顺序等待各条响应的 Future
+        """
+        loop = asyncio.get_running_loop()
+        futures = [loop.create_future() for _ in commands]
+        self._pending.extend(futures)
+        self._writer.write(
+            b"".join(encode_reply([str(arg) for arg in argv]) for argv in commands)
+        )
+        await self._writer.drain()
+        return futures
+
+    async def _read_loop(self, reader: asyncio.StreamReader) -> None:
+        try:
+            while True:
+                try:
+                    reply: object = await read_reply(reader)
+                except ReplyError as e:
+                    reply = e
+                future = self._pending.popleft()
+                if future.done():  # 等待超时的请求
+                    continue
+                if isinstance(reply, Exception):
+                    future.set_exception(reply)
+                else:
+                    future.set_result(reply)
+        except (asyncio.IncompleteReadError, OSError) as e:
+            logger.warning(f"连接已断开: {e}")
+        finally:
+            self.closed = True
+            while self._pending:
+                future = self._pending.popleft()
+                if not future.done():
+                    future.set_exception(ConnectionError("连接已断开"))
+            self._writer.close()
+
+    async def close(self) -> None:
+        self._read_task.cancel()
+        try:
+            await self._read_task
+        except asyncio.CancelledError:
+            pass
+
+
+class AsyncClient:
+    """
+    asyncio 客户端
+
+    连接池最多维护 max_connections 个长连接，每个连接可以同时承载多个请求，
+    新请求交给待处理请求最少的连接；连接断开后自动按 run_client 的退避策略重连。
+
+    用法::
+
+        async with AsyncClient() as client:
+            await client.execute("set", "key", "value")
+            async with client.pipeline() as pipe:
+                pipe.add("get", "key").add("ttl", "key")
+            print(pipe.results)
+    """
+
+    def __init__(
+        self,
+        host: str = HOST,
+        port: int = PORT,
+        max_connections: int = MAX_CONNECTIONS,
+        reconnect_attempts: int = RECONNECT_ATTEMPTS,
+        timeout: float = TIMEOUT,
+        retry_on_disconnect: bool = False,
+    ) -> None:
+        """
+        :param reconnect_attempts: 连接失败时的最大重试次数，0 表示无限重试
+        :param timeout: 等待单条响应的超时时间(秒)
+        :param retry_on_disconnect: 等待响应时连接断开，是否在新连接上重新发送一次；
+            断开前服务器可能已经执行了部分指令，非幂等的写指令(lpush、lpop 等)可能被重复执行，
+            默认不重发，仅在只执行读指令时开启
+        """
+        self.address = f"{host}:{port}"
+        self.host = host
+        self.port = port
+        self.max_connections = max_connections
+        self.reconnect_attempts = reconnect_attempts
+        self.timeout = timeout
+        self.retry_on_disconnect = retry_on_disconnect
+        self._connections: List[_Connection] = []
+        self._connect_lock = asyncio.Lock()
+
+    async def __aenter__(self) -> "AsyncClient":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    async def _acquire(self) -> _Connection:
+        """
+        选择一个连接：有空闲连接或连接数已满时复用待处理请求最少的连接，否则新建连接
+        """
+        self._connections = [conn for conn in self._connections if not conn.closed]
+        if self._connections:
+            conn = min(self._connections, key=lambda c: c.load)
+            if conn.load == 0 or len(self._connections) >= self.max_connections:
+                return conn
+
+        async with self._connect_lock:
+            if len(self._connections) >= self.max_connections:
+                return min(self._connections, key=lambda c: c.load)
+            conn = await self._connect()
+            self._connections.append(conn)
+            return conn
+
+    async def _connect(self) -> _Connection:
+        attempt = 0
+        while True:
+            try:
+                reader, writer = await asyncio.wait_for(
+                    asyncio.open_connection(self.host, self.port), self.timeout
+                )
+                return _Connection(reader, writer)
+            except (OSError, asyncio.TimeoutError) as e:
+                attempt += 1
+                if self.reconnect_attempts and attempt > self.reconnect_attempts:
+                    raise ConnectionError(f"无法连接服务器 {self.address}: {e}") from e
+                wait = reconnect_delay(attempt)
+                logger.warning(
+                    f"连接服务器 {self.address} 失败: {e}，等待 {wait} 秒后重试..."
+                )
+                await asyncio.sleep(wait)
+
+    async def execute(self, *argv: str) -> Reply:
+        """
+        执行一条指令
+
+        :raises ReplyError: 服务器返回错误
+        :raises ConnectionError: 无法连接服务器，或等待响应时连接断开
+        """
+        return (await self.execute_many([argv]))[0]
+
+    async def execute_many(self, commands: Sequence[Sequence[str]]) -> List[Reply]:
+        """
+        在同一个连接上流水线执行多条指令，按顺序返回结果；
+        某条指令出错时仍等待其余响应，再抛出第一个错误
+        """
+        if not commands:
+            return []
+        try:
+            return await self._execute_many(commands)
+        except ConnectionError as e:
+            if not self.retry_on_disconnect:
+                raise
+            logger.warning(f"与服务器 {self.address} 的连接已断开，重新发送: {e}")
+            return await self._execute_many(commands)
+
+    async def _execute_many(self, commands: Sequence[Sequence[str]]) -> List[Reply]:
+        conn = await self._acquire()
+        futures = await conn.send(commands)
+        replies: List[Reply] = []
+        error: Optional[Exception] = None
+        for future in futures:
+            try:
+                replies.append(await asyncio.wait_for(future, self.timeout))
+            except (ReplyError, ConnectionError, asyncio.TimeoutError) as e:
+                replies.append(None)
+                error = error or e
+        if error is not None:
+            raise error
+        return replies
+
+    def pipeline(self) -> "Pipeline":
+        """
+        创建流水线，退出 async with 时一次发送所有指令
+        """
+        return Pipeline(self)
+
+    async def close(self) -> None:
+        for conn in self._connections:
+            await conn.close()
+        self._connections.clear()
+
+
+class Pipeline:
+    """
+    流水线：先收集指令，执行时一次发送，结果按添加顺序保存在 results 中
+    """
+
+    def __init__(self, client: AsyncClient) -> None:
+        self._client = client
+        self._commands: List[Sequence[str]] = []
+        self.results: List[Reply] = []
+
+    def add(self, *argv: str) -> "Pipeline":
+        self._commands.append(argv)
+        return self
+
+    def __len__(self) -> int:
+        return len(self._commands)
+
+    async def execute(self) -> List[Reply]:
+        commands, self._commands = self._commands, []
+        self.results = await self._client.execute_many(commands)
+        return self.results
+
+    async def __aenter__(self) -> "Pipeline":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None and self._commands:
+            await self.execute()
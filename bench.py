@@ -0,0 +1,745 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from functools import partial
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+import aiosqlite
+import yaml
+
+from command import _bind_args, command_handlers, fast_commands
+from config import server_config, yaml_config
+from database import HashMap, Keys, LinkedList, Scan, String, database
+from logger import Joined, _init_logger, shutdown_logger
+from protocol import BUFSIZE, ReplyError, encode_reply, read_reply
+
+ITEMS = 10
+"""预先写入的链表元素数量、哈希表字段数量，以及 mset/mget 等批量指令的参数数量"""
+SETUP_BATCH = 1000
+"""预先写入数据时每批流水线发送的指令数量"""
+SERVER_START_TIMEOUT = 10
+"""等待启动的服务器开始监听的最长时间(秒)"""
+CHANNEL = "bench:channel"
+"""publish 测试发布消息的频道，--subscribers 指定的连接订阅该频道"""
+SUBSCRIBER_SETTLE_TIME = 0.2
+"""publish 测试结束后，订阅者在该时间(秒)内没有再收到消息即认为消息已全部送达"""
+
+LIMITED_TESTS = {"save": 20, "bgsave": 20, "bgrewriteaof": 20}
+"""开销很大的指令最多执行的次数"""
+
+
+class Context:
+    """
+    生成测试指令参数：key 从 keyspace 个 key 中随机选择，值为 data_size 字节
+    """
+
+    def __init__(self, keyspace: int, data_size: int, seed: int) -> None:
+        self.keyspace = keyspace
+        self.value = "x" * data_size
+        self.rng = random.Random(seed)
+        self.payload = ""
+        """restore 使用的序列化数据，预先写入数据后获取"""
+
+    def key(self, kind: str) -> str:
+        return f"bench:{kind}:{self.rng.randrange(self.keyspace)}"
+
+    def keys(self, kind: str) -> List[str]:
+        return [self.key(kind) for _ in range(ITEMS)]
+
+    def field(self) -> str:
+        return f"f{self.rng.randrange(ITEMS)}"
+
+    def pairs(self, keys: List[str]) -> List[str]:
+        return [arg for key in keys for arg in (key, self.value)]
+
+
+# 写入指令在前，读取指令在中间，删除数据的指令在最后，避免影响其他测试的命中率
+TESTS: Dict[str, Callable[[Context], List[str]]] = {
+    "set": lambda c: ["set", c.key("str"), c.value],
+    "setex": lambda c: ["setex", c.key("str"), "3600", c.value],
+    "mset": lambda c: ["mset", *c.pairs(c.keys("str"))],
+    "lpush": lambda c: ["lpush", c.key("list"), c.value],
+    "rpush": lambda c: ["rpush", c.key("list"), c.value],
+    "lset": lambda c: ["lset", c.key("list"), "-1", c.value],
+    "hset": lambda c: ["hset", c.key("hash"), c.field(), c.value],
+    "hmset": lambda c: [
+        "hmset",
+        c.key("hash"),
+        *c.pairs([f"f{i}" for i in range(ITEMS)]),
+    ],
+    "expire": lambda c: ["expire", c.key("str"), "3600"],
+    "persist": lambda c: ["persist", c.key("str")],
+    "restore": lambda c: ["restore", c.key("str"), c.payload],
+    "get": lambda c: ["get", c.key("str")],
+    "mget": lambda c: ["mget", *c.keys("str")],
+    "range": lambda c: ["range", c.key("list"), "0", str(ITEMS - 1)],
+    "len": lambda c: ["len", c.key("list")],
+    "lindex": lambda c: ["lindex", c.key("list"), str(ITEMS // 2)],
+    "hget": lambda c: ["hget", c.key("hash"), c.field()],
+    "hmget": lambda c: ["hmget", c.key("hash"), *[f"f{i}" for i in range(ITEMS)]],
+    "hgetall": lambda c: ["hgetall", c.key("hash")],
+    "hscan": lambda c: ["hscan", c.key("hash"), "0"],
+    "scan": lambda c: ["scan", "0", "COUNT", str(ITEMS)],
+    "ttl": lambda c: ["ttl", c.key("str")],
+    "object": lambda c: ["object", "encoding", c.key("hash")],
+    "dump": lambda c: ["dump", c.key("str")],
+    "publish": lambda c: ["publish", CHANNEL, c.value],
+    "subscribe": lambda c: ["subscribe", c.key("channel")],
+    "unsubscribe": lambda c: ["unsubscribe", c.key("channel")],
+    "psubscribe": lambda c: ["psubscribe", f"{c.key('channel')}*"],
+    "punsubscribe": lambda c: ["punsubscribe", f"{c.key('channel')}*"],
+    "ping": lambda c: ["ping"],
+    "help": lambda c: ["help"],
+    "info": lambda c: ["info"],
+    "slowlog": lambda c: ["slowlog", "get", "10"],
+    "latency": lambda c: ["latency"],
+    "save": lambda c: ["save"],
+    "bgsave": lambda c: ["bgsave"],
+    "bgrewriteaof": lambda c: ["bgrewriteaof"],
+    "replicaof": lambda c: ["replicaof", "no", "one"],
+    "lpop": lambda c: ["lpop", c.key("list")],
+    "rpop": lambda c: ["rpop", c.key("list")],
+    "hdel": lambda c: ["hdel", c.key("hash"), c.field()],
+    "ltrim": lambda c: ["ltrim", c.key("list"), "1", "-2"],
+    "ldel": lambda c: ["ldel", c.key("list")],
+    "del": lambda c: ["del", c.key("str")],
+}
+"""测试的指令及其参数的生成方式，应包含 command_handlers 中的所有指令"""
+
+IN_PROCESS: Dict[str, Callable[[List[str]], Awaitable[Any]]] = {
+    "set": lambda a: String.set(a[1], a[2]),
+    "setex": lambda a: String.set(a[1], a[3], int(a[2])),
+    "mset": lambda a: String.mset(zip(a[1::2], a[2::2])),
+    "lpush": lambda a: LinkedList.lpush(a[1], *a[2:]),
+    "rpush": lambda a: LinkedList.rpush(a[1], *a[2:]),
+    "lset": lambda a: LinkedList.lset(a[1], int(a[2]), a[3]),
+    "hset": lambda a: HashMap.hset(a[1], a[2], a[3]),
+    "hmset": lambda a: HashMap.hmset(a[1], zip(a[2::2], a[3::2])),
+    "expire": lambda a: Keys.expire(a[1], int(a[2])),
+    "persist": lambda a: Keys.persist(a[1]),
+    "restore": lambda a: Keys.restore(a[1], a[2]),
+    "get": lambda a: String.get(a[1]),
+    "mget": lambda a: String.mget(a[1:]),
+    "range": lambda a: LinkedList.range(a[1], int(a[2]), int(a[3])),
+    "len": lambda a: LinkedList.len(a[1]),
+    "lindex": lambda a: LinkedList.lindex(a[1], int(a[2])),
+    "hget": lambda a: HashMap.hget(a[1], a[2]),
+    "hmget": lambda a: HashMap.hmget(a[1], a[2:]),
+    "hgetall": lambda a: HashMap.hgetall(a[1]),
+    "hscan": lambda a: Scan.hscan(a[1], a[2]),
+    "scan": lambda a: Scan.scan(a[1], count=int(a[3])),
+    "ttl": lambda a: Keys.ttl(a[1]),
+    "object": lambda a: Keys.encoding(a[2]),
+    "dump": lambda a: Keys.dump(a[1]),
+    "lpop": lambda a: LinkedList.lpop(a[1]),
+    "rpop": lambda a: LinkedList.rpop(a[1]),
+    "hdel": lambda a: HashMap.hdel(a[1], a[2]),
+    "ltrim": lambda a: LinkedList.ltrim(a[1], int(a[2]), int(a[3])),
+    "ldel": lambda a: LinkedList.ldel(a[1]),
+    "del": lambda a: String.delete(a[1]),
+}
+"""进程内模式下指令参数对应的 database._types 调用，不涉及数据类型的指令跳过"""
+
+
+def _setup_commands(keyspace: int, data_size: int) -> List[List[str]]:
+    """
+    预先写入的数据：keyspace 个字符串、链表、哈希表，链表和哈希表各有 ITEMS 个元素
+    """
+    value = "x" * data_size
+    commands: List[List[str]] = []
+    for i in range(keyspace):
+        commands.append(["set", f"bench:str:{i}", value])
+        commands.append(["rpush", f"bench:list:{i}", *[value] * ITEMS])
+        pairs = [arg for j in range(ITEMS) for arg in (f"f{j}", value)]
+        commands.append(["hmset", f"bench:hash:{i}", *pairs])
+    return commands
+
+
+def _summarize(
+    test: str, latencies: List[float], elapsed: float, errors: int
+) -> Dict[str, Any]:
+    """
+    汇总一项测试的吞吐量和延迟分位数(毫秒)
+    """
+    latencies.sort()
+    count = len(latencies)
+
+    def percentile(q: float) -> float:
+        return latencies[min(count - 1, int(q * count))] * 1e3 if count else 0.0
+
+    return {
+        "test": test,
+        "requests": count,
+        "errors": errors,
+        "seconds": round(elapsed, 4),
+        "rps": round(count / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(0.50), 4),
+        "p95_ms": round(percentile(0.95), 4),
+        "p99_ms": round(percentile(0.99), 4),
+        "p999_ms": round(percentile(0.999), 4),
+        "max_ms": round(latencies[-1] * 1e3, 4) if count else 0.0,
+    }
+
+
+def _print_result(result: Dict[str, Any]) -> None:
+    errors = f", {result['errors']} 个错误" if result["errors"] else ""
+    print(
+        f"{result['test'].upper()}: {result['rps']:.0f} 次/秒 "
+        f"({result['requests']} 次, {result['seconds']:.2f} 秒{errors}) "
+        f"p50={result['p50_ms']:.3f} p95={result['p95_ms']:.3f} "
+        f"p99={result['p99_ms']:.3f} p999={result['p999_ms']:.3f} ms"
+    )
+
+
+async def _run_client(
+    host: str,
+    port: int,
+    test: str,
+    requests: int,
+    pipeline: int,
+    context: Context,
+    latencies: List[float],
+) -> int:
+    """
+    一个连接按流水线深度发送请求，记录每条请求从发送到收到响应的时间，返回错误数量
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    errors = 0
+    try:
+        sent = 0
+        while sent < requests:
+            batch = min(pipeline, requests - sent)
+            commands = [TESTS[test](context) for _ in range(batch)]
+            start = time.perf_counter()
+            writer.write(b"".join(encode_reply(argv) for argv in commands))
+            await writer.drain()
+            for _ in range(batch):
+                try:
+                    await read_reply(reader)
+                except ReplyError:
+                    errors += 1
+                latencies.append(time.perf_counter() - start)
+            sent += batch
+    finally:
+        writer.close()
+        await writer.wait_closed()
+    return errors
+
+
+async def _subscribe(
+    host: str, port: int, received: List[int]
+) -> Tuple[asyncio.StreamWriter, asyncio.Task]:
+    """
+    订阅 publish 测试的频道，在后台读取并丢弃推送的消息，收到的字节数累加到 received[0]。
+    消息不逐条解析，避免测试进程本身成为瓶颈
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(encode_reply(["subscribe", CHANNEL]))
+    await writer.drain()
+    await read_reply(reader)
+
+    async def consume() -> None:
+        try:
+            while True:
+                data = await reader.read(BUFSIZE)
+                if not data:
+                    return
+                received[0] += len(data)
+        except ConnectionError:
+            pass
+
+    return writer, asyncio.create_task(consume())
+
+
+async def _setup_server(host: str, port: int, args: argparse.Namespace) -> str:
+    """
+    预先写入数据，返回 restore 使用的序列化数据
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        commands = _setup_commands(args.keyspace, args.data_size)
+        commands.append(["dump", "bench:str:0"])
+        payload: Any = None
+        for i in range(0, len(commands), SETUP_BATCH):
+            batch = commands[i : i + SETUP_BATCH]
+            writer.write(b"".join(encode_reply(argv) for argv in batch))
+            await writer.drain()
+            for _ in batch:
+                payload = await read_reply(reader)
+        return str(payload)
+    finally:
+        writer.close()
+        await writer.wait_closed()
+
+
+async def run(args: argparse.Namespace, host: str, port: int) -> List[Dict[str, Any]]:
+    """
+    通过网络测试服务器，每项测试由 clients 个连接并发发送
+    """
+    payload = await _setup_server(host, port, args)
+    results = []
+    for test in args.tests:
+        requests = min(args.requests, LIMITED_TESTS.get(test, args.requests))
+        clients = min(args.clients, requests)
+        latencies: List[float] = []
+        contexts = [Context(args.keyspace, args.data_size, i) for i in range(clients)]
+        for context in contexts:
+            context.payload = payload
+        received = [0]
+        subscribers = (
+            await asyncio.gather(
+                *(_subscribe(host, port, received) for _ in range(args.subscribers))
+            )
+            if test == "publish"
+            else []
+        )
+        start = time.perf_counter()
+        errors = await asyncio.gather(
+            *(
+                _run_client(
+                    host,
+                    port,
+                    test,
+                    requests // clients + (i < requests % clients),
+                    args.pipeline,
+                    context,
+                    latencies,
+                )
+                for i, context in enumerate(contexts)
+            )
+        )
+        result = _summarize(test, latencies, time.perf_counter() - start, sum(errors))
+        _print_result(result)
+        results.append(result)
+        if subscribers:
+            # 等待已发布的消息全部送达
+            while True:
+                total = received[0]
+                await asyncio.sleep(SUBSCRIBER_SETTLE_TIME)
+                if received[0] == total:
+                    break
+            for writer, _ in subscribers:
+                writer.close()
+            await asyncio.gather(*(task for _, task in subscribers))
+            message = len(encode_reply(["message", CHANNEL, contexts[0].value]))
+            print(f"{len(subscribers)} 个订阅者共收到 {received[0] // message} 条消息")
+    return results
+
+
+async def run_in_process(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    """
+    不经过网络和指令解析，直接调用 database._types 测试数据结构的性能
+    """
+    await database.connect()
+    try:
+        for argv in _setup_commands(args.keyspace, args.data_size):
+            await IN_PROCESS[argv[0]](argv)
+        payload = await Keys.dump("bench:str:0")
+
+        results = []
+        for test in args.tests:
+            if test not in IN_PROCESS:
+                continue
+            context = Context(args.keyspace, args.data_size, 0)
+            context.payload = str(payload)
+            call = IN_PROCESS[test]
+            latencies: List[float] = []
+            start = time.perf_counter()
+            for _ in range(args.requests):
+                argv = TESTS[test](context)
+                begin = time.perf_counter()
+                await call(argv)
+                latencies.append(time.perf_counter() - begin)
+            result = _summarize(test, latencies, time.perf_counter() - start, 0)
+            _print_result(result)
+            results.append(result)
+        return results
+    finally:
+        await database.close()
+
+
+def run_parse(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    """
+    比较 Alconna 解析指令字符串与按预编译的参数表(fast_commands)绑定参数两种方式下，
+    每项测试的指令参数的解析耗时，不执行指令；无法解析的指令计为错误
+    """
+    parsers: Dict[str, Callable[[str, List[str]], bool]] = {
+        "alconna": lambda name, argv: command_handlers[name][0]
+        .parse(" ".join(argv))
+        .matched,
+        "table": lambda name, argv: _bind_args(fast_commands[name], argv[1:])
+        is not None,
+    }
+    results = []
+    for test in args.tests:
+        for mode, parse in parsers.items():
+            context = Context(args.keyspace, args.data_size, 0)
+            # 只解析参数，任意不含空白的 base64 文本即可
+            context.payload = "eA=="
+            latencies: List[float] = []
+            errors = 0
+            start = time.perf_counter()
+            for _ in range(args.requests):
+                argv = TESTS[test](context)
+                begin = time.perf_counter()
+                matched = parse(argv[0], argv)
+                latencies.append(time.perf_counter() - begin)
+                errors += not matched
+            result = _summarize(
+                f"{test} ({mode})", latencies, time.perf_counter() - start, errors
+            )
+            _print_result(result)
+            results.append(result)
+    return results
+
+
+SQLITE_TESTS = ("set", "get", "rpush")
+"""--sqlite 测试的指令"""
+SQLITE_LIST_SCHEMA = """CREATE TABLE IF NOT EXISTS BENCH_LIST (
+    ID INTEGER PRIMARY KEY AUTOINCREMENT,
+    KEY TEXT NOT NULL,
+    VALUE TEXT NOT NULL,
+    PREV_ID INTEGER,
+    NEXT_ID INTEGER)"""
+"""--sqlite 测试 rpush 使用的链表，与改为内存键空间之前的指针链结构相同"""
+
+SqliteExecute = Callable[[str, Sequence[Any]], Awaitable[Any]]
+"""执行一条 SQL 语句，返回查询结果的第一行"""
+
+
+async def _execute_per_statement(path: Path, query: str, params: Sequence[Any]) -> Any:
+    """
+    使用长连接之前的方式：每条语句打开一个新连接(及其工作线程)，执行后提交并关闭
+    """
+    async with aiosqlite.connect(path) as conn:
+        async with conn.execute(query, params) as cursor:
+            row = await cursor.fetchone()
+        await conn.commit()
+    return row
+
+
+async def _execute_persistent(query: str, params: Sequence[Any]) -> Any:
+    """
+    通过 Database 的长连接执行，写语句执行后提交
+    """
+    if query.startswith("SELECT"):
+        return await database.execute(query, params, fetchone=True)
+    return await database.execute(query, params)
+
+
+async def _sqlite_command(
+    execute: SqliteExecute, test: str, key: str, value: str
+) -> None:
+    """
+    执行存储层直接读写 SQLite 时一条指令对应的语句：set、get 各一条，rpush 四条
+    """
+    if test == "set":
+        await execute(
+            """INSERT INTO STRING (KEY, VALUE) VALUES (?, ?)
+            ON CONFLICT(KEY) DO UPDATE SET VALUE = excluded.VALUE""",
+            (key, value),
+        )
+    elif test == "get":
+        await execute("""SELECT VALUE FROM STRING WHERE KEY = ?""", (key,))
+    else:
+        tail = await execute(
+            """SELECT ID FROM BENCH_LIST WHERE KEY = ? AND NEXT_ID IS NULL""", (key,)
+        )
+        await execute(
+            """INSERT INTO BENCH_LIST (KEY, VALUE, PREV_ID) VALUES (?, ?, ?)""",
+            (key, value, tail[0] if tail else None),
+        )
+        row = await execute(
+            """SELECT ID FROM BENCH_LIST WHERE KEY = ? ORDER BY ID DESC LIMIT 1""",
+            (key,),
+        )
+        if tail:
+            await execute(
+                """UPDATE BENCH_LIST SET NEXT_ID = ? WHERE ID = ?""", (row[0], tail[0])
+            )
+
+
+async def run_sqlite(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    """
+    比较每条语句新建连接与 Database 长连接(WAL、语句缓存)两种方式下，
+    set/get/rpush 对应的 SQL 语句的吞吐量
+    """
+    await database.connect()
+    try:
+        await database.execute(SQLITE_LIST_SCHEMA)
+        modes: Dict[str, SqliteExecute] = {
+            "per-statement": partial(_execute_per_statement, database.DB_PATH),
+            "persistent": _execute_persistent,
+        }
+        results = []
+        for mode, execute in modes.items():
+            for test in SQLITE_TESTS:
+                context = Context(args.keyspace, args.data_size, 0)
+                latencies: List[float] = []
+                start = time.perf_counter()
+                for _ in range(args.requests):
+                    begin = time.perf_counter()
+                    await _sqlite_command(
+                        execute, test, context.key(test), context.value
+                    )
+                    latencies.append(time.perf_counter() - begin)
+                result = _summarize(
+                    f"{test} ({mode})", latencies, time.perf_counter() - start, 0
+                )
+                _print_result(result)
+                results.append(result)
+        return results
+    finally:
+        await database.close()
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(
+    directory: str,
+    workers: Optional[int],
+    request_log: bool = True,
+    options: Optional[Dict[str, Any]] = None,
+) -> Tuple[subprocess.Popen, int]:
+    """
+    在 directory 中以当前配置启动 server.py，监听一个空闲端口，返回进程和端口
+
+    :param options: 覆盖配置文件中的 server 配置项
+    """
+    port = _free_port()
+    config = dict(yaml_config)
+    config["server"] = {
+        **config.get("server", {}),
+        **(options or {}),
+        "host": "127.0.0.1",
+        "port": port,
+    }
+    if workers is not None:
+        config["server"]["workers"] = workers
+    if not request_log:
+        config["log"] = {**config.get("log", {}), "request_sample_rate": 0}
+    with open(os.path.join(directory, "config.yaml"), "w", encoding="utf-8") as f:
+        yaml.safe_dump(config, f, allow_unicode=True)
+
+    process = subprocess.Popen(
+        [sys.executable, str(Path(__file__).resolve().with_name("server.py"))],
+        cwd=directory,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"服务器启动失败，退出码 {process.returncode}")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return process, port
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("等待服务器启动超时")
+
+
+def stop_server(process: subprocess.Popen) -> None:
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(SERVER_START_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+async def _log_requests(
+    log: logging.Logger, requests: int, pipeline: int
+) -> List[float]:
+    """
+    模拟服务器处理请求时记录请求日志，返回每批请求的日志占用事件循环的时间(秒)
+    """
+    blocked: List[float] = []
+    for sent in range(0, requests, pipeline):
+        start = time.perf_counter()
+        for i in range(sent, min(sent + pipeline, requests)):
+            argv = ("set", f"bench:{i}", "x" * 16)
+            log.info("[%s] 收到消息：%s", "127.0.0.1:50000", Joined(argv))
+            log.info("[%s] 发送消息：%s", "127.0.0.1:50000", "1")
+        blocked.append(time.perf_counter() - start)
+        # 让出事件循环，与服务器处理每批请求后等待网络数据相同
+        await asyncio.sleep(0)
+    return blocked
+
+
+def bench_logging(args: argparse.Namespace) -> None:
+    """
+    比较不记录日志、逐条同步写入、写日志线程批量写入三种方式下，
+    请求日志占用事件循环的时间
+    """
+    for mode in ("off", "sync", "async"):
+        with tempfile.TemporaryDirectory() as directory:
+            log = _init_logger(
+                logging.WARNING,  # 只测试写文件，不输出到控制台
+                name=f"bench.{mode}",
+                directory=directory,
+                asynchronous=mode == "async",
+            )
+            if mode == "off":
+                log.setLevel(logging.WARNING)
+            start = time.perf_counter()
+            blocked = asyncio.run(_log_requests(log, args.requests, args.pipeline))
+            elapsed = time.perf_counter() - start
+            shutdown_logger()  # 等待写日志线程写完，避免影响下一项测试
+            written = time.perf_counter() - start
+
+        quantiles = statistics.quantiles(blocked, n=100)
+        print(
+            f"{mode}: 事件循环耗时 {elapsed:.2f} 秒 ({args.requests / elapsed:.0f} 次/秒), "
+            f"每批 p50={quantiles[49] * 1e3:.3f}ms p99={quantiles[98] * 1e3:.3f}ms "
+            f"max={max(blocked) * 1e3:.3f}ms, 全部写入 {written:.2f} 秒"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="基准测试：默认在临时目录中以当前配置启动服务器，依次测试所有指令"
+    )
+    parser.add_argument(
+        "--host",
+        help="连接已运行的服务器而不是启动新的服务器，端口由 --port 指定",
+    )
+    parser.add_argument("--port", type=int, default=server_config.port)
+    parser.add_argument(
+        "--workers", type=int, help="启动的服务器的工作进程数量，默认与配置文件相同"
+    )
+    parser.add_argument(
+        "--no-request-log",
+        action="store_true",
+        help="启动的服务器不记录请求日志(request_sample_rate 为 0)",
+    )
+    parser.add_argument("-c", "--clients", type=int, default=50, help="并发连接数")
+    parser.add_argument(
+        "-n", "--requests", type=int, default=100000, help="每项测试的请求总数"
+    )
+    parser.add_argument(
+        "-P", "--pipeline", type=int, default=1, help="每个连接流水线发送的请求数"
+    )
+    parser.add_argument(
+        "-r", "--keyspace", type=int, default=10000, help="每种类型随机选择的 key 数量"
+    )
+    parser.add_argument(
+        "-d", "--data-size", type=int, default=16, help="值的大小(字节)"
+    )
+    parser.add_argument(
+        "-s",
+        "--subscribers",
+        type=int,
+        default=0,
+        help="publish 测试期间订阅该频道的连接数，用于测试消息扇出",
+    )
+    parser.add_argument(
+        "-t",
+        "--tests",
+        default=",".join(TESTS),
+        help="测试的指令，以逗号分隔，默认为全部指令",
+    )
+    parser.add_argument("--json", help="将结果以 JSON 格式写入文件，- 表示标准输出")
+    parser.add_argument(
+        "--in-process",
+        action="store_true",
+        help="不启动服务器，在进程内直接调用 database._types 测试数据结构",
+    )
+    parser.add_argument(
+        "--sqlite",
+        action="store_true",
+        help="不启动服务器，比较每条语句新建连接与长连接执行 set/get/rpush 对应的 SQL 语句",
+    )
+    parser.add_argument(
+        "--parse",
+        action="store_true",
+        help="不启动服务器，比较 Alconna 与预编译参数表解析各项测试指令参数的耗时",
+    )
+    parser.add_argument(
+        "--logging",
+        action="store_true",
+        help="不连接服务器，测试请求日志占用事件循环的时间(按 -P 的批大小模拟一批请求)",
+    )
+    args = parser.parse_args()
+    if args.logging:
+        bench_logging(args)
+        return
+
+    args.tests = [test.strip().lower() for test in args.tests.split(",")]
+    unknown = [test for test in args.tests if test not in TESTS]
+    if unknown:
+        parser.error(f"未知的测试: {', '.join(unknown)}")
+    untested = set(command_handlers) - set(TESTS)
+    if untested:
+        print(
+            f"警告: 以下指令没有对应的测试: {', '.join(sorted(untested))}",
+            file=sys.stderr,
+        )
+
+    # JSON 输出到标准输出时，逐项结果输出到标准错误
+    output = sys.stderr if args.json == "-" else sys.stdout
+    with tempfile.TemporaryDirectory() as directory, redirect_stdout(output):
+        if args.parse:
+            mode = "parse"
+            results = run_parse(args)
+        elif args.in_process or args.sqlite:
+            # 数据库、AOF、快照等文件使用相对路径，写入临时目录
+            os.chdir(directory)
+            mode = "sqlite" if args.sqlite else "in-process"
+            results = asyncio.run(
+                run_sqlite(args) if args.sqlite else run_in_process(args)
+            )
+        elif args.host:
+            mode = "network"
+            results = asyncio.run(run(args, args.host, args.port))
+        else:
+            mode = "network"
+            process, port = start_server(
+                directory, args.workers, not args.no_request_log
+            )
+            try:
+                results = asyncio.run(run(args, "127.0.0.1", port))
+            finally:
+                stop_server(process)
+
+    if args.json:
+        report = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "mode": mode,
+            "options": {
+                "clients": args.clients,
+                "requests": args.requests,
+                "pipeline": args.pipeline,
+                "keyspace": args.keyspace,
+                "data_size": args.data_size,
+                "workers": args.workers,
+                "request_log": not args.no_request_log,
+            },
+            "results": results,
+        }
+        text = json.dumps(report, ensure_ascii=False, indent=2)
+        if args.json == "-":
+            print(text)
+        else:
+            with open(args.json, "w", encoding="utf-8") as f:
+                f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
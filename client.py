@@ -1,8 +1,10 @@
 import socket
 import time
+from typing import Any, BinaryIO, List, Optional, Sequence, Union
 
 from config import client_config, server_config
-from logger import logger
+from logger import flush_logger, logger
+from protocol import CRLF, ProtocolError, ReplyError, encode_reply
 
 HOST = server_config.host
 PORT = server_config.port
@@ -13,6 +15,8 @@ ADDRESS = f"{HOST}:{PORT}"
 BUFSIZE = 1024
 LOG_FILE = "./logs/client_commands.txt"
 
+Reply = Union[None, str, List[Any]]
+
 
 def send_command(sock: socket.socket, cmd: str) -> str:
     """
@@ -26,6 +30,74 @@ def send_command(sock: socket.socket, cmd: str) -> str:
     return sock.recv(BUFSIZE).decode()
 
 
+def read_reply(f: BinaryIO) -> Reply:
+    """
+    从套接字文件中读取一条完整的 RESP 响应，响应大小不受缓冲区限制
+
+    :raises ReplyError: 服务器返回错误
+    :raises ConnectionError: 连接已关闭
+    """
+    line = f.readline()
+    if not line.endswith(CRLF):
+        raise ConnectionError("连接已关闭")
+    prefix, body = line[:1], line[1:-2]
+    if prefix == b"$":
+        length = int(body)
+        if length < 0:
+            return None
+        data = f.read(length + 2)
+        if len(data) < length + 2:
+            raise ConnectionError("连接已关闭")
+        return data[:-2].decode()
+    if prefix == b"*":
+        items: List[Any] = [read_reply(f) for _ in range(int(body))]
+        return items
+    if prefix in (b"+", b":"):
+        return body.decode()
+    if prefix == b"-":
+        raise ReplyError(body.decode())
+    raise ProtocolError(f"无法识别的响应: {line!r}")
+
+
+class Connection:
+    """
+    到单个服务器的 RESP 长连接，参数可以包含空白字符，可以流水线发送多条指令
+    """
+
+    def __init__(self, host: str = HOST, port: int = PORT) -> None:
+        self.address = f"{host}:{port}"
+        self._sock = socket.create_connection((host, port), HEARTBEAT_INTERVAL)
+        self._file = self._sock.makefile("rb")
+
+    def execute(self, *argv: str) -> Reply:
+        """
+        执行一条指令
+        """
+        return self.pipeline([argv])[0]
+
+    def pipeline(self, commands: Sequence[Sequence[str]]) -> List[Reply]:
+        """
+        一次发送多条指令，按顺序返回各条指令的结果；
+        某条指令出错时仍读取完其余响应，再抛出第一个错误
+        """
+        self._sock.sendall(b"".join(encode_reply(list(argv)) for argv in commands))
+        replies: List[Reply] = []
+        error: Optional[ReplyError] = None
+        for _ in commands:
+            try:
+                replies.append(read_reply(self._file))
+            except ReplyError as e:
+                replies.append(None)
+                error = error or e
+        if error is not None:
+            raise error
+        return replies
+
+    def close(self) -> None:
+        self._file.close()
+        self._sock.close()
+
+
 def connect_socket() -> socket.socket:
     """
     获取 Socket 对象
@@ -37,6 +109,13 @@ def connect_socket() -> socket.socket:
     return s
 
 
+def reconnect_delay(attempt: int) -> int:
+    """
+    第 attempt 次重连前等待的秒数，指数退避，最长 10 秒
+    """
+    return min(10, 2**attempt)
+
+
 def log_command(command: str):
     """
     写命令到文件中
@@ -56,6 +135,7 @@ def run_client():
             attempt = 0
 
             while True:
+                flush_logger()
                 cmd = input(f"{ADDRESS}> ").strip()
 
                 if cmd.lower() in ["exit", "quit"]:
@@ -74,7 +154,7 @@ def run_client():
             return
 
         attempt += 1
-        wait = min(10, 2**attempt)
+        wait = reconnect_delay(attempt)
         logger.info(f"等待 {wait} 秒后重试连接...")
         time.sleep(wait)
 
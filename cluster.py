@@ -0,0 +1,350 @@
+import argparse
+import bisect
+import hashlib
+import queue
+import sys
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Mapping, Optional, Sequence, Tuple
+
+from client import Connection, Reply
+from logger import logger
+
+VIRTUAL_NODES = 160
+"""每个节点在哈希环上的虚拟节点数量，越多 key 分布越均匀"""
+POOL_SIZE = 4
+"""每个节点最多保留的空闲连接数量"""
+REBALANCE_BATCH = 500
+"""迁移时每批流水线发送的 key 数量"""
+SCAN_COUNT = 1000
+"""遍历节点上的 key 时每次 scan 检查的 key 数量"""
+
+KEYLESS_COMMANDS = frozenset(
+    {"ping", "help", "info", "save", "bgsave", "bgrewriteaof", "scan"}
+)
+"""不涉及 key 的指令，需要通过 execute_on 指定节点"""
+SUBCOMMAND_KEY_COMMANDS = frozenset({"object"})
+"""第一个参数为子指令、第二个参数为 key 的指令"""
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+
+def _command_key(argv: Sequence[str]) -> str:
+    if argv[0].lower() in SUBCOMMAND_KEY_COMMANDS and len(argv) > 2:
+        return argv[2]
+    return argv[1]
+
+
+def _parse_node(node: str) -> Tuple[str, int]:
+    host, _, port = node.rpartition(":")
+    return host, int(port)
+
+
+class HashRing:
+    """
+    一致性哈希环
+
+    每个节点在环上放置若干虚拟节点，key 归属于其哈希值顺时针方向的第一个虚拟节点；
+    增加或移除一个节点时只有约 1/N 的 key 改变归属
+    """
+
+    def __init__(self, nodes: Iterable[str] = (), vnodes: int = VIRTUAL_NODES) -> None:
+        self.vnodes = vnodes
+        self.nodes: List[str] = []
+        self._points: List[int] = []
+        """虚拟节点的哈希值，升序排列"""
+        self._owners: List[str] = []
+        """与 _points 一一对应的节点"""
+        for node in nodes:
+            self.add_node(node)
+
+    def add_node(self, node: str) -> None:
+        if node in self.nodes:
+            return
+        self.nodes.append(node)
+        for i in range(self.vnodes):
+            point = _hash(f"{node}#{i}")
+            index = bisect.bisect(self._points, point)
+            self._points.insert(index, point)
+            self._owners.insert(index, node)
+
+    def remove_node(self, node: str) -> None:
+        self.nodes.remove(node)
+        kept = [(p, o) for p, o in zip(self._points, self._owners) if o != node]
+        self._points = [p for p, _ in kept]
+        self._owners = [o for _, o in kept]
+
+    def get_node(self, key: str) -> str:
+        """
+        获取 key 所属的节点
+        """
+        if not self._points:
+            raise ValueError("哈希环中没有节点")
+        index = bisect.bisect(self._points, _hash(key)) % len(self._points)
+        return self._owners[index]
+
+
+class ClusterClient:
+    """
+    多节点客户端：按一致性哈希将 key 路由到所属节点，每个节点维护一个长连接池；
+    mset/mget 及流水线按节点拆分后并行发送
+    """
+
+    def __init__(
+        self,
+        nodes: Iterable[str],
+        pool_size: int = POOL_SIZE,
+        vnodes: int = VIRTUAL_NODES,
+    ) -> None:
+        """
+        :param nodes: 节点地址列表，格式为 host:port
+        """
+        self.ring = HashRing(nodes, vnodes)
+        self.pool_size = pool_size
+        self._pools: Dict[str, "queue.LifoQueue[Connection]"] = defaultdict(
+            lambda: queue.LifoQueue(self.pool_size)
+        )
+        self._executor = ThreadPoolExecutor(max_workers=max(4, len(self.ring.nodes)))
+
+    def add_node(self, node: str) -> None:
+        """
+        增加节点，之后改变归属的 key 需要通过 rebalance 迁移
+        """
+        self.ring.add_node(node)
+
+    def remove_node(self, node: str) -> None:
+        self.ring.remove_node(node)
+        pool = self._pools.pop(node, None)
+        while pool is not None and not pool.empty():
+            pool.get_nowait().close()
+
+    def call(self, node: str, commands: Sequence[Sequence[str]]) -> List[Reply]:
+        """
+        在指定节点上流水线执行多条指令
+
+        取自连接池的连接可能已被服务器关闭，此时换一个新连接重试一次
+        """
+        pool = self._pools[node]
+        try:
+            conn, pooled = pool.get_nowait(), True
+        except queue.Empty:
+            conn, pooled = Connection(*_parse_node(node)), False
+
+        try:
+            replies = conn.pipeline(commands)
+        except (OSError, ConnectionError) as e:
+            conn.close()
+            if not pooled:
+                raise
+            logger.warning(f"与节点 {node} 的连接已失效，重新连接: {e}")
+            conn = Connection(*_parse_node(node))
+            replies = conn.pipeline(commands)
+
+        try:
+            pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+        return replies
+
+    def execute_on(self, node: str, *argv: str) -> Reply:
+        """
+        在指定节点上执行一条指令
+        """
+        return self.call(node, [argv])[0]
+
+    def scan_iter(
+        self, node: str, match: Optional[str] = None, count: int = SCAN_COUNT
+    ) -> Iterator[str]:
+        """
+        用 scan 逐批遍历指定节点上的全部 key
+        """
+        options = ["COUNT", str(count)]
+        if match is not None:
+            options += ["MATCH", match]
+        cursor = "0"
+        while True:
+            reply = self.execute_on(node, "scan", cursor, *options)
+            if not isinstance(reply, list) or len(reply) != 2:
+                raise ValueError(f"scan 执行失败: {reply}")
+            cursor, keys = reply
+            yield from keys or ()
+            if cursor == "0":
+                return
+
+    def execute(self, *argv: str) -> Reply:
+        """
+        执行一条指令，由第一个参数(key)所属的节点执行
+        """
+        name = argv[0].lower()
+        if name == "mget":
+            return self.mget(argv[1:])
+        if name == "mset":
+            if len(argv) % 2 == 0:
+                return "命令参数有误!"
+            return self.mset(dict(zip(argv[1::2], argv[2::2])))
+        if name in KEYLESS_COMMANDS or len(argv) < 2:
+            raise ValueError(f"指令 {name} 不涉及 key，请使用 execute_on 指定节点")
+        return self.call(self.ring.get_node(_command_key(argv)), [argv])[0]
+
+    def pipeline(self, commands: Sequence[Sequence[str]]) -> List[Reply]:
+        """
+        按 key 所属节点拆分多条单 key 指令，各节点并行执行，按原有顺序返回结果
+        """
+        groups: Dict[str, List[int]] = defaultdict(list)
+        for i, argv in enumerate(commands):
+            name = argv[0].lower()
+            if name in KEYLESS_COMMANDS or name in ("mset", "mget") or len(argv) < 2:
+                raise ValueError(f"流水线中只能包含单个 key 的指令: {name}")
+            groups[self.ring.get_node(_command_key(argv))].append(i)
+
+        replies: List[Reply] = [None] * len(commands)
+        for indexes, results in zip(
+            groups.values(),
+            self._executor.map(
+                lambda item: self.call(item[0], [commands[i] for i in item[1]]),
+                groups.items(),
+            ),
+        ):
+            for i, result in zip(indexes, results):
+                replies[i] = result
+        return replies
+
+    def mget(self, keys: Sequence[str]) -> List[Optional[str]]:
+        """
+        获取多个 key 的值，按节点拆分为多条 mget 并行执行
+        """
+        groups: Dict[str, List[int]] = defaultdict(list)
+        for i, key in enumerate(keys):
+            groups[self.ring.get_node(key)].append(i)
+
+        values: List[Optional[str]] = [None] * len(keys)
+        for indexes, (reply,) in zip(
+            groups.values(),
+            self._executor.map(
+                lambda item: self.call(
+                    item[0], [["mget", *(keys[i] for i in item[1])]]
+                ),
+                groups.items(),
+            ),
+        ):
+            if not isinstance(reply, list):
+                raise ValueError(f"mget 执行失败: {reply}")
+            for i, value in zip(indexes, reply):
+                values[i] = value
+        return values
+
+    def mset(self, mapping: Mapping[str, str]) -> str:
+        """
+        存储多个键值对，按节点拆分为多条 mset 并行执行，全部成功时返回 1，否则返回第一个错误
+        """
+        groups: Dict[str, List[str]] = defaultdict(lambda: ["mset"])
+        for key, value in mapping.items():
+            groups[self.ring.get_node(key)] += (key, value)
+
+        for (reply,) in self._executor.map(
+            lambda item: self.call(item[0], [item[1]]),
+            groups.items(),
+        ):
+            if reply != "1":
+                return str(reply)
+        return "1"
+
+    def close(self) -> None:
+        self._executor.shutdown()
+        for pool in self._pools.values():
+            while not pool.empty():
+                pool.get_nowait().close()
+        self._pools.clear()
+
+
+def rebalance(
+    old_nodes: Sequence[str],
+    new_nodes: Sequence[str],
+    keys: Optional[Iterable[str]] = None,
+    batch_size: int = REBALANCE_BATCH,
+    vnodes: int = VIRTUAL_NODES,
+) -> int:
+    """
+    节点变化后，将归属改变的 key 从原节点迁移到新节点，返回迁移的 key 数量
+
+    每批 key 在原节点上流水线执行 dump，在新节点上流水线执行 restore，成功后再从原节点删除；
+    迁移期间写入原节点的数据可能丢失，应在客户端切换到新的节点列表之前、写入较少时执行
+
+    :param keys: 需要检查的 key，不指定时用 scan 遍历各个原节点上的全部 key
+    """
+    old_ring = HashRing(old_nodes, vnodes)
+    new_ring = HashRing(new_nodes, vnodes)
+    client = ClusterClient(set(old_nodes) | set(new_nodes), vnodes=vnodes)
+    batches: Dict[Tuple[str, str], List[str]] = defaultdict(list)
+    moved = 0
+
+    def migrate(source: str, target: str, batch: List[str]) -> int:
+        payloads = client.call(source, [("dump", key) for key in batch])
+        items = [(key, p) for key, p in zip(batch, payloads) if isinstance(p, str)]
+        if not items:
+            return 0
+        results = client.call(target, [("restore", key, p) for key, p in items])
+        for (key, _), result in zip(items, results):
+            if result != "1":
+                raise RuntimeError(f"迁移 {key} 到 {target} 失败: {result}")
+        # expire 0 删除同名的所有类型数据
+        client.call(source, [("expire", key, "0") for key, _ in items])
+        return len(items)
+
+    def scan_old_nodes() -> Iterator[str]:
+        for node in old_nodes:
+            # 其他节点迁入的 key 原本不属于该节点，不再检查
+            yield from (
+                key for key in client.scan_iter(node) if old_ring.get_node(key) == node
+            )
+
+    try:
+        for key in keys if keys is not None else scan_old_nodes():
+            source, target = old_ring.get_node(key), new_ring.get_node(key)
+            if source == target:
+                continue
+            batch = batches[(source, target)]
+            batch.append(key)
+            if len(batch) >= batch_size:
+                moved += migrate(source, target, batch)
+                batch.clear()
+        for (source, target), batch in batches.items():
+            if batch:
+                moved += migrate(source, target, batch)
+    finally:
+        client.close()
+
+    logger.info(f"迁移完成，共迁移 {moved} 个 key")
+    return moved
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="节点变化后迁移归属改变的 key")
+    parser.add_argument(
+        "--old",
+        required=True,
+        help="原节点列表，以逗号分隔，如 127.0.0.1:6001,127.0.0.1:6002",
+    )
+    parser.add_argument("--new", required=True, help="新节点列表，以逗号分隔")
+    parser.add_argument(
+        "--keys",
+        help="每行一个 key 的文件，- 表示从标准输入读取；默认用 scan 遍历原节点上的全部 key",
+    )
+    parser.add_argument(
+        "--batch", type=int, default=REBALANCE_BATCH, help="每批迁移的 key 数量"
+    )
+    args = parser.parse_args()
+
+    if args.keys is None:
+        rebalance(args.old.split(","), args.new.split(","), None, args.batch)
+        return
+    f = open(args.keys, encoding="utf-8") if args.keys != "-" else sys.stdin
+    with f:
+        keys = (line.rstrip("\n") for line in f if line.strip())
+        rebalance(args.old.split(","), args.new.split(","), keys, args.batch)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,56 @@
-from typing import Any
-
-from arclet.alconna import Alconna, Args, CommandMeta, command_manager
+import time
+from inspect import Parameter
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
 
-from database import HashMap, LinkedList, String
+from arclet.alconna import Alconna, Args, CommandMeta, MultiVar, command_manager
+
+from database import (
+    HashMap,
+    Keys,
+    LinkedList,
+    Scan,
+    String,
+    database,
+    keyspace,
+    stats,
+)
 from logger import logger
+from protocol import ErrorReply, IntegerReply
+from pubsub import pubsub
+
+Reply = Union[None, str, List[Any]]
+"""
+指令执行结果：单个字符串，或多个值组成的列表(不存在的值为 None)，不存在时为 None；
+scan 等指令的结果为游标及一个嵌套的列表
+"""
 
 string_set = Alconna(
     "set",
     Args["key", str],
     Args["value", str],
-    meta=CommandMeta(description="存储 key-value 类型数据"),
+    Args["option", str, None],
+    Args["seconds", int, None],
+    meta=CommandMeta(
+        description="存储 key-value 类型数据，set key value EX seconds 可同时设置过期时间"
+    ),
+)
+
+string_setex = Alconna(
+    "setex",
+    Args["key", str],
+    Args["seconds", int],
+    Args["value", str],
+    meta=CommandMeta(description="存储 key-value 类型数据并设置过期时间(秒)"),
 )
 
 string_get = Alconna(
@@ -20,18 +61,32 @@ string_del = Alconna(
     "del", Args["key", str], meta=CommandMeta(description="删除 key 对应的 value")
 )
 
+string_mset = Alconna(
+    "mset",
+    Args["pairs", MultiVar(str)],
+    meta=CommandMeta(
+        description="批量存储 key-value 类型数据：mset key value [key value ...]"
+    ),
+)
+
+string_mget = Alconna(
+    "mget",
+    Args["keys", MultiVar(str)],
+    meta=CommandMeta(description="批量获取多个 key 对应的 value"),
+)
+
 linkedlist_lpush = Alconna(
     "lpush",
     Args["key", str],
-    Args["value", str],
-    meta=CommandMeta(description="可直接放一个数据在左端"),
+    Args["values", MultiVar(str)],
+    meta=CommandMeta(description="可直接放一个或多个数据在左端"),
 )
 
 linkedlist_rpush = Alconna(
     "rpush",
     Args["key", str],
-    Args["value", str],
-    meta=CommandMeta(description="可直接放一个数据在右端"),
+    Args["values", MultiVar(str)],
+    meta=CommandMeta(description="可直接放一个或多个数据在右端"),
 )
 
 linkedlist_range = Alconna(
@@ -39,7 +94,32 @@ linkedlist_range = Alconna(
     Args["key", str],
     Args["start", int],
     Args["end", int],
-    meta=CommandMeta(description="将key 对应 start 到 end 位置的数据全部返回"),
+    meta=CommandMeta(
+        description="将key 对应 start 到 end 位置的数据全部返回，负数表示从右端倒数"
+    ),
+)
+
+linkedlist_lindex = Alconna(
+    "lindex",
+    Args["key", str],
+    Args["index", int],
+    meta=CommandMeta(description="获取key中第index个数据，负数表示从右端倒数"),
+)
+
+linkedlist_lset = Alconna(
+    "lset",
+    Args["key", str],
+    Args["index", int],
+    Args["value", str],
+    meta=CommandMeta(description="替换key中第index个数据，负数表示从右端倒数"),
+)
+
+linkedlist_ltrim = Alconna(
+    "ltrim",
+    Args["key", str],
+    Args["start", int],
+    Args["end", int],
+    meta=CommandMeta(description="只保留key中start到end位置的数据，负数表示从右端倒数"),
 )
 
 linkedlist_len = Alconna(
@@ -68,6 +148,82 @@ help = Alconna(
 
 ping = Alconna("ping", meta=CommandMeta(description="心跳指令，ping响应pong"))
 
+save = Alconna("save", meta=CommandMeta(description="保存快照，保存期间阻塞所有客户端"))
+
+bgsave = Alconna("bgsave", meta=CommandMeta(description="在后台保存快照"))
+
+bgrewriteaof = Alconna(
+    "bgrewriteaof", meta=CommandMeta(description="在后台根据当前数据重写 AOF")
+)
+
+slowlog = Alconna(
+    "slowlog",
+    Args["subcommand", str],
+    Args["count", int, None],
+    meta=CommandMeta(
+        description="慢查询日志：slowlog get [count] 获取最近的记录，slowlog len 获取条数，slowlog reset 清空"
+    ),
+)
+
+latency = Alconna(
+    "latency",
+    Args["command", str, None],
+    meta=CommandMeta(
+        description="获取指令(不指定则为所有指令)及 SQLite 语句的延迟分位数(微秒)，latency reset 清空统计"
+    ),
+)
+
+replicaof = Alconna(
+    "replicaof",
+    Args["host", str],
+    Args["port", str],
+    meta=CommandMeta(
+        description="成为 host:port 的只读副本，replicaof no one 停止复制并成为主节点"
+    ),
+)
+
+info = Alconna(
+    "info",
+    Args["section", str, None],
+    meta=CommandMeta(
+        description="获取服务器运行信息，可指定类别：memory, persistence, replication, "
+        "stats, pubsub, commandstats, latencystats"
+    ),
+)
+
+subscribe = Alconna(
+    "subscribe",
+    Args["channels", MultiVar(str)],
+    meta=CommandMeta(
+        description="订阅频道，连接进入订阅模式，此后只能执行订阅相关的指令及 ping"
+    ),
+)
+
+unsubscribe = Alconna(
+    "unsubscribe",
+    Args["channels", MultiVar(str, "*")],
+    meta=CommandMeta(description="退订频道，不指定频道则退订全部频道"),
+)
+
+psubscribe = Alconna(
+    "psubscribe",
+    Args["patterns", MultiVar(str)],
+    meta=CommandMeta(description="订阅与通配符 pattern 匹配的所有频道"),
+)
+
+punsubscribe = Alconna(
+    "punsubscribe",
+    Args["patterns", MultiVar(str, "*")],
+    meta=CommandMeta(description="退订模式，不指定模式则退订全部模式"),
+)
+
+publish = Alconna(
+    "publish",
+    Args["channel", str],
+    Args["message", str],
+    meta=CommandMeta(description="向频道发布消息，返回收到消息的订阅者数量"),
+)
+
 hash_hset = Alconna(
     "hset",
     Args["key", str],
@@ -83,6 +239,91 @@ hash_hget = Alconna(
     meta=CommandMeta(description="获取key中field字段的value值"),
 )
 
+keys_expire = Alconna(
+    "expire",
+    Args["key", str],
+    Args["seconds", int],
+    meta=CommandMeta(description="为 key 设置过期时间(秒)"),
+)
+
+keys_ttl = Alconna(
+    "ttl",
+    Args["key", str],
+    meta=CommandMeta(
+        description="获取 key 的剩余生存时间(秒)，-1 表示永不过期，-2 表示不存在"
+    ),
+)
+
+keys_persist = Alconna(
+    "persist", Args["key", str], meta=CommandMeta(description="移除 key 的过期时间")
+)
+
+keys_object = Alconna(
+    "object",
+    Args["subcommand", str],
+    Args["key", str],
+    meta=CommandMeta(
+        description="object encoding key 获取 key 的编码(存储方式)：字符串为 raw，链表为 quicklist，"
+        "哈希表为 listpack(整个哈希表一行)或 hashtable(每个字段一行)"
+    ),
+)
+
+keys_dump = Alconna(
+    "dump",
+    Args["key", str],
+    meta=CommandMeta(description="将 key 的所有数据及过期时间序列化为 Base64 文本"),
+)
+
+keys_restore = Alconna(
+    "restore",
+    Args["key", str],
+    Args["payload", str],
+    meta=CommandMeta(description="用 dump 的结果替换 key 的所有数据"),
+)
+
+keys_scan = Alconna(
+    "scan",
+    Args["cursor", str],
+    Args["options", MultiVar(str, "*")],
+    meta=CommandMeta(
+        description="从游标 cursor(首次为 0)开始遍历 key，返回下一个游标(为 0 时遍历完成)及本批的 key："
+        "scan cursor [MATCH pattern] [COUNT count] [TYPE string|list|hash]"
+    ),
+)
+
+hash_hscan = Alconna(
+    "hscan",
+    Args["key", str],
+    Args["cursor", str],
+    Args["options", MultiVar(str, "*")],
+    meta=CommandMeta(
+        description="从游标 cursor(首次为 0)开始遍历哈希表的字段，返回下一个游标及本批的字段和值："
+        "hscan key cursor [MATCH pattern] [COUNT count]"
+    ),
+)
+
+hash_hmset = Alconna(
+    "hmset",
+    Args["key", str],
+    Args["pairs", MultiVar(str)],
+    meta=CommandMeta(
+        description="批量存储key对应的键值对数据：hmset key field value [field value ...]"
+    ),
+)
+
+hash_hmget = Alconna(
+    "hmget",
+    Args["key", str],
+    Args["fields", MultiVar(str)],
+    meta=CommandMeta(description="获取key中多个field字段的value值"),
+)
+
+hash_hgetall = Alconna(
+    "hgetall",
+    Args["key", str],
+    meta=CommandMeta(description="获取key中所有的field字段及其value值"),
+)
+
 hash_hdel = Alconna(
     "hdel",
     Args["key", str],
@@ -92,7 +333,20 @@ hash_hdel = Alconna(
 
 
 async def handle_set(args):
-    return await String.set(args["key"], args["value"])
+    option = args["option"]
+    if option is None:
+        return await String.set(args["key"], args["value"])
+
+    seconds = args["seconds"]
+    if option.lower() != "ex" or seconds is None or seconds <= 0:
+        return ErrorReply("命令参数有误!")
+    return await String.set(args["key"], args["value"], ex=seconds)
+
+
+async def handle_setex(args):
+    if args["seconds"] <= 0:
+        return ErrorReply("命令参数有误!")
+    return await String.set(args["key"], args["value"], ex=args["seconds"])
 
 
 async def handle_get(args):
@@ -103,18 +357,41 @@ async def handle_delete(args):
     return await String.delete(args["key"])
 
 
+async def handle_mset(args):
+    pairs = args["pairs"]
+    if len(pairs) % 2:
+        return ErrorReply("命令参数有误!")
+    return await String.mset(zip(pairs[::2], pairs[1::2]))
+
+
+async def handle_mget(args):
+    return await String.mget(args["keys"])
+
+
 async def handle_lpush(args):
-    return await LinkedList.lpush(args["key"], args["value"])
+    return await LinkedList.lpush(args["key"], *args["values"])
 
 
 async def handle_rpush(args):
-    return await LinkedList.rpush(args["key"], args["value"])
+    return await LinkedList.rpush(args["key"], *args["values"])
 
 
 async def handle_range(args):
     return await LinkedList.range(args["key"], args["start"], args["end"])
 
 
+async def handle_lindex(args):
+    return await LinkedList.lindex(args["key"], args["index"])
+
+
+async def handle_lset(args):
+    return await LinkedList.lset(args["key"], args["index"], args["value"])
+
+
+async def handle_ltrim(args):
+    return await LinkedList.ltrim(args["key"], args["start"], args["end"])
+
+
 async def handle_len(args):
     return await LinkedList.len(args["key"])
 
@@ -139,6 +416,87 @@ async def handle_hget(args):
     return await HashMap.hget(args["key"], args["field"])
 
 
+async def handle_expire(args):
+    return await Keys.expire(args["key"], args["seconds"])
+
+
+async def handle_ttl(args):
+    return await Keys.ttl(args["key"])
+
+
+async def handle_persist(args):
+    return await Keys.persist(args["key"])
+
+
+async def handle_object(args):
+    if args["subcommand"].lower() != "encoding":
+        return ErrorReply(f"未知的子指令: {args['subcommand']}")
+    return await Keys.encoding(args["key"])
+
+
+async def handle_dump(args):
+    return await Keys.dump(args["key"])
+
+
+async def handle_restore(args):
+    return await Keys.restore(args["key"], args["payload"])
+
+
+def _scan_options(
+    options: Sequence[str], names: Sequence[str]
+) -> Optional[Dict[str, str]]:
+    """
+    解析 scan 类指令的 `名称 值` 选项，名称不区分大小写，参数有误时返回 None
+    """
+    if len(options) % 2:
+        return None
+    parsed: Dict[str, str] = {}
+    for name, value in zip(options[::2], options[1::2]):
+        if name.lower() not in names:
+            return None
+        parsed[name.lower()] = value
+    return parsed
+
+
+async def handle_scan(args):
+    options = _scan_options(args["options"], ("match", "count", "type"))
+    if options is None or not options.get("count", "10").isdigit():
+        return ErrorReply("命令参数有误!")
+    return await Scan.scan(
+        args["cursor"],
+        options.get("match"),
+        int(options.get("count", "10")),
+        options.get("type"),
+    )
+
+
+async def handle_hscan(args):
+    options = _scan_options(args["options"], ("match", "count"))
+    if options is None or not options.get("count", "10").isdigit():
+        return ErrorReply("命令参数有误!")
+    return await Scan.hscan(
+        args["key"],
+        args["cursor"],
+        options.get("match"),
+        int(options.get("count", "10")),
+    )
+
+
+async def handle_hmset(args):
+    pairs = args["pairs"]
+    if len(pairs) % 2:
+        return ErrorReply("命令参数有误!")
+    return await HashMap.hmset(args["key"], zip(pairs[::2], pairs[1::2]))
+
+
+async def handle_hmget(args):
+    return await HashMap.hmget(args["key"], args["fields"])
+
+
+async def handle_hgetall(args):
+    return await HashMap.hgetall(args["key"])
+
+
 async def handle_hdel(args):
     return await HashMap.hdel(args["key"], args["field"])
 
@@ -150,6 +508,134 @@ async def handle_ping(args) -> str:
     return "pong"
 
 
+async def handle_subscribe(args) -> str:
+    """
+    订阅相关的指令改变的是连接的状态，由 RESP 连接自身执行，其他情况下不可用
+    """
+    return ErrorReply("订阅指令只能在 RESP 连接中使用!")
+
+
+async def handle_publish(args) -> str:
+    """
+    发布消息，返回收到消息的订阅者数量
+    """
+    return IntegerReply(pubsub.publish(args["channel"], args["message"]))
+
+
+INFO_SECTIONS: Dict[str, Callable[[], Dict[str, object]]] = {
+    "memory": keyspace.memory_info,
+    "persistence": database.persistence_info,
+    "replication": database.replication.info,
+    "stats": stats.info,
+    "pubsub": pubsub.info,
+    "commandstats": stats.command_info,
+    "latencystats": stats.latency_info,
+}
+"""info 指令的信息类别"""
+
+
+async def handle_info(args) -> str:
+    """
+    获取服务器运行信息，每行一个 `名称:值`
+    """
+    section = args["section"]
+    if section is None:
+        sections = list(INFO_SECTIONS)
+    elif section.lower() in INFO_SECTIONS:
+        sections = [section.lower()]
+    else:
+        return ErrorReply(f"未知的信息类别: {section}")
+
+    lines = []
+    for name in sections:
+        lines.append(f"# {name.capitalize()}")
+        lines.extend(f"{key}:{value}" for key, value in INFO_SECTIONS[name]().items())
+    return "\r\n".join(lines)
+
+
+async def handle_save(args) -> str:
+    """
+    保存快照
+    """
+    return database.save()
+
+
+async def handle_bgsave(args) -> str:
+    """
+    后台保存快照
+    """
+    return database.bgsave()
+
+
+async def handle_bgrewriteaof(args) -> str:
+    """
+    后台重写 AOF
+    """
+    if database.aof is None:
+        return ErrorReply("AOF 未开启!")
+    if not database.aof.start_rewrite():
+        return ErrorReply("AOF 重写正在进行中!")
+    return "已开始后台重写 AOF"
+
+
+async def handle_slowlog(args) -> str:
+    """
+    慢查询日志，每条记录一行：编号 开始时间 耗时(微秒) 指令
+    """
+    subcommand = args["subcommand"].lower()
+    if subcommand == "get":
+        count = args["count"] if args["count"] is not None else 10
+        entries = list(stats.slowlog)[: max(count, 0)]
+        if not entries:
+            return "(empty)"
+        return "\r\n".join(
+            f"{entry.id} {entry.timestamp} {entry.duration} {' '.join(entry.argv)}"
+            for entry in entries
+        )
+    if subcommand == "len":
+        return str(len(stats.slowlog))
+    if subcommand == "reset":
+        stats.slowlog.clear()
+        return "1"
+    return ErrorReply(f"未知的子指令: {args['subcommand']}")
+
+
+async def handle_latency(args) -> str:
+    """
+    延迟分位数，每行一个 `名称:p50=..,p99=..,p99.9=..,max=..`
+    """
+    name = args["command"]
+    if name is not None and name.lower() == "reset":
+        stats.reset()
+        return "1"
+    info = stats.latency_info()
+    if name is not None:
+        key = f"latency_percentiles_usec_{name.lower()}"
+        if key not in info:
+            return f"没有指令 {name} 的统计数据"
+        info = {key: info[key]}
+    if not info:
+        return "(empty)"
+    return "\r\n".join(
+        f"{key[len('latency_percentiles_usec_'):]}:{value}"
+        for key, value in info.items()
+    )
+
+
+async def handle_replicaof(args) -> str:
+    """
+    成为副本或停止复制
+    """
+    host, port = args["host"], args["port"]
+    if host.lower() == "no" and port.lower() == "one":
+        database.replication.promote()
+        return "已停止复制，当前为主节点"
+    if not port.isdigit():
+        return ErrorReply("命令参数有误!")
+    database.replication.replicaof(host, int(port))
+    return f"已开始复制主节点 {host}:{port}"
+
+
 async def handle_help_command(args) -> str:
     """
     显示帮助
@@ -159,7 +645,7 @@ async def handle_help_command(args) -> str:
     if command is None:
         return command_manager.all_command_help()
     if command not in command_handlers:
-        return f"未知的指令: {command}"
+        return ErrorReply(f"未知的指令: {command}")
 
     help_info = command_manager.command_help(command)
     return help_info or "帮助信息不存在!"
@@ -167,8 +653,11 @@ async def handle_help_command(args) -> str:
 
 command_handlers: dict[str, tuple[Alconna, Any]] = {
     "set": (string_set, handle_set),
+    "setex": (string_setex, handle_setex),
     "get": (string_get, handle_get),
     "del": (string_del, handle_delete),
+    "mset": (string_mset, handle_mset),
+    "mget": (string_mget, handle_mget),
     "lpush": (linkedlist_lpush, handle_lpush),
     "rpush": (linkedlist_rpush, handle_rpush),
     "range": (linkedlist_range, handle_range),
@@ -176,47 +665,259 @@ command_handlers: dict[str, tuple[Alconna, Any]] = {
     "len": (linkedlist_len, handle_len),
     "lpop": (linkedlist_lpop, handle_lpop),
     "rpop": (linkedlist_rpop, handle_rpop),
+    "lindex": (linkedlist_lindex, handle_lindex),
+    "lset": (linkedlist_lset, handle_lset),
+    "ltrim": (linkedlist_ltrim, handle_ltrim),
     "help": (help, handle_help_command),
     "ping": (ping, handle_ping),
+    "info": (info, handle_info),
+    "save": (save, handle_save),
+    "bgsave": (bgsave, handle_bgsave),
+    "bgrewriteaof": (bgrewriteaof, handle_bgrewriteaof),
+    "replicaof": (replicaof, handle_replicaof),
+    "slowlog": (slowlog, handle_slowlog),
+    "latency": (latency, handle_latency),
+    "subscribe": (subscribe, handle_subscribe),
+    "unsubscribe": (unsubscribe, handle_subscribe),
+    "psubscribe": (psubscribe, handle_subscribe),
+    "punsubscribe": (punsubscribe, handle_subscribe),
+    "publish": (publish, handle_publish),
     "hset": (hash_hset, handle_hset),
     "hget": (hash_hget, handle_hget),
     "hdel": (hash_hdel, handle_hdel),
+    "expire": (keys_expire, handle_expire),
+    "ttl": (keys_ttl, handle_ttl),
+    "persist": (keys_persist, handle_persist),
+    "object": (keys_object, handle_object),
+    "dump": (keys_dump, handle_dump),
+    "restore": (keys_restore, handle_restore),
+    "scan": (keys_scan, handle_scan),
+    "hmset": (hash_hmset, handle_hmset),
+    "hmget": (hash_hmget, handle_hmget),
+    "hgetall": (hash_hgetall, handle_hgetall),
+    "hscan": (hash_hscan, handle_hscan),
 }
 
 
+WRITE_COMMANDS = frozenset(
+    {
+        "set",
+        "setex",
+        "del",
+        "mset",
+        "lpush",
+        "rpush",
+        "lpop",
+        "rpop",
+        "ldel",
+        "lset",
+        "ltrim",
+        "hset",
+        "hdel",
+        "hmset",
+        "expire",
+        "persist",
+        "restore",
+    }
+)
+"""修改数据的指令，副本上只能由主节点同步执行"""
+READONLY_MESSAGE = ErrorReply("只读副本不能执行写指令!")
+
+
+class FastCommand(NamedTuple):
+    """
+    预编译的指令参数表，热路径直接按位置校验参数个数并转换类型，无需经过 Alconna
+    """
+
+    handler: Any
+    names: Tuple[str, ...]
+    """参数名"""
+    converters: Tuple[Callable[[str], Any], ...]
+    """参数类型转换函数"""
+    required: int
+    """必填参数个数"""
+    defaults: Dict[str, Any]
+    """可选参数的默认值"""
+    variadic: bool
+    """最后一个参数是否接收剩余的全部参数(MultiVar)"""
+    variadic_min: int
+    """最后一个参数至少接收的参数个数"""
+
+
+def _compile_command(alconna_class: Alconna, handler: Any) -> FastCommand:
+    arguments = alconna_class.args.argument
+    defaults = {
+        arg.name: arg.field.default
+        for arg in arguments
+        if arg.field.default is not Parameter.empty
+    }
+    return FastCommand(
+        handler=handler,
+        names=tuple(arg.name for arg in arguments),
+        converters=tuple(int if arg.value.origin is int else str for arg in arguments),
+        required=len(arguments) - len(defaults),
+        defaults=defaults,
+        variadic=bool(arguments) and isinstance(arguments[-1].value, MultiVar),
+        variadic_min=(
+            0
+            if arguments
+            and isinstance(arguments[-1].value, MultiVar)
+            and arguments[-1].value.flag == "*"
+            else 1
+        ),
+    )
+
+
+fast_commands: Dict[str, FastCommand] = {
+    name: _compile_command(alconna_class, handler)
+    for name, (alconna_class, handler) in command_handlers.items()
+}
+
+
+def _bind_args(command: FastCommand, tokens: Sequence[str]) -> Optional[Dict[str, Any]]:
+    """
+    按预编译的参数表绑定参数，参数有误时返回 None
+    """
+    if command.variadic:
+        # 剩余参数全部归入最后一个参数
+        fixed = len(command.names) - 1
+        if len(tokens) < fixed + command.variadic_min:
+            return None
+        try:
+            args = {
+                name: convert(token)
+                for name, convert, token in zip(
+                    command.names, command.converters, tokens[:fixed]
+                )
+            }
+            convert = command.converters[-1]
+            args[command.names[-1]] = tuple(convert(token) for token in tokens[fixed:])
+        except ValueError:
+            return None
+        return args
+
+    if not command.required <= len(tokens) <= len(command.names):
+        return None
+
+    try:
+        args = {
+            name: convert(token)
+            for name, convert, token in zip(command.names, command.converters, tokens)
+        }
+    except ValueError:
+        return None
+
+    if len(tokens) < len(command.names):
+        for name in command.names[len(tokens) :]:
+            args[name] = command.defaults[name]
+    return args
+
+
+async def _call(
+    command: FastCommand, name: str, argv: Sequence[str], args: Any
+) -> Reply:
+    """
+    执行指令并记录调用次数、延迟及慢查询
+    """
+    start = time.perf_counter()
+    try:
+        result = await command.handler(args)
+    except Exception:
+        stats.record_command(name, argv, start, error=True)
+        raise
+    stats.record_command(name, argv, start)
+    return result
+
+
+def text_reply(result: Reply) -> str:
+    """
+    将多个值的执行结果转换为以空格分隔的文本，供纯文本模式使用
+    """
+    if isinstance(result, str):
+        return result
+    if result is None:
+        return "(nil)"
+    if not result:
+        return "(empty)"
+    return " ".join(
+        (
+            value
+            if isinstance(value, str)
+            else text_reply(value) if value is not None else "(nil)"
+        )
+        for value in result
+    )
+
+
 async def parse_command_string(command_str: str) -> str:
     """
     解析指令字符串并返回执行结果
     """
     # 提取指令名和参数
-    parts = command_str.split(maxsplit=1)
+    parts = command_str.split()
     if not parts:
-        msg = "无效的指令!"
+        msg = ErrorReply("无效的指令!")
         logger.error(msg)
         return msg
 
     command_name = parts[0]
-    # raw_command_arg = parts[1]
 
-    # 使用 Alconna 解析器解析命令和参数
-    command_handler = command_handlers.get(command_name)
-    if command_handler is None:
-        msg = f"未知的指令: {command_name}"
+    command = fast_commands.get(command_name)
+    if command is None:
+        msg = ErrorReply(f"未知的指令: {command_name}")
         logger.error(msg)
         return msg
+    if command_name in WRITE_COMMANDS and database.replication.is_replica:
+        stats.record_error(command_name)
+        return READONLY_MESSAGE
+
+    # 不含引号的指令直接按空白切分后走快速路径
+    if "'" not in command_str and '"' not in command_str:
+        if len(parts) > 1 and parts[1] in ["-h", "--help"]:
+            help_info = command_manager.command_help(command_name)
+            return help_info or "帮助信息不存在!"
+
+        args = _bind_args(command, parts[1:])
+        if args is not None:
+            return text_reply(await _call(command, command_name, parts, args))
+
+    # 带引号的参数及参数有误的指令交给 Alconna 解析
+    alconna_class = command_handlers[command_name][0]
+    arparma = alconna_class.parse(command_str)
+
+    if not arparma.matched:
+        stats.record_error(command_name)
+        msg = ErrorReply("命令参数有误!")
+        logger.warning(msg)
+        return msg
+
+    return text_reply(await _call(command, command_name, parts, arparma))
 
-    alconna_class = command_handler[0]
-    handler = command_handler[1]
 
-    args = alconna_class.parse(command_str)
+async def execute_command(argv: List[str]) -> Reply:
+    """
+    执行已经切分好参数的指令(RESP 协议)，参数中可以包含空白字符
+    """
+    command_name = argv[0].lower()
+
+    command = fast_commands.get(command_name)
+    if command is None:
+        msg = ErrorReply(f"未知的指令: {command_name}")
+        logger.error(msg)
+        return msg
+    if command_name in WRITE_COMMANDS and database.replication.is_replica:
+        stats.record_error(command_name)
+        return READONLY_MESSAGE
 
-    if len(parts) > 1 and parts[1] in ["-h", "--help"]:
+    if len(argv) > 1 and argv[1] in ["-h", "--help"]:
         help_info = command_manager.command_help(command_name)
         return help_info or "帮助信息不存在!"
 
-    if not args.matched:
-        msg = "命令参数有误!"
+    args = _bind_args(command, argv[1:])
+    if args is None:
+        stats.record_error(command_name)
+        msg = ErrorReply("命令参数有误!")
         logger.warning(msg)
         return msg
 
-    return await handler(args)
+    return await _call(command, command_name, argv, args)
@@ -1,8 +1,13 @@
+from typing import Dict, Literal, Optional
+
 import yaml as yaml_
 from pydantic import BaseModel
 
 CONFIG_PATH = "./config.yaml"
 
+MaxmemoryPolicy = Literal["allkeys-lru", "allkeys-lfu", "volatile-ttl", "noeviction"]
+AppendFsync = Literal["always", "everysec", "no"]
+
 
 class ServerConfig(BaseModel):
     host: str = "127.0.0.1"
@@ -11,9 +16,81 @@ class ServerConfig(BaseModel):
     """服务器服务端口"""
     backlog: int = 5
     """服务器最大连接数量"""
+    workers: int = 1
+    """工作进程数量，大于 1 时按 key 的哈希值分片，每个进程保存一个分片"""
+    ipc_dir: str = "./ipc"
+    """多进程模式下分片之间转发指令使用的 Unix 套接字所在目录"""
 
     db_path: str = "./database.db"
     """数据库文件路径"""
+    flush_interval: float = 1.0
+    """内存脏数据写回数据库的间隔(秒)"""
+    list_chunk_size: int = 128
+    """链表在数据库中每行最多保存的元素个数，修改后下次启动时整体重写链表数据"""
+    hash_max_listpack_entries: int = 128
+    """字段数不超过该值的哈希表以紧凑编码(整个哈希表一行)保存"""
+    hash_max_listpack_value: int = 64
+    """字段名和值的长度均不超过该值的哈希表以紧凑编码保存"""
+    compression: str = "zlib"
+    """数据库中大值使用的压缩算法，none 表示不压缩"""
+    compression_threshold: int = 1024
+    """UTF-8 编码后不小于该长度(字节)的字符串、链表元素及哈希表字段值压缩后保存"""
+    compression_level: int = 1
+    """压缩级别，越大压缩率越高、速度越慢(zlib 为 1~9)"""
+
+    maxmemory: int = 0
+    """数据占用内存的上限(字节)，0 表示不限制"""
+    maxmemory_policy: MaxmemoryPolicy = "noeviction"
+    """达到内存上限时的淘汰策略"""
+    maxmemory_samples: int = 5
+    """每次淘汰时随机抽样的键数量，越大越接近精确的 LRU/LFU"""
+
+    appendonly: bool = False
+    """是否开启 AOF 持久化"""
+    appendfilename: str = "./appendonly.aof"
+    """AOF 文件路径"""
+    appendfsync: AppendFsync = "everysec"
+    """AOF 落盘策略"""
+    auto_aof_rewrite_percentage: int = 100
+    """AOF 大小超过上次重写后大小的百分之多少时自动重写，0 表示不自动重写"""
+    auto_aof_rewrite_min_size: int = 64 * 1024 * 1024
+    """自动重写的最小 AOF 大小(字节)"""
+
+    snapshot_path: str = "./dump.snapshot"
+    """快照文件路径"""
+    snapshot_on_shutdown: bool = True
+    """关闭服务器时是否保存快照，下次启动时直接从快照载入数据"""
+
+    replicaof: Optional[str] = None
+    """启动时作为副本复制的主节点地址(host:port)，为空时作为主节点"""
+    repl_backlog_size: int = 1024 * 1024
+    """复制积压缓冲区大小(字节)，副本断线期间的写命令不超过该大小时可以部分同步"""
+
+    slowlog_log_slower_than: int = 10000
+    """执行时间超过多少微秒的指令记入慢查询日志，0 表示记录所有指令，负数表示不记录"""
+    slowlog_max_len: int = 128
+    """慢查询日志最多保留的条数"""
+    metrics_port: int = 0
+    """Prometheus 指标(HTTP GET /metrics)的服务端口，0 表示不开启；多进程模式下第 i 个工作进程使用 metrics_port + i"""
+    pubsub_output_buffer_limit: int = 32 * 1024 * 1024
+    """订阅连接发送缓冲区的上限(字节)，消费过慢的订阅者超过该上限时被断开，0 表示不限制"""
+
+
+class LogConfig(BaseModel):
+    level: str = "INFO"
+    """控制台日志等级(日志文件记录全部等级)"""
+    dir: str = "./logs"
+    """日志文件所在目录"""
+    max_bytes: int = 100 * 1024 * 1024
+    """单个日志文件超过该大小(字节)时轮转，0 表示只按日期轮转"""
+    backup_count: int = 30
+    """最多保留的历史日志文件数量(不含正在写入的文件)，0 表示全部保留"""
+    async_write: bool = True
+    """是否由后台线程格式化并批量写入日志，关闭后在事件循环中逐条写入"""
+    request_sample_rate: float = 1.0
+    """请求日志(收到消息/发送消息)的采样率，0 表示不记录"""
+    request_sample_rates: Dict[str, float] = {}
+    """按指令设置的请求日志采样率，未设置的指令使用 request_sample_rate"""
 
 
 class ClientConfig(BaseModel):
@@ -28,3 +105,4 @@ with open(CONFIG_PATH, "r", encoding="utf-8") as f:
 
 server_config = ServerConfig(**yaml_config.get("server", {}))
 client_config = ClientConfig(**yaml_config.get("client", {}))
+log_config = LogConfig(**yaml_config.get("log", {}))
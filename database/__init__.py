@@ -1,4 +1,17 @@
+from ._keyspace import keyspace
+from ._scan import Scan, compile_pattern
 from ._sqlite import database
-from ._types import HashMap, LinkedList, String
+from ._stats import stats
+from ._types import HashMap, Keys, LinkedList, String
 
-__all__ = ["database", "String", "LinkedList", "HashMap"]
+__all__ = [
+    "database",
+    "keyspace",
+    "stats",
+    "String",
+    "LinkedList",
+    "HashMap",
+    "Keys",
+    "Scan",
+    "compile_pattern",
+]
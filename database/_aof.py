@@ -0,0 +1,331 @@
+import asyncio
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+from config import AppendFsync
+from protocol import BUFSIZE, ProtocolError, RespParser, encode_reply
+
+from ._keyspace import keyspace
+from ._types import HashMap, Keys, LinkedList, String
+
+logger = logging.getLogger(__name__)
+
+REWRITE_BATCH = 512
+"""重写时每条 rpush/hmset 命令最多携带的元素数量"""
+REWRITE_CHUNK = 1 << 20
+"""重写时累积多少字节后写入一次临时文件并让出事件循环"""
+
+
+async def _replay_expireat(key: str, when: str) -> None:
+    if keyspace.exists(key):
+        keyspace.set_expire(key, float(when))
+
+
+async def _replay_remove(key: str) -> None:
+    keyspace.remove(key)
+
+
+REPLAY_COMMANDS: Dict[str, Callable[..., Awaitable[object]]] = {
+    "set": String.set,
+    "del": String.delete,
+    "rpush": LinkedList.rpush,
+    "lpush": LinkedList.lpush,
+    "lpop": LinkedList.lpop,
+    "rpop": LinkedList.rpop,
+    "ldel": LinkedList.ldel,
+    "lset": lambda key, index, value: LinkedList.lset(key, int(index), value),
+    "ltrim": lambda key, start, end: LinkedList.ltrim(key, int(start), int(end)),
+    "hset": HashMap.hset,
+    "hmset": lambda key, *pairs: HashMap.hmset(key, zip(pairs[::2], pairs[1::2])),
+    "hdel": HashMap.hdel,
+    "expireat": _replay_expireat,
+    "persist": Keys.persist,
+    "remove": _replay_remove,
+}
+"""AOF 中的写命令及其重放方法"""
+
+
+def _write_all(fd: int, data: bytes) -> None:
+    with memoryview(data) as view:
+        while view:
+            view = view[os.write(fd, view) :]
+
+
+class AppendOnlyFile:
+    """
+    追加写命令日志(AOF)
+
+    写命令由键空间记录，每批命令执行完后合并为一次 write 写入文件；
+    appendfsync 为 always 时，同一时刻等待落盘的所有客户端共享一次 fsync(组提交)
+    """
+
+    def __init__(
+        self,
+        path: str,
+        appendfsync: AppendFsync = "everysec",
+        rewrite_percentage: int = 100,
+        rewrite_min_size: int = 64 << 20,
+    ) -> None:
+        self.path = Path(path)
+        self.appendfsync = appendfsync
+        self.rewrite_percentage = rewrite_percentage
+        """文件大小超过上次重写后大小的百分之多少时自动重写，0 表示不自动重写"""
+        self.rewrite_min_size = rewrite_min_size
+        """自动重写的最小文件大小(字节)"""
+
+        self._fd: Optional[int] = None
+        self._written = 0
+        """累计写入的字节数，重写后不清零"""
+        self._synced = 0
+        """累计确认落盘的字节数，与 _written 比较判断是否需要 fsync"""
+        self._size = 0
+        """当前文件大小"""
+        self._base_size = 0
+        """上次重写(或载入)后的文件大小"""
+        self._sync_task: Optional[asyncio.Future] = None
+        """进行中的 fsync，等待落盘的协程共享同一次 fsync"""
+
+        self._rewrite_task: Optional[asyncio.Task] = None
+        self._rewrite_pending: Optional[Set[str]] = None
+        """重写期间尚未写入新文件的键，这些键的新命令无需追加到重写缓冲区"""
+        self._rewrite_buffer: List[bytes] = []
+        """重写期间产生的、需要追加到新文件末尾的命令"""
+
+    @property
+    def rewriting(self) -> bool:
+        return self._rewrite_task is not None
+
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    async def load(self) -> int:
+        """
+        流式读取并重放 AOF，返回重放的命令数量；已过期的 key 由调用方在重放完成后删除
+        """
+        parser = RespParser()
+        count = 0
+        keyspace.loading = True
+        try:
+            with open(self.path, "rb") as f:
+                while data := f.read(BUFSIZE):
+                    parser.feed(data)
+                    while (argv := parser.get_command()) is not None:
+                        replay = REPLAY_COMMANDS.get(argv[0])
+                        if replay is None:
+                            raise ProtocolError(f"AOF 中存在未知的命令: {argv[0]}")
+                        await replay(*argv[1:])
+                        count += 1
+        finally:
+            keyspace.loading = False
+
+        size = self.path.stat().st_size
+        if parser.offset < size:
+            # 写入中途宕机留下的不完整命令
+            logger.warning(
+                f"AOF 末尾存在 {size - parser.offset} 字节不完整的命令，已截断"
+            )
+            os.truncate(self.path, parser.offset)
+        return count
+
+    def open(self) -> None:
+        """
+        以追加模式打开 AOF
+        """
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._size = self._base_size = os.fstat(self._fd).st_size
+        keyspace.add_sink(self._append)
+
+    async def close(self) -> None:
+        """
+        停止重写，写入并落盘剩余的命令后关闭文件
+        """
+        if self._rewrite_task is not None:
+            self._rewrite_task.cancel()
+            try:
+                await self._rewrite_task
+            except asyncio.CancelledError:
+                pass
+        if self._fd is None:
+            return
+
+        self.write_pending()
+        if self._sync_task is not None:
+            await self._sync_task
+        os.fsync(self._fd)
+        os.close(self._fd)
+        self._fd = None
+        keyspace.remove_sink(self._append)
+
+    @staticmethod
+    def write_pending() -> None:
+        """
+        将键空间中记录的写命令一次性写入文件
+        """
+        keyspace.flush_propagated()
+
+    def _append(self, records: List[Tuple[str, ...]], data: bytes) -> None:
+        if self._fd is None:
+            return
+        _write_all(self._fd, data)
+        self._written += len(data)
+        self._size += len(data)
+
+        pending = self._rewrite_pending
+        if pending is not None:
+            # 尚未写入新文件的键，其最新状态会在重写时一并写入
+            self._rewrite_buffer.extend(
+                encode_reply(argv) for argv in records if argv[1] not in pending
+            )
+
+    async def commit(self) -> None:
+        """
+        写入本批命令，appendfsync 为 always 时等待其落盘
+        """
+        self.write_pending()
+        if self.appendfsync != "always":
+            return
+
+        target = self._written
+        while self._synced < target:
+            if self._sync_task is None:
+                self._sync_task = asyncio.ensure_future(self._fsync())
+            await asyncio.shield(self._sync_task)
+
+    async def _fsync(self) -> None:
+        """
+        在线程池中执行 fsync，不阻塞事件循环
+        """
+        written, fd = self._written, self._fd
+        try:
+            if fd is not None:
+                await asyncio.get_running_loop().run_in_executor(None, os.fsync, fd)
+            self._synced = max(self._synced, written)
+        finally:
+            self._sync_task = None
+
+    async def cron(self) -> None:
+        """
+        每秒执行一次：写入后台任务(过期、淘汰)产生的命令，everysec 策略下落盘，
+        并在文件增长过多时自动重写
+        """
+        self.write_pending()
+        if (
+            self.appendfsync == "everysec"
+            and self._synced < self._written
+            and self._sync_task is None
+        ):
+            self._sync_task = asyncio.ensure_future(self._fsync())
+
+        if (
+            self.rewrite_percentage
+            and not self.rewriting
+            and self._size >= self.rewrite_min_size
+            and self._size >= self._base_size * (100 + self.rewrite_percentage) // 100
+        ):
+            logger.info(f"AOF 大小已达到 {self._size} 字节，开始自动重写")
+            self.start_rewrite()
+
+    def start_rewrite(self) -> bool:
+        """
+        开始后台重写，已有重写在进行时返回 False
+        """
+        if self.rewriting:
+            return False
+        self._rewrite_task = asyncio.create_task(self.rewrite())
+        return True
+
+    async def rewrite(self) -> None:
+        """
+        根据内存中的当前数据生成最小的命令集合，替换原有的 AOF
+
+        逐个键生成命令并分块写入临时文件，期间让出事件循环，客户端不会被阻塞。
+        重写期间的新命令照常写入原文件，其中已写入新文件的键的命令另存一份，
+        重写完成后追加到新文件末尾
+        """
+        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        tmp_path = self.path.with_name(f"{self.path.name}.rewrite")
+        keys = list(
+            keyspace.strings.keys() | keyspace.lists.keys() | keyspace.hashes.keys()
+        )
+        self.write_pending()
+        pending = self._rewrite_pending = set(keys)
+        self._rewrite_buffer = []
+
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            chunk: List[bytes] = []
+            size = 0
+            for key in keys:
+                pending.discard(key)
+                for argv in self._dump_key(key):
+                    data = encode_reply(argv)
+                    chunk.append(data)
+                    size += len(data)
+                if size >= REWRITE_CHUNK:
+                    await loop.run_in_executor(None, _write_all, fd, b"".join(chunk))
+                    chunk, size = [], 0
+
+            # 先在后台写入重写期间积累的命令，缩短最后一步的同步写入
+            chunk.extend(self._rewrite_buffer)
+            self._rewrite_buffer = []
+            await loop.run_in_executor(None, _write_all, fd, b"".join(chunk))
+            await loop.run_in_executor(None, os.fsync, fd)
+            if self._sync_task is not None:
+                await asyncio.shield(self._sync_task)
+
+            # 以下不再让出事件循环，保证没有命令遗漏
+            self.write_pending()
+            _write_all(fd, b"".join(self._rewrite_buffer))
+            os.fsync(fd)
+            os.replace(tmp_path, self.path)
+            if self._fd is not None:
+                os.close(self._fd)
+            self._fd = fd
+            os.lseek(fd, 0, os.SEEK_END)
+            fd = -1
+            # 新文件已经落盘，等待中的 always 客户端无需再次 fsync
+            self._synced = self._written
+            self._size = self._base_size = os.fstat(self._fd).st_size
+        except BaseException:
+            if fd != -1:
+                os.close(fd)
+                tmp_path.unlink(missing_ok=True)
+            raise
+        finally:
+            self._rewrite_pending = None
+            self._rewrite_buffer = []
+            self._rewrite_task = None
+
+        logger.info(
+            f"AOF 重写完成：{len(keys)} 个键，{self._size} 字节，"
+            f"耗时 {time.perf_counter() - start:.3f} 秒"
+        )
+
+    @staticmethod
+    def _dump_key(key: str) -> Iterator[Tuple[str, ...]]:
+        """
+        生成重建 key 当前数据所需的命令
+        """
+        value = keyspace.strings.get(key)
+        if value is not None:
+            yield ("set", key, value)
+
+        items = keyspace.lists.get(key)
+        if items:
+            values = list(items)
+            for i in range(0, len(values), REWRITE_BATCH):
+                yield ("rpush", key, *values[i : i + REWRITE_BATCH])
+
+        fields = keyspace.hashes.get(key)
+        if fields:
+            pairs = [item for pair in fields.items() for item in pair]
+            for i in range(0, len(pairs), 2 * REWRITE_BATCH):
+                yield ("hmset", key, *pairs[i : i + 2 * REWRITE_BATCH])
+
+        when = keyspace.expires.get(key)
+        if when is not None:
+            yield ("expireat", key, repr(when))
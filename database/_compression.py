@@ -0,0 +1,87 @@
+import logging
+import zlib
+from typing import Callable, Dict, NamedTuple, Optional
+
+from config import server_config
+
+logger = logging.getLogger(__name__)
+
+COMPRESSION = server_config.compression
+"""数据库中大值使用的压缩算法"""
+COMPRESSION_THRESHOLD = server_config.compression_threshold
+"""编码后不小于该长度(字节)的值才尝试压缩"""
+COMPRESSION_LEVEL = server_config.compression_level
+"""压缩级别"""
+
+
+class Codec(NamedTuple):
+    """
+    压缩算法。tag 写在每个压缩值的第一个字节，解压时据此选择算法，
+    因此修改 compression 配置后已经写入的值仍可读取
+    """
+
+    tag: int
+    name: str
+    compress: Callable[[bytes, int], bytes]
+    """(数据, 压缩级别) -> 压缩数据"""
+    decompress: Callable[[bytes], bytes]
+
+
+CODECS: Dict[int, Codec] = {}
+"""已注册的压缩算法，按 tag 索引"""
+
+
+def register_codec(codec: Codec) -> None:
+    """
+    注册一种压缩算法，tag 取值 1~255 且一经写入数据库就不能再改变含义
+    """
+    if not 0 < codec.tag < 256:
+        raise ValueError(f"压缩算法 {codec.name} 的标记 {codec.tag} 超出范围")
+    existing = CODECS.get(codec.tag)
+    if existing is not None and existing.name != codec.name:
+        raise ValueError(f"压缩算法 {codec.name} 的标记与 {existing.name} 重复")
+    CODECS[codec.tag] = codec
+
+
+register_codec(Codec(1, "zlib", zlib.compress, zlib.decompress))
+
+_codec: Optional[Codec] = None
+"""写入时使用的压缩算法，由 init_codec 按配置选择"""
+
+
+def init_codec() -> None:
+    """
+    按配置项 compression 选择写入时使用的压缩算法，为 none 时不压缩。
+    需在注册完其他压缩算法之后、写入数据之前调用
+    """
+    global _codec
+    _codec = None
+    if COMPRESSION == "none":
+        return
+    for codec in CODECS.values():
+        if codec.name == COMPRESSION:
+            _codec = codec
+            return
+    logger.warning(f"未知的压缩算法 {COMPRESSION}，不压缩数据")
+
+
+def compress(data: bytes) -> Optional[bytes]:
+    """
+    压缩一个值，返回以算法标记开头的压缩数据；未超过阈值或压缩后没有变小时返回 None
+    """
+    if len(data) < COMPRESSION_THRESHOLD or _codec is None:
+        return None
+    compressed = _codec.compress(data, COMPRESSION_LEVEL)
+    if len(compressed) + 1 >= len(data):
+        return None
+    return bytes((_codec.tag,)) + compressed
+
+
+def decompress(data: bytes) -> bytes:
+    """
+    解压 compress 返回的数据
+    """
+    codec = CODECS.get(data[0])
+    if codec is None:
+        raise ValueError(f"未知的压缩算法标记 {data[0]}")
+    return codec.decompress(data[1:])
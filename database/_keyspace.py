@@ -0,0 +1,772 @@
+import random
+import time
+from collections import deque
+from heapq import heapify, heappop, heappush
+from itertools import islice
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from config import MaxmemoryPolicy, server_config
+from protocol import encode_reply
+
+ListChunks = List[Tuple[int, int, List[str]]]
+"""(块编号, 块中第一个元素的位置, 块中的元素)"""
+PropagateSink = Callable[[List[Tuple[str, ...]], bytes], None]
+"""写命令的接收方，参数为一批写命令及其 RESP 编码"""
+StringSnapshot = Dict[str, Optional[str]]
+ListSnapshot = Dict[str, Optional[Tuple[int, int, ListChunks]]]
+HashSnapshot = Tuple[
+    Set[str], Dict[str, Dict[str, Optional[str]]], Dict[str, Dict[str, str]]
+]
+"""(整体删除的哈希表, 每个字段一行的哈希表中发生变化的字段, 紧凑编码的哈希表的全部字段)"""
+ExpireSnapshot = Dict[str, Optional[float]]
+
+KEY_OVERHEAD = 96
+"""每个键的固定内存开销估算值(字节)，包括字典条目、键对象及元数据"""
+ITEM_OVERHEAD = 56
+"""每个字符串值、链表元素、哈希字段的固定内存开销估算值(字节)"""
+
+LIST_CHUNK_SIZE = max(1, server_config.list_chunk_size)
+"""链表每个块(数据库中的一行)最多保存的元素个数"""
+HASH_MAX_LISTPACK_ENTRIES = server_config.hash_max_listpack_entries
+"""紧凑编码的哈希表最多包含的字段数"""
+HASH_MAX_LISTPACK_VALUE = server_config.hash_max_listpack_value
+"""紧凑编码的哈希表中字段名和值的最大长度"""
+
+LFU_INIT_VAL = 5
+"""新键的 LFU 计数初始值，避免刚写入的键立即被淘汰"""
+LFU_LOG_FACTOR = 10
+"""LFU 对数计数器的增长因子，越大计数增长越慢"""
+LFU_DECAY_TIME = 1
+"""LFU 计数每隔多少分钟未被访问减 1"""
+
+
+def item_size(value: str) -> int:
+    """
+    估算一个字符串值或链表元素占用的内存
+    """
+    return len(value) + ITEM_OVERHEAD
+
+
+def field_size(field: str, value: str) -> int:
+    """
+    估算一个哈希字段占用的内存
+    """
+    return len(field) + len(value) + 2 * ITEM_OVERHEAD
+
+
+def _lfu_minutes() -> int:
+    return int(time.monotonic() // 60)
+
+
+def _lfu_decay(access: int, now: int) -> int:
+    """
+    返回按未访问时长衰减后的 LFU 计数
+    """
+    counter = access & 0xFF
+    periods = (now - (access >> 8)) // LFU_DECAY_TIME
+    return max(0, counter - periods)
+
+
+def _lfu_increment(counter: int) -> int:
+    """
+    Morris 对数计数器：计数越大，每次访问使其加 1 的概率越小，8 位即可表示百万级访问次数
+    """
+    if counter >= 255:
+        return counter
+    base = max(0, counter - LFU_INIT_VAL)
+    if random.random() < 1.0 / (base * LFU_LOG_FACTOR + 1):
+        counter += 1
+    return counter
+
+
+def scan_slots(items: List[str], cursor: int, count: int) -> Tuple[int, List[str]]:
+    """
+    从后向前增量遍历删除时用末尾元素填补空位的列表，返回下一个游标和本批的元素
+
+    游标为尚未遍历的前端部分的长度，0 表示从头开始，返回 0 表示遍历完成。
+    删除只会把末尾的元素移到更靠前的位置，尚未遍历的元素不会被移到已遍历的部分，
+    因此遍历开始前已存在且期间未被删除的元素一定会被返回(可能重复返回)
+    """
+    end = min(cursor, len(items)) if cursor else len(items)
+    start = max(0, end - count)
+    return start, items[start:end]
+
+
+class SlotList:
+    """
+    元素集合：元素保存在列表中并记录各自的下标，删除时将末尾的元素移到被删除元素的位置，
+    增删都是 O(1)，可以用 scan_slots 增量遍历
+    """
+
+    __slots__ = ("items", "slots")
+
+    def __init__(self, items: Iterable[str] = ()) -> None:
+        self.items: List[str] = []
+        self.slots: Dict[str, int] = {}
+        """元素 -> 在 items 中的下标"""
+        for item in items:
+            self.add(item)
+
+    def add(self, item: str) -> None:
+        if item not in self.slots:
+            self.slots[item] = len(self.items)
+            self.items.append(item)
+
+    def discard(self, item: str) -> None:
+        slot = self.slots.pop(item, None)
+        if slot is None:
+            return
+        last = self.items.pop()
+        if last != item:
+            self.items[slot] = last
+            self.slots[last] = slot
+
+
+class DirtySnapshot(NamedTuple):
+    """
+    一次写回所需的脏数据快照，值为 None 表示该键已被删除
+    """
+
+    strings: StringSnapshot
+    lists: ListSnapshot
+    hashes: HashSnapshot
+    expires: ExpireSnapshot
+
+
+class KeyMeta:
+    """
+    键的元数据，用于内存统计和淘汰
+    """
+
+    __slots__ = ("slot", "size", "access")
+
+    def __init__(self, slot: int, size: int, access: int) -> None:
+        self.slot = slot
+        """键在抽样列表中的下标"""
+        self.size = size
+        """键占用内存的估算值(字节)"""
+        self.access = access
+        """LRU 策略下为最近访问时刻(毫秒)；LFU 策略下高位为最近访问的分钟数，低 8 位为对数访问计数"""
+
+
+class ListValue(deque):
+    """
+    链表在内存中的表示
+
+    每个元素都有一个有符号的位置编号：lpush 向负方向增长，rpush 向正方向增长。
+    持久化时位置为 p 的元素保存在编号为 p // LIST_CHUNK_SIZE 的块中，每个块是数据库中的一行，
+    只需写回自上次写回以来发生变化的块；push/pop 只改变两端的块
+    """
+
+    def __init__(self, items: Iterable[str] = (), head: int = 0) -> None:
+        super().__init__(items)
+        self.head = head
+        """第一个元素的位置"""
+        self.dirty_chunks: Set[int] = set()
+        """上次写回后发生变化的块编号"""
+        self.all_dirty = False
+        """是否需要整体写回"""
+
+    @property
+    def tail(self) -> int:
+        """
+        最后一个元素的位置
+        """
+        return self.head + len(self) - 1
+
+    def push_left(self, value: str) -> None:
+        """
+        在左端放入一个数据
+        """
+        self.appendleft(value)
+        self.head -= 1
+        self.dirty_chunks.add(self.head // LIST_CHUNK_SIZE)
+
+    def push_right(self, value: str) -> None:
+        """
+        在右端放入一个数据
+        """
+        self.append(value)
+        self.dirty_chunks.add(self.tail // LIST_CHUNK_SIZE)
+
+    def pop_left(self) -> str:
+        """
+        取出并删除左端的数据
+        """
+        self.dirty_chunks.add(self.head // LIST_CHUNK_SIZE)
+        value = self.popleft()
+        self.head += 1
+        return value
+
+    def pop_right(self) -> str:
+        """
+        取出并删除右端的数据
+        """
+        self.dirty_chunks.add(self.tail // LIST_CHUNK_SIZE)
+        return self.pop()
+
+    def replace(self, index: int, value: str) -> str:
+        """
+        替换第 index 个(0 <= index < len)数据，返回原来的数据
+        """
+        old = self[index]
+        self[index] = value
+        self.dirty_chunks.add((self.head + index) // LIST_CHUNK_SIZE)
+        return old
+
+    def trim(self, start: int, end: int) -> List[str]:
+        """
+        只保留第 start 到 end 个(0 <= start <= end < len)数据，返回被删除的数据
+        """
+        removed = [self.popleft() for _ in range(start)]
+        if start:
+            self.head += start
+            self.dirty_chunks.add(self.head // LIST_CHUNK_SIZE)
+        right = len(self) - (end - start + 1)
+        if right:
+            removed.extend(self.pop() for _ in range(right))
+            self.dirty_chunks.add(self.tail // LIST_CHUNK_SIZE)
+        return removed
+
+    def slice(self, start: int, stop: int) -> List[str]:
+        """
+        第 start 到 stop - 1 个(0 <= start <= stop <= len)数据，从离得较近的一端开始遍历
+        """
+        if start <= len(self) - stop:
+            return list(islice(self, start, stop))
+        items = list(islice(reversed(self), len(self) - stop, len(self) - start))
+        items.reverse()
+        return items
+
+    def mark_all_dirty(self) -> None:
+        """
+        将整个链表标记为需要写回
+        """
+        self.all_dirty = True
+
+    def take_dirty(self) -> Tuple[int, int, ListChunks]:
+        """
+        取出需要写回的块及当前首尾块的编号，并重置脏标记
+        """
+        head, tail = self.head, self.tail
+        first, last = head // LIST_CHUNK_SIZE, tail // LIST_CHUNK_SIZE
+        if self.all_dirty:
+            chunks: Iterable[int] = range(first, last + 1)
+        else:
+            # 已经弹出的块不在首尾块之间，写回时整行删除
+            chunks = sorted(c for c in self.dirty_chunks if first <= c <= last)
+        self.dirty_chunks = set()
+        self.all_dirty = False
+
+        rows: ListChunks = []
+        for chunk in chunks:
+            start = max(chunk * LIST_CHUNK_SIZE, head)
+            end = min((chunk + 1) * LIST_CHUNK_SIZE - 1, tail)
+            rows.append((chunk, start, self.slice(start - head, end - head + 1)))
+        return first, last, rows
+
+
+class Keyspace:
+    """
+    内存键空间，保存全部数据的权威副本
+
+    所有读写都只访问内存，修改过的键会被记录为脏键，由持久层定期批量写回 SQLite
+    """
+
+    def __init__(
+        self,
+        maxmemory: int = 0,
+        maxmemory_policy: MaxmemoryPolicy = "noeviction",
+        maxmemory_samples: int = 5,
+    ) -> None:
+        self.maxmemory = maxmemory
+        """内存上限(字节)，0 表示不限制"""
+        self.maxmemory_policy = maxmemory_policy
+        """达到内存上限时的淘汰策略"""
+        self.maxmemory_samples = maxmemory_samples
+        """每次淘汰时随机抽样的键数量"""
+
+        self.strings: Dict[str, str] = {}
+        """字符串类型数据"""
+        self.lists: Dict[str, ListValue] = {}
+        """双向链表类型数据"""
+        self.hashes: Dict[str, Dict[str, str]] = {}
+        """哈希类型数据"""
+        self.hashtable_hashes: Set[str] = set()
+        """超出紧凑编码阈值、每个字段保存为一行的哈希表，其余哈希表整个保存为一行"""
+        self.hash_slots: Dict[str, SlotList] = {}
+        """每个字段一行的哈希表的全部字段，用于 hscan 增量遍历；紧凑编码的哈希表较小，一次返回全部字段"""
+        self.expires: Dict[str, float] = {}
+        """设置了过期时间的键及其过期时刻(Unix 时间戳)"""
+        self._expire_heap: List[Tuple[float, str]] = []
+        """按过期时刻排序的最小堆，主动过期时无需遍历全部键；条目失效后延迟删除"""
+        self.meta: Dict[str, KeyMeta] = {}
+        """键的内存占用及访问信息"""
+        self._sample_keys: List[str] = []
+        """所有键组成的列表，用于 O(1) 随机抽样及 scan 增量遍历"""
+
+        self.used_memory = 0
+        """全部键占用内存的估算值(字节)"""
+        self.evicted_keys = 0
+        """因内存上限被淘汰的键数量"""
+        self.expired_keys = 0
+        """因过期被删除的键数量"""
+        self.keyspace_hits = 0
+        """读取时命中的次数"""
+        self.keyspace_misses = 0
+        """读取时未命中的次数"""
+
+        self.loading = False
+        """是否正在重放 AOF 或主节点同步的写命令：重放的命令执行时 key 尚未过期，此时不惰性删除，
+        也不检查内存上限，AOF 载入完成后再删除过期的 key、按淘汰策略释放内存"""
+        self.replica = False
+        """本节点是否为副本：过期的 key 只对读取隐藏，等待主节点同步删除，也不检查内存上限，
+        避免与主节点不一致"""
+
+        self.propagating = False
+        """是否记录写命令，存在接收方(AOF、副本)时为 True"""
+        self.propagated: List[Tuple[str, ...]] = []
+        """尚未交给接收方的写命令"""
+        self._sinks: List[PropagateSink] = []
+
+        self.dirty_strings: Set[str] = set()
+        """待写回的字符串键"""
+        self.dirty_lists: Set[str] = set()
+        """待写回的双向链表键"""
+        self.dirty_hashes: Dict[str, Set[str]] = {}
+        """待写回的哈希键及其发生变化的字段"""
+        self.cleared_hashes: Set[str] = set()
+        """上次写回后被整体删除过的哈希键"""
+        self.dirty_expires: Set[str] = set()
+        """待写回过期时间的键"""
+
+    def propagate(self, *argv: str) -> None:
+        """
+        记录一条已经生效的写命令，第一个参数之后紧跟 key。
+
+        命令记录的是执行效果而非原始命令：相对过期时间会被换算为过期时刻，
+        过期和淘汰删除的键也会记录为 remove，重放时结果与执行时一致
+        """
+        if self.propagating:
+            self.propagated.append(argv)
+
+    def add_sink(self, sink: PropagateSink) -> None:
+        self._sinks.append(sink)
+        self.propagating = True
+
+    def remove_sink(self, sink: PropagateSink) -> None:
+        self._sinks.remove(sink)
+        self.propagating = bool(self._sinks)
+
+    def flush_propagated(self) -> None:
+        """
+        将记录的写命令编码一次，交给所有接收方
+        """
+        records = self.propagated
+        if not records:
+            return
+        self.propagated = []
+        data = b"".join(encode_reply(argv) for argv in records)
+        for sink in self._sinks:
+            sink(records, data)
+
+    def get_list(self, key: str) -> ListValue:
+        """
+        获取 key 对应的链表，不存在则创建
+        """
+        items = self.lists.get(key)
+        if items is None:
+            items = self.lists[key] = ListValue()
+        return items
+
+    def has_dirty(self) -> bool:
+        """
+        是否存在待写回的脏键
+        """
+        return bool(
+            self.dirty_strings
+            or self.dirty_lists
+            or self.dirty_hashes
+            or self.cleared_hashes
+            or self.dirty_expires
+        )
+
+    def exists(self, key: str) -> bool:
+        """
+        是否有任意类型的数据使用了 key
+        """
+        return key in self.strings or key in self.lists or key in self.hashes
+
+    def remove(self, key: str) -> None:
+        """
+        删除 key 对应的所有类型的数据及其过期时间
+        """
+        if self.strings.pop(key, None) is not None:
+            self.dirty_strings.add(key)
+        if self.lists.pop(key, None) is not None:
+            self.dirty_lists.add(key)
+        if self.hashes.pop(key, None) is not None:
+            self.mark_hash_cleared(key)
+        self.persist(key)
+        if key in self.meta:
+            self._drop_meta(key)
+            self.propagate("remove", key)
+
+    def set_expire(self, key: str, when: float) -> None:
+        """
+        设置 key 的过期时刻
+        """
+        self.expires[key] = when
+        heappush(self._expire_heap, (when, key))
+        self.dirty_expires.add(key)
+
+    def persist(self, key: str) -> bool:
+        """
+        移除 key 的过期时间，返回 key 此前是否设置了过期时间
+        """
+        if self.expires.pop(key, None) is None:
+            return False
+        self.dirty_expires.add(key)
+        return True
+
+    def forget(self, key: str) -> None:
+        """
+        key 上的数据被全部删除后移除其过期时间及元数据，避免之后新建的同名 key 继承过期时间
+        """
+        if not self.exists(key):
+            self.persist(key)
+            self._drop_meta(key)
+
+    def touch(self, key: str, read: bool = False) -> bool:
+        """
+        访问 key 前调用：惰性删除已过期的 key，并记录访问信息
+
+        :param read: 是否为读取操作，读取操作计入命中率统计
+        :return: key 是否可见；副本上已过期但尚未被主节点删除的 key 不可见，调用方应视为不存在
+        """
+        when = self.expires.get(key)
+        visible = True
+        if when is not None and when <= time.time() and not self.loading:
+            if self.replica:
+                visible = False
+            else:
+                self.remove(key)
+                self.expired_keys += 1
+
+        meta = self.meta.get(key) if visible else None
+        if meta is not None:
+            meta.access = self._access(meta.access)
+        if read:
+            if meta is not None:
+                self.keyspace_hits += 1
+            else:
+                self.keyspace_misses += 1
+        return visible
+
+    def grow(self, key: str, size: int) -> None:
+        """
+        记录 key 占用内存的变化量，key 尚无元数据时创建
+        """
+        meta = self.meta.get(key)
+        if meta is None:
+            meta = self.meta[key] = KeyMeta(
+                len(self._sample_keys), len(key) + KEY_OVERHEAD, self._access(None)
+            )
+            self._sample_keys.append(key)
+            self.used_memory += meta.size
+        meta.size += size
+        self.used_memory += size
+
+    def rebuild_meta(self) -> None:
+        """
+        根据全部数据重新估算每个键的内存占用，在载入数据后调用
+        """
+        self.meta = {}
+        self._sample_keys = []
+        self.used_memory = 0
+        for key, value in self.strings.items():
+            self.grow(key, item_size(value))
+        for key, items in self.lists.items():
+            self.grow(
+                key, sum(len(value) for value in items) + len(items) * ITEM_OVERHEAD
+            )
+        for key, fields in self.hashes.items():
+            self.grow(
+                key, sum(field_size(field, value) for field, value in fields.items())
+            )
+
+    def reserve(self) -> bool:
+        """
+        写入前检查内存上限，超出时按淘汰策略删除键
+
+        :return: 能否继续写入，noeviction 策略或没有可淘汰的键时返回 False
+        """
+        if self.loading or self.replica:
+            # 重放的命令在写入 AOF 时已经通过检查，必须全部执行，载入完成后再统一检查；
+            # 副本不按自身的内存上限淘汰键，与主节点保持一致
+            return True
+        while self.maxmemory and self.used_memory > self.maxmemory:
+            key = self._eviction_candidate()
+            if key is None:
+                return False
+            self.remove(key)
+            self.evicted_keys += 1
+        return True
+
+    def _eviction_candidate(self) -> Optional[str]:
+        """
+        按淘汰策略选出一个待淘汰的键
+
+        LRU/LFU 策略从随机抽样的若干个键中选出最久未访问/访问频率最低的键，
+        volatile-ttl 策略直接取过期时间堆的堆顶，均无需遍历全部键
+        """
+        policy = self.maxmemory_policy
+        if policy == "volatile-ttl":
+            heap = self._expire_heap
+            while heap:
+                when, key = heap[0]
+                if self.expires.get(key) == when:
+                    return key
+                heappop(heap)
+            return None
+
+        keys = self._sample_keys
+        if policy == "noeviction" or not keys:
+            return None
+
+        candidates = [
+            keys[random.randrange(len(keys))] for _ in range(self.maxmemory_samples)
+        ]
+        if policy == "allkeys-lfu":
+            now = _lfu_minutes()
+            return min(candidates, key=lambda k: _lfu_decay(self.meta[k].access, now))
+        return min(candidates, key=lambda k: self.meta[k].access)
+
+    def _access(self, access: Optional[int]) -> int:
+        """
+        返回一次访问后的访问信息
+        """
+        if self.maxmemory_policy != "allkeys-lfu":
+            return int(time.monotonic() * 1000)
+
+        now = _lfu_minutes()
+        counter = LFU_INIT_VAL if access is None else _lfu_decay(access, now)
+        return now << 8 | _lfu_increment(counter)
+
+    def _drop_meta(self, key: str) -> None:
+        """
+        删除 key 的元数据，将抽样列表末尾的键移到其位置上
+        """
+        meta = self.meta.pop(key, None)
+        if meta is None:
+            return
+        self.used_memory -= meta.size
+
+        last = self._sample_keys.pop()
+        if last != key:
+            self._sample_keys[meta.slot] = last
+            self.meta[last].slot = meta.slot
+
+    def scan(self, cursor: int, count: int) -> Tuple[int, List[str]]:
+        """
+        增量遍历所有键(包括已过期、尚未删除的键)，返回下一个游标和本批的键
+        """
+        return scan_slots(self._sample_keys, cursor, count)
+
+    def memory_info(self) -> Dict[str, object]:
+        """
+        内存使用及淘汰统计信息
+        """
+        lookups = self.keyspace_hits + self.keyspace_misses
+        return {
+            "used_memory": self.used_memory,
+            "maxmemory": self.maxmemory,
+            "maxmemory_policy": self.maxmemory_policy,
+            "keys": len(self.meta),
+            "expires": len(self.expires),
+            "evicted_keys": self.evicted_keys,
+            "expired_keys": self.expired_keys,
+            "keyspace_hits": self.keyspace_hits,
+            "keyspace_misses": self.keyspace_misses,
+            "hit_ratio": f"{self.keyspace_hits / lookups:.4f}" if lookups else "0",
+        }
+
+    def expire_cycle(self, budget: float) -> bool:
+        """
+        主动删除已过期的键，最多占用 budget 秒
+
+        :return: 是否因为时间片用完而提前结束
+        """
+        now = time.time()
+        deadline = time.perf_counter() + budget
+        heap = self._expire_heap
+        removed = 0
+
+        while heap and heap[0][0] <= now:
+            when, key = heappop(heap)
+            if self.expires.get(key) != when:
+                continue  # 过期时间已被修改或移除
+            self.remove(key)
+            self.expired_keys += 1
+            removed += 1
+            if removed % 64 == 0 and time.perf_counter() > deadline:
+                return True
+
+        # 失效条目过多时重建堆，限制内存占用
+        if len(heap) > 2 * len(self.expires) + 1024:
+            self.rebuild_expire_index()
+        return False
+
+    def rebuild_expire_index(self) -> None:
+        """
+        根据 expires 重建按过期时刻排序的堆
+        """
+        self._expire_heap = [(when, key) for key, when in self.expires.items()]
+        heapify(self._expire_heap)
+
+    def mark_hash_field(self, key: str, field: str) -> None:
+        """
+        标记哈希表中发生变化(写入或删除)的字段
+        """
+        fields = self.dirty_hashes.get(key)
+        if fields is None:
+            fields = self.dirty_hashes[key] = set()
+        fields.add(field)
+
+        slots = self.hash_slots.get(key)
+        if slots is not None:
+            if field in self.hashes.get(key, ()):
+                slots.add(field)
+            else:
+                slots.discard(field)
+
+    def mark_hash_cleared(self, key: str) -> None:
+        """
+        标记整体删除的哈希表，写回时先删除其全部字段
+        """
+        self.cleared_hashes.add(key)
+        self.dirty_hashes.pop(key, None)
+        self.hashtable_hashes.discard(key)
+        self.hash_slots.pop(key, None)
+
+    def hash_encoding(self, key: str) -> str:
+        """
+        哈希表的编码：listpack(整个哈希表一行)或 hashtable(每个字段一行)
+        """
+        return "hashtable" if key in self.hashtable_hashes else "listpack"
+
+    def check_hash_encoding(self, key: str, field: str, value: str) -> None:
+        """
+        写入字段后调用：紧凑编码的哈希表超出阈值时转换为每个字段一行。
+        与 Redis 相同，转换后即使字段减少也不再转换回紧凑编码
+        """
+        if key in self.hashtable_hashes:
+            return
+        if (
+            len(self.hashes[key]) > HASH_MAX_LISTPACK_ENTRIES
+            or len(field) > HASH_MAX_LISTPACK_VALUE
+            or len(value) > HASH_MAX_LISTPACK_VALUE
+        ):
+            self.hashtable_hashes.add(key)
+            self.hash_slots[key] = SlotList(self.hashes[key])
+            self.rewrite_hash(key)
+
+    def rebuild_hash_encodings(self) -> None:
+        """
+        按阈值重新确定每个哈希表的编码，在载入数据后调用
+        """
+        self.hashtable_hashes = {
+            key
+            for key, fields in self.hashes.items()
+            if len(fields) > HASH_MAX_LISTPACK_ENTRIES
+            or any(
+                len(field) > HASH_MAX_LISTPACK_VALUE
+                or len(value) > HASH_MAX_LISTPACK_VALUE
+                for field, value in fields.items()
+            )
+        }
+        self.hash_slots = {
+            key: SlotList(self.hashes[key]) for key in self.hashtable_hashes
+        }
+
+    def rewrite_hash(self, key: str) -> None:
+        """
+        编码改变后，写回时删除哈希表原有的数据行并按新的编码整体写入
+        """
+        self.cleared_hashes.add(key)
+        self.dirty_hashes[key] = set(self.hashes[key])
+
+    def mark_all_dirty(self) -> None:
+        """
+        将全部数据标记为需要写回
+        """
+        self.dirty_strings = set(self.strings)
+        self.dirty_lists = set(self.lists)
+        for items in self.lists.values():
+            items.mark_all_dirty()
+        self.dirty_hashes = {key: set(fields) for key, fields in self.hashes.items()}
+        self.cleared_hashes = set()
+        self.dirty_expires = set(self.expires)
+
+    def take_dirty(self) -> DirtySnapshot:
+        """
+        取出所有脏键当前值的快照并清空脏键集合，值为 None 表示该键已被删除
+
+        快照在同一个同步调用中生成，写回期间的新修改会重新标记为脏键
+        """
+        strings: StringSnapshot = {
+            key: self.strings.get(key) for key in self.dirty_strings
+        }
+        lists: ListSnapshot = {}
+        for key in self.dirty_lists:
+            items = self.lists.get(key)
+            lists[key] = items.take_dirty() if items else None
+        hash_fields: Dict[str, Dict[str, Optional[str]]] = {}
+        packed_hashes: Dict[str, Dict[str, str]] = {}
+        for key, dirty_fields in self.dirty_hashes.items():
+            fields = self.hashes.get(key, {})
+            if key in self.hashtable_hashes:
+                hash_fields[key] = {field: fields.get(field) for field in dirty_fields}
+            elif fields:
+                # 紧凑编码的哈希表任意字段变化时整体写回
+                packed_hashes[key] = dict(fields)
+        hashes: HashSnapshot = (self.cleared_hashes, hash_fields, packed_hashes)
+        expires: ExpireSnapshot = {
+            key: self.expires.get(key) for key in self.dirty_expires
+        }
+
+        self.dirty_strings = set()
+        self.dirty_lists = set()
+        self.dirty_hashes = {}
+        self.cleared_hashes = set()
+        self.dirty_expires = set()
+        return DirtySnapshot(strings, lists, hashes, expires)
+
+    def restore_dirty(self, snapshot: DirtySnapshot) -> None:
+        """
+        写回失败时重新标记脏键，等待下一次写回
+        """
+        self.dirty_strings.update(snapshot.strings)
+        self.dirty_lists.update(snapshot.lists)
+        self.dirty_expires.update(snapshot.expires)
+
+        cleared, hash_fields, packed_hashes = snapshot.hashes
+        self.cleared_hashes.update(cleared)
+        for key, fields in hash_fields.items():
+            for field in fields:
+                self.mark_hash_field(key, field)
+        for key in packed_hashes:
+            self.dirty_hashes.setdefault(key, set())
+
+        # 写回失败的链表变化范围已无法还原，整体重新写回
+        for key in snapshot.lists:
+            items = self.lists.get(key)
+            if items is not None:
+                items.mark_all_dirty()
+
+
+keyspace = Keyspace(
+    server_config.maxmemory,
+    server_config.maxmemory_policy,
+    server_config.maxmemory_samples,
+)
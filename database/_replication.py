@@ -0,0 +1,404 @@
+import asyncio
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from protocol import (
+    BUFSIZE,
+    CRLF,
+    ProtocolError,
+    RespParser,
+    RespReader,
+    encode_reply,
+)
+
+from ._aof import REPLAY_COMMANDS
+from ._keyspace import keyspace
+from ._snapshot import Snapshot
+
+logger = logging.getLogger(__name__)
+
+REPLICA_BUFFER_LIMIT = 64 << 20
+"""副本的发送缓冲区(含全量同步期间积累的命令)超过多少字节时断开该副本"""
+SYNC_CHUNK = 1 << 20
+"""全量同步时每次发送/接收的快照数据大小"""
+ACK_INTERVAL = 1.0
+"""副本向主节点报告复制偏移量的间隔(秒)"""
+RECONNECT_DELAY_MAX = 5
+"""副本重连主节点的最长等待时间(秒)"""
+
+
+def _new_replid() -> str:
+    return os.urandom(20).hex()
+
+
+class _Replica:
+    """
+    主节点上的一个副本连接
+    """
+
+    def __init__(self, writer: asyncio.StreamWriter, address: str) -> None:
+        self.writer = writer
+        self.address = address
+        self.ack_offset = 0
+        """副本最近报告的复制偏移量"""
+        self.ack_time = time.time()
+        self.pending: Optional[List[bytes]] = []
+        """全量同步期间积累的写命令，同步完成后为 None"""
+        self.pending_size = 0
+
+    def send(self, data: bytes) -> bool:
+        """
+        发送写命令，缓冲区过大时返回 False
+        """
+        if self.pending is not None:
+            self.pending.append(data)
+            self.pending_size += len(data)
+            return self.pending_size <= REPLICA_BUFFER_LIMIT
+        self.writer.write(data)
+        return self.writer.transport.get_write_buffer_size() <= REPLICA_BUFFER_LIMIT
+
+    def start_streaming(self) -> None:
+        """
+        全量同步完成，发送同步期间积累的写命令，之后直接发送
+        """
+        assert self.pending is not None
+        self.writer.write(b"".join(self.pending))
+        self.pending = None
+
+
+class Replication:
+    """
+    主从复制
+
+    主节点将写命令(与 AOF 相同的执行效果)追加到复制积压缓冲区并发送给所有副本，
+    复制偏移量为累计产生的命令字节数。副本首次连接时从 fork 出的快照全量同步，
+    之后持续接收写命令；断线重连时若主节点的积压缓冲区仍包含副本缺少的部分，只补发这部分
+    """
+
+    def __init__(
+        self,
+        snapshot: Snapshot,
+        load_snapshot: Callable[[Path], Awaitable[None]],
+        backlog_size: int = 1 << 20,
+    ) -> None:
+        """
+        :param snapshot: 用于全量同步时生成快照
+        :param load_snapshot: 副本收到全量同步的快照后，用其替换全部数据
+        """
+        self.snapshot = snapshot
+        self._load_snapshot = load_snapshot
+        self.backlog_size = backlog_size
+
+        self.replid = _new_replid()
+        """复制 ID，副本保存主节点的复制 ID"""
+        self.offset = 0
+        """复制偏移量，主节点为累计产生的命令字节数，副本为已经执行的命令字节数"""
+        self._backlog: Optional[bytearray] = None
+        """复制积压缓冲区，第一个副本连接后创建"""
+        self._backlog_offset = 0
+        """积压缓冲区第一个字节的复制偏移量"""
+        self._replicas: List[_Replica] = []
+
+        self.master: Optional[Tuple[str, int]] = None
+        """主节点地址，不为 None 时本节点为副本"""
+        self.link_up = False
+        """副本与主节点的连接是否正常"""
+        self._link_task: Optional[asyncio.Task] = None
+
+    @property
+    def is_replica(self) -> bool:
+        return self.master is not None
+
+    # ---------------------------------------------------------------- 主节点
+
+    def _feed(self, records: List[Tuple[str, ...]], data: bytes) -> None:
+        """
+        写命令的接收方：追加到积压缓冲区并发送给所有副本
+        """
+        if self.is_replica or self._backlog is None:
+            return
+        self.offset += len(data)
+        backlog = self._backlog
+        backlog += data
+        if len(backlog) > self.backlog_size:
+            overflow = len(backlog) - self.backlog_size
+            del backlog[:overflow]
+            self._backlog_offset += overflow
+
+        for replica in list(self._replicas):
+            if not replica.send(data):
+                logger.warning(f"副本 {replica.address} 的发送缓冲区过大，断开连接")
+                self._drop_replica(replica)
+
+    def _drop_replica(self, replica: _Replica) -> None:
+        if replica in self._replicas:
+            self._replicas.remove(replica)
+            replica.writer.close()
+
+    async def serve_replica(
+        self,
+        reader: RespReader,
+        writer: asyncio.StreamWriter,
+        argv: List[str],
+        address: str,
+    ) -> None:
+        """
+        处理副本发送的 psync <replid> <offset>，之后该连接只用于向副本发送写命令
+
+        复制 ID 一致且积压缓冲区包含副本缺少的全部数据时部分同步(+CONTINUE)，
+        否则全量同步(+FULLRESYNC <replid> <offset>，随后发送快照)
+        """
+        if self.is_replica:
+            writer.write(b"-ERR replica cannot serve psync\r\n")
+            await writer.drain()
+            return
+        try:
+            replid, offset = argv[1], int(argv[2])
+        except (IndexError, ValueError):
+            writer.write(b"-ERR invalid psync arguments\r\n")
+            await writer.drain()
+            return
+
+        if self._backlog is None:
+            self._backlog = bytearray()
+            self._backlog_offset = self.offset
+            keyspace.add_sink(self._feed)
+
+        replica = _Replica(writer, address)
+        keyspace.flush_propagated()
+        if replid == self.replid and self._backlog_offset <= offset <= self.offset:
+            writer.write(b"+CONTINUE %b\r\n" % self.replid.encode())
+            writer.write(bytes(self._backlog[offset - self._backlog_offset :]))
+            replica.pending = None
+            replica.ack_offset = offset
+            self._replicas.append(replica)
+            logger.info(f"副本 {address} 部分同步，补发 {self.offset - offset} 字节")
+        elif not await self._full_sync(replica):
+            writer.close()
+            return
+
+        try:
+            while (commands := await reader.read_commands()) is not None:
+                for command in commands:
+                    if command[:2] == ["replconf", "ack"] and len(command) == 3:
+                        replica.ack_offset = int(command[2])
+                        replica.ack_time = time.time()
+        except (ProtocolError, ValueError, OSError) as e:
+            logger.warning(f"副本 {address} 连接出错: {e}")
+        finally:
+            self._drop_replica(replica)
+            logger.info(f"副本 {address} 已断开")
+
+    async def _full_sync(self, replica: _Replica) -> bool:
+        """
+        全量同步：fork 出子进程写入快照并发送，期间产生的写命令暂存在副本的缓冲区中
+        """
+        start = time.perf_counter()
+        path = self.snapshot.path.with_name(
+            f"{self.snapshot.path.name}.sync-{os.getpid()}-{id(replica)}"
+        )
+        offset = self.offset
+        # 快照取得数据之前不能让出事件循环，保证快照恰好对应 offset
+        self._replicas.append(replica)
+        try:
+            if not await self.snapshot.write_in_background(path):
+                self._drop_replica(replica)
+                return False
+            if replica not in self._replicas:  # 同步期间缓冲区过大
+                return False
+
+            writer = replica.writer
+            writer.write(b"+FULLRESYNC %b %d\r\n" % (self.replid.encode(), offset))
+            size = path.stat().st_size
+            writer.write(b"$%d\r\n" % size)
+            with open(path, "rb") as f:
+                while chunk := f.read(SYNC_CHUNK):
+                    writer.write(chunk)
+                    await writer.drain()
+            if replica not in self._replicas:
+                return False
+            replica.start_streaming()
+        except OSError as e:
+            logger.error(f"向副本 {replica.address} 全量同步失败: {e}")
+            self._drop_replica(replica)
+            return False
+        finally:
+            path.unlink(missing_ok=True)
+
+        replica.ack_offset = offset
+        logger.info(
+            f"副本 {replica.address} 全量同步完成，快照 {size} 字节，"
+            f"耗时 {time.perf_counter() - start:.3f} 秒"
+        )
+        return True
+
+    # ---------------------------------------------------------------- 副本
+
+    def replicaof(self, host: str, port: int) -> None:
+        """
+        成为 host:port 的副本，在后台与主节点同步
+        """
+        self._stop_link()
+        for replica in list(self._replicas):
+            self._drop_replica(replica)
+        if self.master != (host, port):
+            # 更换主节点后无法部分同步
+            self.replid = "?"
+        self.master = (host, port)
+        keyspace.replica = True
+        self._link_task = asyncio.create_task(self._link_loop())
+
+    def promote(self) -> None:
+        """
+        停止复制，成为主节点(replicaof no one)，保留现有数据
+        """
+        self._stop_link()
+        self.master = None
+        keyspace.replica = False
+        self.replid = _new_replid()
+        if self._backlog is not None:
+            self._backlog.clear()
+            self._backlog_offset = self.offset
+
+    def _stop_link(self) -> None:
+        if self._link_task is not None:
+            self._link_task.cancel()
+            self._link_task = None
+        self.link_up = False
+
+    async def close(self) -> None:
+        task = self._link_task
+        self._stop_link()
+        if task is not None:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        for replica in list(self._replicas):
+            self._drop_replica(replica)
+
+    async def _link_loop(self) -> None:
+        """
+        与主节点保持连接，断开后重连并尝试部分同步
+        """
+        attempt = 0
+        while True:
+            assert self.master is not None
+            host, port = self.master
+            try:
+                reader, writer = await asyncio.open_connection(host, port)
+            except OSError as e:
+                logger.warning(f"连接主节点 {host}:{port} 失败: {e}")
+            else:
+                attempt = 0
+                try:
+                    await self._sync(reader, writer)
+                except (OSError, asyncio.IncompleteReadError, ProtocolError) as e:
+                    logger.warning(f"与主节点 {host}:{port} 的连接已断开: {e}")
+                except Exception:
+                    # 主节点发送的数据有误或执行命令出错，已有数据可能不完整，重连后全量同步
+                    logger.exception(f"与主节点 {host}:{port} 同步失败，将重新全量同步")
+                    self.replid = "?"
+                finally:
+                    self.link_up = False
+                    writer.close()
+            attempt += 1
+            await asyncio.sleep(min(RECONNECT_DELAY_MAX, attempt))
+
+    async def _sync(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        offset = self.offset if self.replid != "?" else -1
+        writer.write(encode_reply(["psync", self.replid, str(offset)]))
+        line = await reader.readuntil(CRLF)
+        if line.startswith(b"+FULLRESYNC "):
+            _, replid, master_offset = line.split()
+            await self._receive_snapshot(reader)
+            self.replid, self.offset = replid.decode(), int(master_offset)
+        elif line.startswith(b"+CONTINUE"):
+            logger.info(f"与主节点部分同步，从偏移量 {self.offset} 继续")
+        else:
+            raise ProtocolError(f"主节点拒绝同步: {line.decode().strip()}")
+
+        self.link_up = True
+        ack_task = asyncio.create_task(self._ack_loop(writer))
+        try:
+            parser = RespParser()
+            base = self.offset
+            while data := await reader.read(BUFSIZE):
+                parser.feed(data)
+                # 主节点执行命令时 key 尚未过期，按原样执行；过期的 key 由主节点的 remove 删除
+                keyspace.loading = True
+                try:
+                    while (argv := parser.get_command()) is not None:
+                        replay = REPLAY_COMMANDS.get(argv[0])
+                        if replay is None:
+                            raise ProtocolError(f"主节点发送了未知的命令: {argv[0]}")
+                        await replay(*argv[1:])
+                        self.offset = base + parser.offset
+                finally:
+                    keyspace.loading = False
+                keyspace.flush_propagated()
+        finally:
+            ack_task.cancel()
+
+    async def _receive_snapshot(self, reader: asyncio.StreamReader) -> None:
+        """
+        接收全量同步的快照并载入
+        """
+        line = await reader.readuntil(CRLF)
+        if not line.startswith(b"$"):
+            raise ProtocolError(f"期望快照长度，实际收到 {line!r}")
+        remaining = int(line[1:])
+        path = self.snapshot.path.with_name(f"{self.snapshot.path.name}.replica")
+        start = time.perf_counter()
+        try:
+            with open(path, "wb") as f:
+                while remaining:
+                    chunk = await reader.read(min(SYNC_CHUNK, remaining))
+                    if not chunk:
+                        raise asyncio.IncompleteReadError(b"", remaining)
+                    f.write(chunk)
+                    remaining -= len(chunk)
+            await self._load_snapshot(path)
+        finally:
+            path.unlink(missing_ok=True)
+        logger.info(f"全量同步完成，耗时 {time.perf_counter() - start:.3f} 秒")
+
+    async def _ack_loop(self, writer: asyncio.StreamWriter) -> None:
+        while True:
+            writer.write(encode_reply(["replconf", "ack", str(self.offset)]))
+            await asyncio.sleep(ACK_INTERVAL)
+
+    # ---------------------------------------------------------------- 信息
+
+    def info(self) -> Dict[str, object]:
+        """
+        复制状态信息
+        """
+        info: Dict[str, object] = {}
+        if self.master is not None:
+            info["role"] = "slave"
+            info["master_host"], info["master_port"] = self.master
+            info["master_link_status"] = "up" if self.link_up else "down"
+            info["slave_repl_offset"] = self.offset
+        else:
+            info["role"] = "master"
+            info["connected_slaves"] = len(self._replicas)
+            now = time.time()
+            for i, replica in enumerate(self._replicas):
+                state = "wait_bgsave" if replica.pending is not None else "online"
+                info[f"slave{i}"] = (
+                    f"addr={replica.address},state={state},"
+                    f"offset={replica.ack_offset},lag={int(now - replica.ack_time)}"
+                )
+        info["master_replid"] = self.replid
+        info["master_repl_offset"] = self.offset
+        info["repl_backlog_active"] = int(self._backlog is not None)
+        info["repl_backlog_size"] = self.backlog_size
+        info["repl_backlog_first_byte_offset"] = self._backlog_offset
+        info["repl_backlog_histlen"] = len(self._backlog or b"")
+        return info
@@ -0,0 +1,159 @@
+import re
+import time
+from typing import Container, List, Optional, Pattern, Union
+
+from protocol import ErrorReply
+
+from ._keyspace import keyspace, scan_slots
+
+SCAN_TYPES = ("string", "list", "hash")
+"""scan 的 TYPE 参数可选的类型"""
+
+ScanReply = Union[str, List[Union[str, List[str]]]]
+"""[下一个游标, [key 或 字段、值 ...]]，出错时为错误信息"""
+
+
+def compile_pattern(pattern: str) -> Pattern[str]:
+    """
+    将 Redis 风格的通配符编译为正则表达式：* 匹配任意字符串，? 匹配任意一个字符，
+    [abc] / [^abc] / [a-z] 匹配(不匹配)其中一个字符，\\ 转义下一个字符
+    """
+    parts: List[str] = []
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        i += 1
+        if c == "*":
+            parts.append(".*")
+        elif c == "?":
+            parts.append(".")
+        elif c == "\\" and i < n:
+            parts.append(re.escape(pattern[i]))
+            i += 1
+        elif c == "[":
+            j = i
+            negate = j < n and pattern[j] == "^"
+            if negate:
+                j += 1
+            items: List[str] = []
+            while j < n and pattern[j] != "]":
+                if pattern[j] == "\\" and j + 1 < n:
+                    j += 1
+                    items.append(re.escape(pattern[j]))
+                elif j + 2 < n and pattern[j + 1] == "-" and pattern[j + 2] != "]":
+                    low, high = sorted((pattern[j], pattern[j + 2]))
+                    items.append(f"{re.escape(low)}-{re.escape(high)}")
+                    j += 2
+                else:
+                    items.append(re.escape(pattern[j]))
+                j += 1
+            if j >= n:
+                # 没有闭合的 [ 按普通字符处理
+                parts.append(re.escape(c))
+                continue
+            i = j + 1
+            if items:
+                parts.append(f"[{'^' if negate else ''}{''.join(items)}]")
+            else:
+                parts.append(r"[\s\S]" if negate else r"[^\s\S]")
+        else:
+            parts.append(re.escape(c))
+    return re.compile("".join(parts), re.DOTALL)
+
+
+def _type_values(type_: str) -> Container[str]:
+    """
+    内存中保存该类型数据的字典
+    """
+    if type_ == "string":
+        return keyspace.strings
+    if type_ == "list":
+        return keyspace.lists
+    return keyspace.hashes
+
+
+def _parse_cursor(cursor: str) -> Optional[int]:
+    """
+    解析十进制整数游标，无效时返回 None
+    """
+    try:
+        value = int(cursor)
+    except ValueError:
+        return None
+    return value if value >= 0 else None
+
+
+class Scan:
+    """
+    基于游标的增量遍历
+
+    直接遍历内存中的键(字段)列表：删除时用列表末尾的元素填补空位，遍历从后向前进行，
+    游标为尚未遍历部分的长度，无需保存遍历状态，每批只复制至多 count 个元素，不会长时间阻塞事件循环。
+    遍历开始前已存在且期间未被删除的 key 一定会被返回，同一个 key 可能被返回多次
+    """
+
+    @staticmethod
+    async def scan(
+        cursor: str,
+        pattern: Optional[str] = None,
+        count: int = 10,
+        type_: Optional[str] = None,
+    ) -> ScanReply:
+        """
+        遍历所有 key，可按通配符 pattern 及类型(string / list / hash)过滤
+        """
+        position = _parse_cursor(cursor)
+        if position is None:
+            return ErrorReply("无效的游标!")
+        if count < 1:
+            return ErrorReply("命令参数有误!")
+        if type_ is not None and type_.lower() not in SCAN_TYPES:
+            return ErrorReply(f"未知的类型: {type_}")
+
+        position, keys = keyspace.scan(position, count)
+
+        # 跳过已过期(只隐藏，由主动过期删除)或类型不符的 key
+        regex = compile_pattern(pattern) if pattern is not None else None
+        values = _type_values(type_.lower()) if type_ is not None else None
+        now = time.time()
+        matched: List[str] = []
+        for key in keys:
+            if regex is not None and not regex.fullmatch(key):
+                continue
+            when = keyspace.expires.get(key)
+            if when is not None and when <= now:
+                continue
+            if values is None or key in values:
+                matched.append(key)
+        return [str(position), matched]
+
+    @staticmethod
+    async def hscan(
+        key: str, cursor: str, pattern: Optional[str] = None, count: int = 10
+    ) -> ScanReply:
+        """
+        遍历哈希表的字段，返回的列表中字段与值交替出现；
+        紧凑编码的哈希表较小，一次返回全部字段
+        """
+        position = _parse_cursor(cursor)
+        if position is None:
+            return ErrorReply("无效的游标!")
+        if count < 1:
+            return ErrorReply("命令参数有误!")
+
+        fields = keyspace.hashes.get(key) if keyspace.touch(key, read=True) else None
+        if not fields:
+            return ["0", []]
+        regex = compile_pattern(pattern) if pattern is not None else None
+
+        slots = keyspace.hash_slots.get(key)
+        if slots is None:
+            position, names = 0, list(fields)
+        else:
+            position, names = scan_slots(slots.items, position, count)
+
+        items: List[str] = []
+        for field in names:
+            if regex is None or regex.fullmatch(field):
+                items.extend((field, fields[field]))
+        return [str(position), items]
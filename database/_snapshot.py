@@ -0,0 +1,399 @@
+import asyncio
+import io
+import logging
+import mmap
+import os
+import struct
+import time
+import uuid
+import zlib
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+from ._keyspace import ListValue, keyspace
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"KVSNAP\r\n"
+VERSION = 1
+
+TYPE_STRING = 0x01
+TYPE_LIST = 0x02
+TYPE_HASH = 0x03
+TYPE_EXPIRE = 0x04
+TYPE_EOF = 0xFF
+
+U32 = struct.Struct("<I")
+HEADER = struct.Struct("<8sH16s")
+"""魔数、格式版本、快照 ID"""
+LIST_HEADER = struct.Struct("<qI")
+"""链表首元素位置、元素个数"""
+EXPIRE_AT = struct.Struct("<d")
+
+WRITE_BUFFER = 1 << 20
+"""写入时累积多少字节后写入一次文件"""
+
+SnapshotData = Tuple[
+    Dict[str, str],
+    Dict[str, ListValue],
+    Dict[str, Dict[str, str]],
+    Dict[str, float],
+]
+"""字符串、链表、哈希表、过期时间"""
+
+
+class SnapshotError(Exception):
+    """
+    快照文件损坏或格式不受支持
+    """
+
+
+class _Writer:
+    """
+    带缓冲区的快照写入器，同时计算 CRC32
+    """
+
+    def __init__(self, f) -> None:
+        self._f = f
+        self._buffer = bytearray()
+        self.crc = 0
+
+    def write(self, data: bytes) -> None:
+        self._buffer += data
+        if len(self._buffer) >= WRITE_BUFFER:
+            self.flush()
+
+    def write_str(self, value: str) -> None:
+        data = value.encode()
+        self._buffer += U32.pack(len(data))
+        self._buffer += data
+        if len(self._buffer) >= WRITE_BUFFER:
+            self.flush()
+
+    def flush(self) -> None:
+        self.crc = zlib.crc32(self._buffer, self.crc)
+        self._f.write(self._buffer)
+        self._buffer.clear()
+
+
+def _write_string(writer: _Writer, key: str, value: str) -> None:
+    writer.write(bytes((TYPE_STRING,)))
+    writer.write_str(key)
+    writer.write_str(value)
+
+
+def _write_list(writer: _Writer, key: str, items: ListValue) -> None:
+    writer.write(bytes((TYPE_LIST,)))
+    writer.write_str(key)
+    writer.write(LIST_HEADER.pack(items.head, len(items)))
+    for value in items:
+        writer.write_str(value)
+
+
+def _write_hash(writer: _Writer, key: str, fields: Dict[str, str]) -> None:
+    writer.write(bytes((TYPE_HASH,)))
+    writer.write_str(key)
+    writer.write(U32.pack(len(fields)))
+    for field, value in fields.items():
+        writer.write_str(field)
+        writer.write_str(value)
+
+
+def _write_expire(writer: _Writer, key: str, when: float) -> None:
+    writer.write(bytes((TYPE_EXPIRE,)))
+    writer.write_str(key)
+    writer.write(EXPIRE_AT.pack(when))
+
+
+def write_snapshot(path: Path, data: SnapshotData, snapshot_id: bytes) -> None:
+    """
+    将数据写入快照文件：先写入临时文件，落盘后再替换原文件
+
+    文件格式：文件头之后每条记录以 1 字节类型开头，字符串均为 4 字节长度 + UTF-8 内容，
+    以 EOF 类型和整个文件的 CRC32 结尾
+    """
+    strings, lists, hashes, expires = data
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    with open(tmp_path, "wb") as f:
+        writer = _Writer(f)
+        writer.write(HEADER.pack(MAGIC, VERSION, snapshot_id))
+
+        for key, value in strings.items():
+            _write_string(writer, key, value)
+        for key, items in lists.items():
+            _write_list(writer, key, items)
+        for key, fields in hashes.items():
+            _write_hash(writer, key, fields)
+        for key, when in expires.items():
+            _write_expire(writer, key, when)
+
+        writer.write(bytes((TYPE_EOF,)))
+        writer.flush()
+        f.write(U32.pack(writer.crc))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _read_records(
+    buffer: Union[bytes, mmap.mmap], view: memoryview, pos: int, data: SnapshotData
+) -> int:
+    """
+    从 pos 开始解码记录直到 EOF 记录，写入 data，返回 EOF 记录之后的位置
+    """
+    strings, lists, hashes, expires = data
+    unpack_u32 = U32.unpack_from
+
+    def read_str() -> str:
+        nonlocal pos
+        (length,) = unpack_u32(buffer, pos)
+        start = pos + 4
+        pos = start + length
+        return str(view[start:pos], "utf-8")
+
+    while True:
+        record_type = buffer[pos]
+        pos += 1
+        if record_type == TYPE_STRING:
+            key = read_str()
+            strings[key] = read_str()
+        elif record_type == TYPE_LIST:
+            key = read_str()
+            head, count = LIST_HEADER.unpack_from(buffer, pos)
+            pos += LIST_HEADER.size
+            lists[key] = ListValue([read_str() for _ in range(count)], head)
+        elif record_type == TYPE_HASH:
+            key = read_str()
+            (count,) = unpack_u32(buffer, pos)
+            pos += 4
+            hashes[key] = {read_str(): read_str() for _ in range(count)}
+        elif record_type == TYPE_EXPIRE:
+            key = read_str()
+            (expires[key],) = EXPIRE_AT.unpack_from(buffer, pos)
+            pos += EXPIRE_AT.size
+        elif record_type == TYPE_EOF:
+            return pos
+        else:
+            raise SnapshotError(f"未知的记录类型: {record_type}")
+
+
+def dump_key(key: str) -> bytes:
+    """
+    将 key 的所有类型的数据及过期时间按快照的记录格式编码(DUMP)，以 CRC32 结尾
+    """
+    buffer = io.BytesIO()
+    writer = _Writer(buffer)
+    value = keyspace.strings.get(key)
+    if value is not None:
+        _write_string(writer, key, value)
+    items = keyspace.lists.get(key)
+    if items:
+        _write_list(writer, key, items)
+    fields = keyspace.hashes.get(key)
+    if fields:
+        _write_hash(writer, key, fields)
+    when = keyspace.expires.get(key)
+    if when is not None:
+        _write_expire(writer, key, when)
+    writer.write(bytes((TYPE_EOF,)))
+    writer.flush()
+    buffer.write(U32.pack(writer.crc))
+    return buffer.getvalue()
+
+
+def load_key(
+    payload: bytes,
+) -> Tuple[Optional[str], List[str], Dict[str, str], Optional[float]]:
+    """
+    解码 dump_key 的结果(RESTORE)
+
+    :return: 字符串、链表元素、哈希表字段、过期时刻，不存在的部分分别为 None、空列表、空字典、None
+    """
+    if (
+        len(payload) < 5
+        or zlib.crc32(payload[:-4]) != U32.unpack_from(payload, len(payload) - 4)[0]
+    ):
+        raise SnapshotError("DUMP 数据校验失败")
+
+    data: SnapshotData = ({}, {}, {}, {})
+    try:
+        with memoryview(payload) as view:
+            _read_records(payload, view, 0, data)
+    except (IndexError, struct.error, UnicodeDecodeError) as e:
+        raise SnapshotError(f"DUMP 数据格式有误: {e}") from e
+    strings, lists, hashes, expires = data
+    return (
+        next(iter(strings.values()), None),
+        next((list(items) for items in lists.values()), []),
+        next(iter(hashes.values()), {}),
+        next(iter(expires.values()), None),
+    )
+
+
+def read_snapshot(path: Path) -> Tuple[bytes, SnapshotData]:
+    """
+    通过 mmap 读取快照文件，直接从映射的内存中解码，不额外复制文件内容
+
+    :return: 快照 ID 及数据
+    """
+    data: SnapshotData = ({}, {}, {}, {})
+
+    with open(path, "rb") as f, mmap.mmap(
+        f.fileno(), 0, access=mmap.ACCESS_READ
+    ) as mm, memoryview(mm) as view:
+        if len(mm) < HEADER.size + 5:
+            raise SnapshotError("快照文件不完整")
+        magic, version, snapshot_id = HEADER.unpack_from(mm)
+        if magic != MAGIC:
+            raise SnapshotError("不是有效的快照文件")
+        if version != VERSION:
+            raise SnapshotError(f"不支持的快照版本: {version}")
+        (crc,) = U32.unpack_from(mm, len(mm) - 4)
+        if zlib.crc32(view[:-4]) != crc:
+            raise SnapshotError("快照文件校验失败")
+
+        _read_records(mm, view, HEADER.size, data)
+
+    return snapshot_id, data
+
+
+class Snapshot:
+    """
+    二进制快照(SAVE/BGSAVE)
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = Path(path)
+        self.last_save = 0.0
+        """最近一次成功保存快照的时刻(Unix 时间戳)"""
+        self.last_bgsave_ok = True
+        """最近一次后台保存是否成功"""
+        self._bgsave_task: Optional[asyncio.Task] = None
+
+    @property
+    def saving(self) -> bool:
+        return self._bgsave_task is not None
+
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    def save(self) -> bytes:
+        """
+        在当前线程中保存快照，保存期间阻塞事件循环
+
+        :return: 快照 ID
+        """
+        start = time.perf_counter()
+        snapshot_id = uuid.uuid4().bytes
+        write_snapshot(
+            self.path,
+            (keyspace.strings, keyspace.lists, keyspace.hashes, keyspace.expires),
+            snapshot_id,
+        )
+        self.last_save = time.time()
+        logger.info(f"快照已保存，耗时 {time.perf_counter() - start:.3f} 秒")
+        return snapshot_id
+
+    def start_bgsave(self) -> bool:
+        """
+        开始后台保存快照，已有后台保存在进行时返回 False
+        """
+        if self.saving:
+            return False
+        self._bgsave_task = asyncio.create_task(self.bgsave())
+        return True
+
+    @staticmethod
+    async def write_in_background(path: Path) -> bool:
+        """
+        在后台将当前数据写入 path，返回是否成功
+
+        调用时同步取得数据，第一次让出事件循环之前的数据即为快照内容。
+        支持 fork 的平台在子进程中写入，子进程的内存是 fork 时刻数据的写时复制副本，
+        无需复制数据即可得到一致的快照；否则先复制一份数据再在线程中写入
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            if hasattr(os, "fork"):
+                pid = os.fork()
+                if pid == 0:
+                    code = 1
+                    try:
+                        write_snapshot(
+                            path,
+                            (
+                                keyspace.strings,
+                                keyspace.lists,
+                                keyspace.hashes,
+                                keyspace.expires,
+                            ),
+                            uuid.uuid4().bytes,
+                        )
+                        code = 0
+                    except BaseException as e:
+                        logger.error(f"子进程保存快照失败: {e}")
+                    finally:
+                        os._exit(code)
+                _, status = await loop.run_in_executor(None, os.waitpid, pid, 0)
+                return os.waitstatus_to_exitcode(status) == 0
+
+            data: SnapshotData = (
+                dict(keyspace.strings),
+                {k: ListValue(v, v.head) for k, v in keyspace.lists.items()},
+                {k: dict(v) for k, v in keyspace.hashes.items()},
+                dict(keyspace.expires),
+            )
+            await loop.run_in_executor(
+                None, write_snapshot, path, data, uuid.uuid4().bytes
+            )
+            return True
+        except Exception as e:
+            logger.error(f"后台保存快照失败: {e}", exc_info=True)
+            return False
+
+    async def bgsave(self) -> None:
+        """
+        在后台保存快照，不阻塞事件循环
+        """
+        start = time.perf_counter()
+        try:
+            ok = await self.write_in_background(self.path)
+        finally:
+            self._bgsave_task = None
+
+        self.last_bgsave_ok = ok
+        if ok:
+            self.last_save = time.time()
+            logger.info(f"后台保存快照完成，耗时 {time.perf_counter() - start:.3f} 秒")
+        else:
+            logger.error("后台保存快照失败")
+
+    async def wait(self) -> None:
+        """
+        等待进行中的后台保存完成
+        """
+        if self._bgsave_task is not None:
+            await self._bgsave_task
+
+    def read_id(self) -> Optional[bytes]:
+        """
+        只读取文件头中的快照 ID，文件不是有效的快照时返回 None
+        """
+        with open(self.path, "rb") as f:
+            header = f.read(HEADER.size)
+        if len(header) < HEADER.size:
+            return None
+        magic, version, snapshot_id = HEADER.unpack(header)
+        if magic != MAGIC or version != VERSION:
+            return None
+        return snapshot_id
+
+    def load(self) -> bytes:
+        """
+        载入快照到内存键空间
+
+        :return: 快照 ID
+        """
+        snapshot_id, data = read_snapshot(self.path)
+        keyspace.strings, keyspace.lists, keyspace.hashes, keyspace.expires = data
+        return snapshot_id
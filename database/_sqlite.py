@@ -1,63 +1,912 @@
 import asyncio
 import logging
-import os
 import sqlite3
+import struct
+import time
+from contextlib import asynccontextmanager
 from pathlib import Path
-from typing import Any, Iterable, Literal, Optional, Sequence, Union, overload
+from typing import (
+    Any,
+    AsyncIterator,
+    Dict,
+    Iterable,
+    List,
+    Literal,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+    overload,
+)
 
 import aiosqlite
 from aiosqlite import Row
 
 from config import server_config
+from protocol import ErrorReply
+
+from ._aof import AppendOnlyFile
+from ._compression import compress, decompress, init_codec
+from ._keyspace import (
+    LIST_CHUNK_SIZE,
+    ExpireSnapshot,
+    HashSnapshot,
+    ListSnapshot,
+    ListValue,
+    keyspace,
+)
+from ._replication import Replication
+from ._snapshot import Snapshot, SnapshotError, read_snapshot
+from ._stats import stats
 
 logger = logging.getLogger(__name__)
 
+CACHED_STATEMENTS = 256
+"""预编译语句缓存数量"""
+ACTIVE_EXPIRE_INTERVAL = 0.1
+"""主动过期任务的执行间隔(秒)"""
+ACTIVE_EXPIRE_BUDGET = 0.025
+"""每次主动过期最多占用事件循环的时间(秒)"""
+AOF_CRON_INTERVAL = 1.0
+"""AOF 定时任务(everysec 落盘、自动重写)的执行间隔(秒)"""
+MIGRATE_BATCH = 1024
+"""迁移数据时每批写入的行数"""
+
+_U32 = struct.Struct("<I")
+_COMPRESSED = 1 << 31
+"""元素长度的最高位表示该元素已压缩"""
+
+StoredValue = Union[str, bytes]
+"""数据库中的值：TEXT 为原始值，BLOB 为以压缩算法标记开头的压缩数据"""
+
+
+def _encode_value(value: str) -> StoredValue:
+    """
+    超过压缩阈值的值压缩后以 BLOB 保存，其余值保持 TEXT 不变
+    """
+    data = compress(value.encode())
+    return value if data is None else data
+
+
+def _decode_value(value: StoredValue) -> str:
+    return value if isinstance(value, str) else decompress(value).decode()
+
+
+def _pack_items(items: Iterable[str]) -> bytes:
+    """
+    将链表的一个块编码为一行数据：每个元素依次为 4 字节长度及 UTF-8 编码，
+    超过压缩阈值的元素保存压缩数据，并在长度的最高位做标记
+    """
+    parts: List[bytes] = []
+    for value in items:
+        data = value.encode()
+        compressed = compress(data)
+        if compressed is None:
+            parts.append(_U32.pack(len(data)))
+            parts.append(data)
+        else:
+            parts.append(_U32.pack(len(compressed) | _COMPRESSED))
+            parts.append(compressed)
+    return b"".join(parts)
+
+
+def _unpack_items(data: bytes, count: int) -> List[str]:
+    """
+    解码链表的一个块
+    """
+    items: List[str] = []
+    pos = 0
+    for _ in range(count):
+        (size,) = _U32.unpack_from(data, pos)
+        pos += 4
+        if size & _COMPRESSED:
+            size &= ~_COMPRESSED
+            items.append(decompress(data[pos : pos + size]).decode())
+        else:
+            items.append(data[pos : pos + size].decode())
+        pos += size
+    return items
+
+
+def _unpack_rows(rows: Iterable[Row], per_count: int = 1) -> List[List[str]]:
+    """
+    解码以 COUNT、ITEMS 两列结尾的每一行，per_count 为每个计数对应的元素个数
+    """
+    return [_unpack_items(row[-1], per_count * row[-2]) for row in rows]
+
+
+def _decode_strings(rows: Iterable[Row]) -> Dict[str, str]:
+    return {key: _decode_value(value) for key, value in rows}
+
+
+def _decode_hash_fields(rows: Iterable[Row]) -> Dict[str, Dict[str, str]]:
+    hashes: Dict[str, Dict[str, str]] = {}
+    for key, field, value in rows:
+        hashes.setdefault(key, {})[field] = _decode_value(value)
+    return hashes
+
+
+def _encode_strings(strings: Dict[str, Optional[str]]) -> List[Tuple[str, StoredValue]]:
+    return [
+        (key, _encode_value(value))
+        for key, value in strings.items()
+        if value is not None
+    ]
+
+
+def _encode_chunks(lists: ListSnapshot) -> List[Tuple[str, int, int, int, bytes]]:
+    return [
+        (key, chunk, start, len(items), _pack_items(items))
+        for key, snapshot in lists.items()
+        if snapshot is not None
+        for chunk, start, items in snapshot[2]
+    ]
+
+
+def _encode_hash_fields(
+    hash_fields: Dict[str, Dict[str, Optional[str]]],
+) -> List[Tuple[str, str, StoredValue]]:
+    return [
+        (key, field, _encode_value(value))
+        for key, fields in hash_fields.items()
+        for field, value in fields.items()
+        if value is not None
+    ]
+
+
+def _encode_packed_hashes(
+    packed_hashes: Dict[str, Dict[str, str]],
+) -> List[Tuple[str, int, bytes]]:
+    return [
+        (
+            key,
+            len(fields),
+            _pack_items(item for pair in fields.items() for item in pair),
+        )
+        for key, fields in packed_hashes.items()
+    ]
+
+
+def _shard_path(path: Path, shard: int) -> Path:
+    """
+    database.db -> database-0.db
+    """
+    return path.with_name(f"{path.stem}-{shard}{path.suffix}")
+
 
 class Database:
     def __init__(self) -> None:
         self.DB_PATH = Path(server_config.db_path)
 
-        asyncio.run(self.init_db())
-        logger.info(f"数据库路径: {self.DB_PATH}")
+        self._conn: Optional[aiosqlite.Connection] = None
+        self._connect_lock = asyncio.Lock()
+        self._write_lock = asyncio.Lock()
+        """串行化长连接上的事务，避免其他协程的语句混入或提交进行中的事务"""
+        self._flush_task: Optional[asyncio.Task] = None
+        self._expire_task: Optional[asyncio.Task] = None
+        self._aof_task: Optional[asyncio.Task] = None
+        self._stopping = asyncio.Event()
+        self._created = False
+        """数据库文件是否在本次启动时新建"""
+
+        self.aof: Optional[AppendOnlyFile] = None
+        if server_config.appendonly:
+            self.aof = AppendOnlyFile(
+                server_config.appendfilename,
+                server_config.appendfsync,
+                server_config.auto_aof_rewrite_percentage,
+                server_config.auto_aof_rewrite_min_size,
+            )
+        self.snapshot = Snapshot(server_config.snapshot_path)
+        self.replication = Replication(
+            self.snapshot, self.load_replica_snapshot, server_config.repl_backlog_size
+        )
+
+    def use_shard(self, shard: int, count: int) -> None:
+        """
+        多进程模式下每个工作进程只保存一个分片，数据库、AOF、快照使用各自独立的文件，
+        内存上限由各分片平分；应在 connect 之前调用
+        """
+        self.DB_PATH = _shard_path(self.DB_PATH, shard)
+        if self.aof is not None:
+            self.aof.path = _shard_path(self.aof.path, shard)
+        self.snapshot.path = _shard_path(self.snapshot.path, shard)
+        keyspace.maxmemory //= count
+
+    async def connect(self) -> None:
+        """
+        打开数据库长连接并初始化数据库，应在服务器启动时调用
+        """
+        async with self._connect_lock:
+            if self._conn is not None:
+                return
+
+            conn = await aiosqlite.connect(
+                self.DB_PATH, cached_statements=CACHED_STATEMENTS
+            )
+            conn.row_factory = aiosqlite.Row
+            # WAL 模式下读写互不阻塞，配合 NORMAL 同步级别减少 fsync 次数
+            await conn.execute("PRAGMA journal_mode=WAL")
+            await conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn = conn
+
+            init_codec()
+            await self.init_db()
+            if self.aof is not None and self.aof.exists():
+                await self.load_aof()
+            elif not await self.load_snapshot():
+                await self.load()
+            # 启动后数据库会继续变化，关闭时保存的快照不再与数据库一致
+            await self.execute("""DELETE FROM META WHERE NAME = 'snapshot_id'""")
+            logger.info(f"数据库路径: {self.DB_PATH}")
+
+            self._stopping.clear()
+            if self.aof is not None:
+                created = not self.aof.exists()
+                self.aof.open()
+                if created:
+                    # 以当前数据生成初始 AOF
+                    await self.aof.rewrite()
+                self._aof_task = asyncio.create_task(self.__aof_loop())
+            self._flush_task = asyncio.create_task(self.__flush_loop())
+            self._expire_task = asyncio.create_task(self.__expire_loop())
+            if server_config.replicaof:
+                host, _, port = server_config.replicaof.rpartition(":")
+                self.replication.replicaof(host, int(port))
+
+    async def close(self) -> None:
+        """
+        停止写回任务，写回剩余脏数据后关闭数据库长连接，应在服务器关闭时调用
+        """
+        async with self._connect_lock:
+            if self._conn is None:
+                return
+
+            self._stopping.set()
+            await self.replication.close()
+            if self._expire_task is not None:
+                await self._expire_task
+                self._expire_task = None
+            if self._flush_task is not None:
+                await self._flush_task
+                self._flush_task = None
+            if self._aof_task is not None:
+                await self._aof_task
+                self._aof_task = None
+            if self.aof is not None:
+                await self.aof.close()
+
+            await self.snapshot.wait()
+            await self.flush()
+            # 写回失败时数据库与内存不一致，不能记录快照 ID
+            if server_config.snapshot_on_shutdown and not keyspace.has_dirty():
+                await self.save_shutdown_snapshot()
+
+            await self._conn.close()
+            self._conn = None
+
+    async def save_shutdown_snapshot(self) -> None:
+        """
+        关闭前保存快照，并在数据库中记录快照 ID，下次启动时可以直接载入快照
+        """
+        try:
+            snapshot_id = self.snapshot.save()
+        except OSError as e:
+            logger.error(f"保存快照失败: {e}")
+            return
+        await self.execute(
+            """INSERT INTO META (NAME, VALUE) VALUES ('snapshot_id', ?)
+            ON CONFLICT(NAME) DO UPDATE SET VALUE = excluded.VALUE""",
+            (snapshot_id.hex(),),
+        )
 
     async def init_db(self) -> None:
         """
-        初始化数据库，检查数据库是否存在，不存在则创建
+        初始化数据库，检查数据表是否存在，不存在则创建
         """
-        if not os.path.isfile(self.DB_PATH) or self.DB_PATH.stat().st_size == 0:
+        conn = await self.__connection()
+        async with conn.execute(
+            """SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'STRING'"""
+        ) as cursor:
+            exists = await cursor.fetchone()
+
+        self._created = exists is None
+        if self._created:
             logger.info("数据库不存在，正在创建...")
             await self.__create_database()
 
-    def __connect(self) -> aiosqlite.Connection:
-        return aiosqlite.connect(self.DB_PATH)
+        await self.__migrate(conn)
+
+    async def __migrate(self, conn: aiosqlite.Connection) -> None:
+        """
+        按 PRAGMA user_version 记录的结构版本依次执行尚未执行的迁移，
+        新建的数据库同样从初始结构迁移至最新版本
+        """
+        migrations = [
+            self.__migrate_list_positions,
+            self.__migrate_hash_fields,
+            self.__migrate_expires,
+            self.__migrate_meta,
+            self.__migrate_list_chunks,
+            self.__migrate_packed_hashes,
+        ]
+
+        async with conn.execute("PRAGMA user_version") as cursor:
+            row = await cursor.fetchone()
+        version: int = row[0]  # type: ignore
+
+        for target, migration in enumerate(migrations[version:], start=version + 1):
+            logger.info(f"正在迁移数据库结构至版本 {target}...")
+            async with self.transaction():
+                await migration(conn)
+                await conn.execute(f"PRAGMA user_version = {target}")
+
+    @staticmethod
+    async def __migrate_list_positions(conn: aiosqlite.Connection) -> None:
+        """
+        版本 1：链表由 PREV_ID/NEXT_ID 指针链改为按 (KEY, POSITION) 排列
+        """
+        await conn.execute("""CREATE TABLE DLIST_V1 (
+            ID INTEGER PRIMARY KEY,
+            KEY TEXT NOT NULL,
+            POSITION INTEGER NOT NULL,
+            VALUE TEXT NOT NULL);""")
+
+        # 在内存中沿指针链为每个元素编号
+        nodes: Dict[str, Dict[int, Tuple[str, Optional[int]]]] = {}
+        heads: Dict[str, int] = {}
+        for item_id, key, value, prev_id, next_id in await conn.execute_fetchall(
+            """SELECT ID, KEY, VALUE, PREV_ID, NEXT_ID FROM DLIST"""
+        ):
+            nodes.setdefault(key, {})[item_id] = (value, next_id)
+            if prev_id is None:
+                heads[key] = item_id
+
+        rows: List[Tuple[str, int, str]] = []
+        for key, head_id in heads.items():
+            key_nodes = nodes[key]
+            node_id: Optional[int] = head_id
+            position = 0
+            while node_id is not None and node_id in key_nodes:
+                value, node_id = key_nodes[node_id]
+                rows.append((key, position, value))
+                position += 1
+
+        await conn.executemany(
+            """INSERT INTO DLIST_V1 (KEY, POSITION, VALUE) VALUES (?, ?, ?)""", rows
+        )
+        await conn.execute("""DROP TABLE DLIST""")
+        await conn.execute("""ALTER TABLE DLIST_V1 RENAME TO DLIST""")
+        await conn.execute(
+            """CREATE UNIQUE INDEX DLIST_KEY_POSITION ON DLIST (KEY, POSITION)"""
+        )
+
+    @staticmethod
+    async def __migrate_hash_fields(conn: aiosqlite.Connection) -> None:
+        """
+        版本 2：哈希表同一字段只保留最后写入的一行，并为 (KEY, FIELD) 建立唯一索引
+        """
+        await conn.execute("""DELETE FROM HASHMAP WHERE ID NOT IN
+            (SELECT MAX(ID) FROM HASHMAP GROUP BY KEY, FIELD)""")
+        await conn.execute(
+            """CREATE UNIQUE INDEX HASHMAP_KEY_FIELD ON HASHMAP (KEY, FIELD)"""
+        )
+
+    @staticmethod
+    async def __migrate_expires(conn: aiosqlite.Connection) -> None:
+        """
+        版本 3：新增过期时间表，并按过期时刻建立索引
+        """
+        await conn.execute("""CREATE TABLE EXPIRES (
+            KEY TEXT PRIMARY KEY,
+            EXPIRE_AT REAL NOT NULL);""")
+        await conn.execute("""CREATE INDEX EXPIRES_EXPIRE_AT ON EXPIRES (EXPIRE_AT)""")
+
+    @staticmethod
+    async def __migrate_meta(conn: aiosqlite.Connection) -> None:
+        """
+        版本 4：新增元数据表，记录与数据库内容一致的快照 ID
+        """
+        await conn.execute("""CREATE TABLE META (
+            NAME TEXT PRIMARY KEY,
+            VALUE TEXT NOT NULL);""")
+
+    @staticmethod
+    async def __migrate_list_chunks(conn: aiosqlite.Connection) -> None:
+        """
+        版本 5：链表由每个元素一行改为每 LIST_CHUNK_SIZE 个元素一行(块)，
+        按 (KEY, CHUNK) 定位，块中的元素编码为一个 BLOB
+        """
+        await conn.execute("""CREATE TABLE DLIST_V2 (
+            ID INTEGER PRIMARY KEY,
+            KEY TEXT NOT NULL,
+            CHUNK INTEGER NOT NULL,
+            START INTEGER NOT NULL,
+            COUNT INTEGER NOT NULL,
+            ITEMS BLOB NOT NULL);""")
+
+        insert = """INSERT INTO DLIST_V2 (KEY, CHUNK, START, COUNT, ITEMS)
+            VALUES (?, ?, ?, ?, ?)"""
+        rows: List[Tuple[str, int, int, int, bytes]] = []
+        chunk_id: Optional[Tuple[str, int]] = None
+        """当前块所属的 key 及块编号"""
+        start = 0
+        items: List[str] = []
+        key: Optional[str] = None
+        position = 0
+        async with conn.execute(
+            """SELECT KEY, POSITION, VALUE FROM DLIST ORDER BY KEY, POSITION"""
+        ) as cursor:
+            async for row_key, row_position, value in cursor:
+                # 位置不连续的元素按顺序重新编号
+                position = row_position if row_key != key else position + 1
+                key = row_key
+                if chunk_id != (key, position // LIST_CHUNK_SIZE):
+                    if chunk_id is not None:
+                        rows.append((*chunk_id, start, len(items), _pack_items(items)))
+                    if len(rows) >= MIGRATE_BATCH:
+                        await conn.executemany(insert, rows)
+                        rows = []
+                    chunk_id = (key, position // LIST_CHUNK_SIZE)
+                    start, items = position, []
+                items.append(value)
+        if chunk_id is not None:
+            rows.append((*chunk_id, start, len(items), _pack_items(items)))
+        await conn.executemany(insert, rows)
+
+        await conn.execute("""DROP TABLE DLIST""")
+        await conn.execute("""ALTER TABLE DLIST_V2 RENAME TO DLIST""")
+        await conn.execute(
+            """CREATE UNIQUE INDEX DLIST_KEY_CHUNK ON DLIST (KEY, CHUNK)"""
+        )
+
+    @staticmethod
+    async def __migrate_packed_hashes(conn: aiosqlite.Connection) -> None:
+        """
+        版本 6：新增紧凑编码的哈希表，整个哈希表的字段名和值编码为一个 BLOB。
+        已有的小哈希表在载入时按阈值转换，下次写回时整体重写
+        """
+        await conn.execute("""CREATE TABLE HASHMAP_PACKED (
+            KEY TEXT PRIMARY KEY,
+            COUNT INTEGER NOT NULL,
+            ITEMS BLOB NOT NULL);""")
+
+    async def load(self) -> None:
+        """
+        将数据库中的全部数据一次性载入内存键空间
+        """
+        conn = await self.__connection()
+        # 解压在线程池中进行
+        loop = asyncio.get_running_loop()
+
+        strings = await conn.execute_fetchall("""SELECT KEY, VALUE FROM STRING""")
+        keyspace.strings = await loop.run_in_executor(None, _decode_strings, strings)
+
+        hashes = await loop.run_in_executor(
+            None,
+            _decode_hash_fields,
+            await conn.execute_fetchall("""SELECT KEY, FIELD, VALUE FROM HASHMAP"""),
+        )
+        packed: Set[str] = set()
+        rows = await conn.execute_fetchall(
+            """SELECT KEY, COUNT, ITEMS FROM HASHMAP_PACKED"""
+        )
+        for (key, _, _), items in zip(
+            rows, await loop.run_in_executor(None, _unpack_rows, rows, 2)
+        ):
+            pairs = iter(items)
+            hashes.setdefault(key, {}).update(zip(pairs, pairs))
+            packed.add(key)
+        keyspace.hashes = hashes
+
+        lists: Dict[str, ListValue] = {}
+        rows = await conn.execute_fetchall(
+            """SELECT KEY, CHUNK, START, COUNT, ITEMS FROM DLIST ORDER BY KEY, CHUNK"""
+        )
+        for (key, chunk, start, count, _), chunk_items in zip(
+            rows, await loop.run_in_executor(None, _unpack_rows, rows)
+        ):
+            values = lists.get(key)
+            if values is None:
+                values = lists[key] = ListValue(head=start)
+            if start != values.tail + 1 or not (
+                chunk == start // LIST_CHUNK_SIZE
+                and chunk == (start + count - 1) // LIST_CHUNK_SIZE
+            ):
+                # 位置不连续或 list_chunk_size 已修改时按内存中的顺序重新编号，
+                # 并在下次写回时整体覆盖
+                values.mark_all_dirty()
+                keyspace.dirty_lists.add(key)
+            values.extend(chunk_items)
+        keyspace.lists = lists
+
+        expires = await conn.execute_fetchall("""SELECT KEY, EXPIRE_AT FROM EXPIRES""")
+        keyspace.expires = {row[0]: row[1] for row in expires}
+        self.__prepare_keyspace()
+        self.__sync_hash_encodings(packed)
+
+        logger.info(
+            f"已载入 {len(keyspace.strings)} 个字符串，"
+            f"{len(keyspace.lists)} 个链表，{len(keyspace.hashes)} 个哈希表"
+        )
+
+    async def load_snapshot(self) -> bool:
+        """
+        快照与数据库内容一致(数据库中记录的快照 ID 与快照相同，上次正常关闭时保存)
+        或数据库在本次启动时新建(从其他节点复制的快照)时，从快照载入数据，比逐行读取数据库快得多。
+        数据库中的数据被全部删除后同样为空，此时的快照已经过时，不能仅凭数据库为空载入
+
+        :return: 是否从快照载入了数据
+        """
+        if not self.snapshot.exists():
+            return False
+
+        snapshot_id = self.snapshot.read_id()
+        row = await self.execute(
+            """SELECT VALUE FROM META WHERE NAME = 'snapshot_id'""", fetchone=True
+        )
+        in_sync = (
+            snapshot_id is not None and row is not None and row[0] == snapshot_id.hex()
+        )
+        if not in_sync and not self._created:
+            logger.info("快照与数据库内容不一致，从数据库载入数据")
+            return False
+
+        conn = await self.__connection()
+        start = time.perf_counter()
+        try:
+            self.snapshot.load()
+        except (OSError, SnapshotError) as e:
+            logger.error(f"载入快照失败，从数据库载入数据: {e}")
+            return False
+        self.__prepare_keyspace()
+        if not in_sync:
+            # 将快照中的数据写入新建的数据库
+            keyspace.mark_all_dirty()
+        else:
+            rows = await conn.execute_fetchall("""SELECT KEY FROM HASHMAP_PACKED""")
+            self.__sync_hash_encodings({row[0] for row in rows})
+
+        logger.info(
+            f"已从快照载入 {len(keyspace.strings)} 个字符串，"
+            f"{len(keyspace.lists)} 个链表，{len(keyspace.hashes)} 个哈希表，"
+            f"耗时 {time.perf_counter() - start:.3f} 秒"
+        )
+        return True
+
+    @staticmethod
+    def __sync_hash_encodings(packed: Set[str]) -> None:
+        """
+        从数据库或与之一致的快照载入数据后调用：数据库中的存储方式与按阈值确定的编码不一致的
+        哈希表(升级前的数据、阈值已修改)在下次写回时按新的编码整体重写
+
+        :param packed: 数据库中以紧凑编码保存的哈希表
+        """
+        for key in keyspace.hashes:
+            if (key in packed) == (key in keyspace.hashtable_hashes):
+                keyspace.rewrite_hash(key)
+
+    @staticmethod
+    def __prepare_keyspace() -> None:
+        """
+        载入数据后重建元数据、哈希表编码和过期索引，删除停机期间已经过期的键；
+        副本上的键由主节点同步删除
+        """
+        keyspace.rebuild_meta()
+        keyspace.rebuild_hash_encodings()
+        keyspace.rebuild_expire_index()
+        while not keyspace.replica and keyspace.expire_cycle(ACTIVE_EXPIRE_BUDGET):
+            pass
+        if not keyspace.reserve():
+            logger.warning("已载入的数据超出 maxmemory 上限，在释放内存前将拒绝写入")
+
+    async def load_aof(self) -> None:
+        """
+        重放 AOF 恢复数据，并以恢复的数据覆盖数据库中可能过时的数据
+        """
+        assert self.aof is not None
+        count = await self.aof.load()
+        self.__prepare_keyspace()
+
+        async with self.transaction() as conn:
+            for table in ("STRING", "DLIST", "HASHMAP", "HASHMAP_PACKED", "EXPIRES"):
+                await conn.execute(f"DELETE FROM {table}")
+        keyspace.mark_all_dirty()
+
+        logger.info(
+            f"已重放 AOF 中的 {count} 条命令，载入 {len(keyspace.strings)} 个字符串，"
+            f"{len(keyspace.lists)} 个链表，{len(keyspace.hashes)} 个哈希表"
+        )
+
+    async def load_replica_snapshot(self, path: Path) -> None:
+        """
+        副本全量同步：用主节点的快照替换全部数据，并以其覆盖数据库和 AOF
+        """
+        loop = asyncio.get_running_loop()
+        _, data = await loop.run_in_executor(None, read_snapshot, path)
+        async with self.transaction() as conn:
+            for table in ("STRING", "DLIST", "HASHMAP", "HASHMAP_PACKED", "EXPIRES"):
+                await conn.execute(f"DELETE FROM {table}")
+        # 以下不再让出事件循环，写回任务取得的一定是新数据
+        keyspace.strings, keyspace.lists, keyspace.hashes, keyspace.expires = data
+        self.__prepare_keyspace()
+        keyspace.mark_all_dirty()
+        if self.aof is not None:
+            self.aof.start_rewrite()
+
+        logger.info(
+            f"已从主节点载入 {len(keyspace.strings)} 个字符串，"
+            f"{len(keyspace.lists)} 个链表，{len(keyspace.hashes)} 个哈希表"
+        )
+
+    def save(self) -> str:
+        """
+        在前台保存快照，保存期间阻塞所有客户端
+        """
+        if self.snapshot.saving:
+            return ErrorReply("后台保存快照正在进行中!")
+        try:
+            self.snapshot.save()
+        except OSError as e:
+            logger.error(f"保存快照失败: {e}")
+            return ErrorReply(f"保存快照失败: {e}")
+        return "1"
+
+    def bgsave(self) -> str:
+        """
+        在后台保存快照
+        """
+        if not self.snapshot.start_bgsave():
+            return ErrorReply("后台保存快照正在进行中!")
+        return "已开始后台保存快照"
+
+    def persistence_info(self) -> Dict[str, object]:
+        """
+        持久化状态信息
+        """
+        return {
+            "last_save_time": int(self.snapshot.last_save),
+            "bgsave_in_progress": int(self.snapshot.saving),
+            "last_bgsave_status": "ok" if self.snapshot.last_bgsave_ok else "err",
+            "aof_enabled": int(self.aof is not None),
+            "aof_rewrite_in_progress": int(self.aof is not None and self.aof.rewriting),
+        }
+
+    async def commit(self) -> None:
+        """
+        将本批写命令交给 AOF 和副本，并按 appendfsync 策略等待 AOF 落盘
+        """
+        keyspace.flush_propagated()
+        if self.aof is not None:
+            await self.aof.commit()
+
+    async def flush(self) -> None:
+        """
+        将内存键空间中的脏键在一个事务中批量写回数据库
+        """
+        if not keyspace.has_dirty():
+            return
+
+        async with self._write_lock:
+            # 持有写锁后再生成快照，保证先生成的快照一定先提交
+            snapshot = keyspace.take_dirty()
+            try:
+                async with self.transaction(locked=True) as conn:
+                    await self.__write_strings(conn, snapshot.strings)
+                    await self.__write_lists(conn, snapshot.lists)
+                    await self.__write_hashes(conn, snapshot.hashes)
+                    await self.__write_expires(conn, snapshot.expires)
+            except Exception as e:
+                keyspace.restore_dirty(snapshot)
+                logger.error(f"写回数据库失败: {e}", exc_info=True)
+                return
+
+        cleared, hash_fields, packed_hashes = snapshot.hashes
+        logger.debug(
+            f"已写回 {len(snapshot.strings)} 个字符串，{len(snapshot.lists)} 个链表，"
+            f"{len(cleared | hash_fields.keys() | packed_hashes.keys())} 个哈希表，"
+            f"{len(snapshot.expires)} 个过期时间"
+        )
+
+    @asynccontextmanager
+    async def transaction(
+        self, locked: bool = False
+    ) -> AsyncIterator[aiosqlite.Connection]:
+        """
+        在长连接上开启一个写事务，正常退出时提交，出错时回滚
+
+        :param locked: 调用方是否已经持有写锁
+        """
+        if not locked:
+            async with self._write_lock:
+                async with self.transaction(locked=True) as conn:
+                    yield conn
+            return
+
+        conn = await self.__connection()
+        start = time.perf_counter()
+        await conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            await conn.rollback()
+            raise
+        await conn.commit()
+        stats.record_statement("TRANSACTION", start)
+
+    async def __expire_loop(self) -> None:
+        """
+        主动过期：定期删除已过期的键，每次只占用一个时间片，不会长时间阻塞事件循环
+        """
+        while not self._stopping.is_set():
+            # 副本上的键由主节点删除后同步过来，避免与主节点不一致
+            if not self.replication.is_replica and keyspace.expire_cycle(
+                ACTIVE_EXPIRE_BUDGET
+            ):
+                # 时间片用完但仍有过期的键，让出事件循环后继续
+                keyspace.flush_propagated()
+                await asyncio.sleep(0)
+                continue
+            keyspace.flush_propagated()
+            try:
+                await asyncio.wait_for(self._stopping.wait(), ACTIVE_EXPIRE_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    async def __aof_loop(self) -> None:
+        """
+        定期执行 AOF 的落盘与自动重写
+        """
+        assert self.aof is not None
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), AOF_CRON_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            await self.aof.cron()
+
+    async def __flush_loop(self) -> None:
+        """
+        按 flush_interval 间隔定期写回脏数据
+        """
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(
+                    self._stopping.wait(), server_config.flush_interval
+                )
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+    @staticmethod
+    async def __write_strings(
+        conn: aiosqlite.Connection, strings: Dict[str, Optional[str]]
+    ) -> None:
+        if not strings:
+            return
+
+        await conn.executemany(
+            """DELETE FROM STRING WHERE KEY = ?""",
+            [(key,) for key, value in strings.items() if value is None],
+        )
+        # 压缩大值可能耗时较长，在线程池中编码，避免阻塞其他客户端
+        rows = await asyncio.get_running_loop().run_in_executor(
+            None, _encode_strings, strings
+        )
+        await conn.executemany(
+            """INSERT INTO STRING (KEY, VALUE) VALUES (?, ?)
+            ON CONFLICT(KEY) DO UPDATE SET VALUE = excluded.VALUE""",
+            rows,
+        )
+
+    @staticmethod
+    async def __write_lists(conn: aiosqlite.Connection, lists: ListSnapshot) -> None:
+        if not lists:
+            return
+
+        deleted = [(key,) for key, snapshot in lists.items() if snapshot is None]
+        trimmed = [
+            (key, snapshot[0], snapshot[1])
+            for key, snapshot in lists.items()
+            if snapshot is not None
+        ]
+        rows = await asyncio.get_running_loop().run_in_executor(
+            None, _encode_chunks, lists
+        )
+
+        await conn.executemany("""DELETE FROM DLIST WHERE KEY = ?""", deleted)
+        # 删除两端已经弹出的块，只写回发生变化的块
+        await conn.executemany(
+            """DELETE FROM DLIST WHERE KEY = ? AND (CHUNK < ? OR CHUNK > ?)""",
+            trimmed,
+        )
+        await conn.executemany(
+            """INSERT INTO DLIST (KEY, CHUNK, START, COUNT, ITEMS)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(KEY, CHUNK) DO UPDATE SET
+            START = excluded.START, COUNT = excluded.COUNT, ITEMS = excluded.ITEMS""",
+            rows,
+        )
+
+    @staticmethod
+    async def __write_hashes(conn: aiosqlite.Connection, hashes: HashSnapshot) -> None:
+        cleared, hash_fields, packed_hashes = hashes
+        if not cleared and not hash_fields and not packed_hashes:
+            return
+
+        # 整体删除或编码改变的哈希表两种存储方式的数据都要删除
+        await conn.executemany(
+            """DELETE FROM HASHMAP WHERE KEY = ?""", [(key,) for key in cleared]
+        )
+        await conn.executemany(
+            """DELETE FROM HASHMAP_PACKED WHERE KEY = ?""", [(key,) for key in cleared]
+        )
+        await conn.executemany(
+            """DELETE FROM HASHMAP WHERE KEY = ? AND FIELD = ?""",
+            [
+                (key, field)
+                for key, fields in hash_fields.items()
+                for field, value in fields.items()
+                if value is None
+            ],
+        )
+        loop = asyncio.get_running_loop()
+        await conn.executemany(
+            """INSERT INTO HASHMAP (KEY, FIELD, VALUE) VALUES (?, ?, ?)
+            ON CONFLICT(KEY, FIELD) DO UPDATE SET VALUE = excluded.VALUE""",
+            await loop.run_in_executor(None, _encode_hash_fields, hash_fields),
+        )
+        await conn.executemany(
+            """INSERT INTO HASHMAP_PACKED (KEY, COUNT, ITEMS) VALUES (?, ?, ?)
+            ON CONFLICT(KEY) DO UPDATE SET
+            COUNT = excluded.COUNT, ITEMS = excluded.ITEMS""",
+            await loop.run_in_executor(None, _encode_packed_hashes, packed_hashes),
+        )
+
+    @staticmethod
+    async def __write_expires(
+        conn: aiosqlite.Connection, expires: ExpireSnapshot
+    ) -> None:
+        if not expires:
+            return
+
+        await conn.executemany(
+            """DELETE FROM EXPIRES WHERE KEY = ?""",
+            [(key,) for key, when in expires.items() if when is None],
+        )
+        await conn.executemany(
+            """INSERT INTO EXPIRES (KEY, EXPIRE_AT) VALUES (?, ?)
+            ON CONFLICT(KEY) DO UPDATE SET EXPIRE_AT = excluded.EXPIRE_AT""",
+            [(key, when) for key, when in expires.items() if when is not None],
+        )
+
+    async def __connection(self) -> aiosqlite.Connection:
+        if self._conn is None:
+            await self.connect()
+        return self._conn  # type: ignore
 
     async def __create_database(self) -> None:
         """
         创建三个表，分别存放字符串类型，双向链表类型，哈希类型表
         """
-        await self.execute(
-            """CREATE TABLE STRING(
+        await self.execute("""CREATE TABLE STRING(
             ID INTEGER PRIMARY KEY AUTOINCREMENT,
             KEY TEXT NOT NULL UNIQUE,
-            VALUE TEXT NOT NULL);"""
-        )
-        await self.execute(
-            """CREATE TABLE DLIST (
+            VALUE TEXT NOT NULL);""")
+        await self.execute("""CREATE TABLE DLIST (
             ID INTEGER PRIMARY KEY AUTOINCREMENT,
             KEY TEXT NOT NULL,
             VALUE TEXT NOT NULL,
             PREV_ID INTEGER,
             NEXT_ID INTEGER,
             FOREIGN KEY (PREV_ID) REFERENCES DLIST(ID),
-            FOREIGN KEY (NEXT_ID) REFERENCES DLIST(ID));"""
-        )
-        await self.execute(
-            """CREATE TABLE HASHMAP (
+            FOREIGN KEY (NEXT_ID) REFERENCES DLIST(ID));""")
+        await self.execute("""CREATE TABLE HASHMAP (
             ID INTEGER PRIMARY KEY AUTOINCREMENT,
             KEY TEXT NOT NULL,
             FIELD TEXT NOT NULL,
-            VALUE TEXT NOT NULL);"""
-        )
+            VALUE TEXT NOT NULL);""")
 
     @overload
     async def execute(
@@ -107,31 +956,38 @@ class Database:
         :param fetchone: 是否获取单个结果
         :param fetchall: 是否获取所有结果
         """
-        async with self.__connect() as conn:
-            conn.row_factory = aiosqlite.Row
-            cursor = await conn.cursor()
+        conn = await self.__connection()
 
+        async with self._write_lock, conn.cursor() as cursor:
+            # 不含等待写锁的时间
+            start = time.perf_counter()
             try:
-                await cursor.execute(query, params)
-            except aiosqlite.IntegrityError:
-                msg = "违反唯一性或外键约束！"
-                logger.error(msg)
-                return msg
-            except (aiosqlite.OperationalError, sqlite3.OperationalError) as e:
-                msg = f"操作错误: {e}"
-                logger.error(msg, exc_info=True)
-                return msg
-            except Exception as e:
-                msg = f"其他错误: {e}"
-                logger.error(e, exc_info=True)
-                return msg
+                try:
+                    await cursor.execute(query, params)
+                except aiosqlite.IntegrityError:
+                    await conn.rollback()
+                    msg = "违反唯一性或外键约束！"
+                    logger.error(msg)
+                    return msg
+                except (aiosqlite.OperationalError, sqlite3.OperationalError) as e:
+                    await conn.rollback()
+                    msg = f"操作错误: {e}"
+                    logger.error(msg, exc_info=True)
+                    return msg
+                except Exception as e:
+                    await conn.rollback()
+                    msg = f"其他错误: {e}"
+                    logger.error(e, exc_info=True)
+                    return msg
 
-            if fetchone:
-                return await cursor.fetchone()
-            if fetchall:
-                return await cursor.fetchall()
+                if fetchone:
+                    return await cursor.fetchone()
+                if fetchall:
+                    return await cursor.fetchall()
 
-            await conn.commit()
+                await conn.commit()
+            finally:
+                stats.record_statement(query.split(None, 1)[0].upper(), start)
 
         return "1"  # Succeed.
 
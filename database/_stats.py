@@ -0,0 +1,282 @@
+import time
+from collections import deque
+from typing import Deque, Dict, Iterator, List, NamedTuple, Sequence, Tuple
+
+from config import server_config
+
+SUB_BUCKET_BITS = 4
+"""每个 2 的幂区间划分的桶数为 2**SUB_BUCKET_BITS，相对误差不超过 1/16"""
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+MAX_EXPONENT = 36
+"""可记录的最大值约为 2**36 微秒(约 19 小时)，更大的值计入最后一个桶"""
+PROMETHEUS_BUCKETS = tuple(1 << i for i in range(3, 24))
+"""Prometheus 直方图的桶上界(微秒)：8 微秒到约 8 秒，2 的幂恰好是分桶边界"""
+SLOWLOG_MAX_ARGS = 32
+"""慢查询日志中每条指令最多记录的参数个数"""
+SLOWLOG_MAX_ARG_LEN = 128
+"""慢查询日志中每个参数最多记录的字符数"""
+
+
+class Histogram:
+    """
+    HDR 风格的对数分桶直方图，以微秒为单位
+
+    小于 16 的值每个值一个桶，之后每个 2 的幂区间均分为 16 个桶，
+    记录一个值只需计算桶下标并计数，分位数的相对误差不超过 1/16
+    """
+
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self) -> None:
+        self.counts = [0] * ((MAX_EXPONENT + 1) * SUB_BUCKETS)
+        self.count = 0
+        self.total = 0
+        """所有值之和"""
+        self.max = 0
+
+    @staticmethod
+    def _index(value: int) -> int:
+        if value < SUB_BUCKETS:
+            return value
+        shift = value.bit_length() - SUB_BUCKET_BITS - 1
+        return min(
+            (shift + 1) * SUB_BUCKETS + (value >> shift) - SUB_BUCKETS,
+            MAX_EXPONENT * SUB_BUCKETS + SUB_BUCKETS - 1,
+        )
+
+    @staticmethod
+    def _upper_bound(index: int) -> int:
+        """
+        桶中的最大值
+        """
+        if index < SUB_BUCKETS:
+            return index
+        shift = index // SUB_BUCKETS - 1
+        return ((index % SUB_BUCKETS + SUB_BUCKETS + 1) << shift) - 1
+
+    def record(self, value: int) -> None:
+        self.counts[self._index(value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, q: float) -> int:
+        """
+        第 q 分位数(0 到 100)，返回所在桶的上界，不超过记录过的最大值
+        """
+        if not self.count:
+            return 0
+        rank = max(1, int(self.count * q / 100 + 0.5))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self._upper_bound(index), self.max)
+        return self.max
+
+    def cumulative(self, bounds: Sequence[int]) -> Iterator[Tuple[int, int]]:
+        """
+        依次返回 (上界, 小于该上界的值的个数)，bounds 需为升序的 2 的幂
+        """
+        seen = 0
+        index = 0
+        for bound in bounds:
+            end = self._index(bound - 1)
+            while index <= end:
+                seen += self.counts[index]
+                index += 1
+            yield bound, seen
+
+    def reset(self) -> None:
+        self.counts = [0] * len(self.counts)
+        self.count = self.total = self.max = 0
+
+
+class CommandStats:
+    """
+    一条指令的调用次数、出错次数和延迟分布
+    """
+
+    __slots__ = ("calls", "errors", "latency")
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.errors = 0
+        self.latency = Histogram()
+
+
+class SlowLogEntry(NamedTuple):
+    id: int
+    timestamp: int
+    """开始执行的时间(Unix 时间戳，秒)"""
+    duration: int
+    """执行耗时(微秒)"""
+    argv: Tuple[str, ...]
+
+
+class Stats:
+    """
+    指令与 SQLite 语句的执行统计，以及慢查询日志
+    """
+
+    def __init__(self, slowlog_slower_than: int = 10000, slowlog_max_len: int = 128):
+        """
+        :param slowlog_slower_than: 执行时间超过多少微秒的指令记入慢查询日志，负数表示不记录
+        :param slowlog_max_len: 慢查询日志最多保留的条数
+        """
+        self.slowlog_slower_than = slowlog_slower_than
+        self.commands: Dict[str, CommandStats] = {}
+        self.statements: Dict[str, Histogram] = {}
+        """按语句类型(SELECT、INSERT、TRANSACTION 等)统计的 SQLite 执行时间"""
+        self.slowlog: Deque[SlowLogEntry] = deque(maxlen=slowlog_max_len)
+        self._slowlog_id = 0
+        self.start_time = time.time()
+
+    def record_command(
+        self, name: str, argv: Sequence[str], start: float, error: bool = False
+    ) -> None:
+        """
+        记录一次指令执行
+
+        :param start: 开始执行时 time.perf_counter() 的值
+        """
+        duration = int((time.perf_counter() - start) * 1e6)
+        stats = self.commands.get(name)
+        if stats is None:
+            stats = self.commands[name] = CommandStats()
+        stats.calls += 1
+        stats.errors += error
+        stats.latency.record(duration)
+
+        if 0 <= self.slowlog_slower_than <= duration:
+            args = [
+                (
+                    arg
+                    if len(arg) <= SLOWLOG_MAX_ARG_LEN
+                    else f"{arg[:SLOWLOG_MAX_ARG_LEN]}..."
+                )
+                for arg in argv[:SLOWLOG_MAX_ARGS]
+            ]
+            if len(argv) > SLOWLOG_MAX_ARGS:
+                args.append(f"... ({len(argv) - SLOWLOG_MAX_ARGS} more arguments)")
+            self._slowlog_id += 1
+            self.slowlog.appendleft(
+                SlowLogEntry(
+                    self._slowlog_id,
+                    int(time.time() - duration / 1e6),
+                    duration,
+                    tuple(args),
+                )
+            )
+
+    def record_error(self, name: str) -> None:
+        """
+        记录一次未执行的指令(参数有误、副本拒绝写入等)
+        """
+        stats = self.commands.get(name)
+        if stats is None:
+            stats = self.commands[name] = CommandStats()
+        stats.errors += 1
+
+    def record_statement(self, kind: str, start: float) -> None:
+        """
+        记录一次 SQLite 语句或事务的执行时间
+        """
+        histogram = self.statements.get(kind)
+        if histogram is None:
+            histogram = self.statements[kind] = Histogram()
+        histogram.record(int((time.perf_counter() - start) * 1e6))
+
+    def reset(self) -> None:
+        self.commands.clear()
+        self.statements.clear()
+
+    def info(self) -> Dict[str, object]:
+        """
+        总体统计信息
+        """
+        return {
+            "uptime_in_seconds": int(time.time() - self.start_time),
+            "total_commands_processed": sum(s.calls for s in self.commands.values()),
+            "total_error_replies": sum(s.errors for s in self.commands.values()),
+            "slowlog_len": len(self.slowlog),
+        }
+
+    def command_info(self) -> Dict[str, object]:
+        """
+        每条指令的调用次数、总耗时、平均耗时(微秒)及出错次数
+        """
+        return {
+            f"cmdstat_{name}": (
+                f"calls={s.calls},usec={s.latency.total},"
+                f"usec_per_call={s.latency.total / max(s.calls, 1):.2f},"
+                f"errors={s.errors}"
+            )
+            for name, s in sorted(self.commands.items())
+        }
+
+    def latency_info(self) -> Dict[str, object]:
+        """
+        每条指令及每类 SQLite 语句的延迟分位数(微秒)
+        """
+        histograms = [
+            (name, s.latency) for name, s in sorted(self.commands.items()) if s.calls
+        ]
+        histograms += [
+            (f"sql_{kind.lower()}", h) for kind, h in sorted(self.statements.items())
+        ]
+        return {
+            f"latency_percentiles_usec_{name}": (
+                f"p50={h.percentile(50)},p99={h.percentile(99)},"
+                f"p99.9={h.percentile(99.9)},max={h.max}"
+            )
+            for name, h in histograms
+        }
+
+    def prometheus(self, gauges: Dict[str, Dict[str, object]]) -> str:
+        """
+        Prometheus 文本格式的指标
+
+        :param gauges: info 指令各类别的信息，其中的数值作为 gauge 输出
+        """
+        lines: List[str] = []
+
+        def histogram(name: str, label: str, items: List[Tuple[str, Histogram]]):
+            lines.append(f"# TYPE {name} histogram")
+            for value, h in items:
+                for bound, count in h.cumulative(PROMETHEUS_BUCKETS):
+                    lines.append(
+                        f'{name}_bucket{{{label}="{value}",le="{bound / 1e6}"}} {count}'
+                    )
+                lines.append(f'{name}_bucket{{{label}="{value}",le="+Inf"}} {h.count}')
+                lines.append(f'{name}_sum{{{label}="{value}"}} {h.total / 1e6}')
+                lines.append(f'{name}_count{{{label}="{value}"}} {h.count}')
+
+        commands = sorted(self.commands.items())
+        lines.append("# TYPE kvstore_commands_total counter")
+        for name, s in commands:
+            lines.append(f'kvstore_commands_total{{command="{name}"}} {s.calls}')
+        lines.append("# TYPE kvstore_command_errors_total counter")
+        for name, s in commands:
+            lines.append(f'kvstore_command_errors_total{{command="{name}"}} {s.errors}')
+        histogram(
+            "kvstore_command_duration_seconds",
+            "command",
+            [(name, s.latency) for name, s in commands],
+        )
+        histogram(
+            "kvstore_sqlite_duration_seconds",
+            "statement",
+            sorted(self.statements.items()),
+        )
+
+        for section, info in gauges.items():
+            for key, value in info.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    lines.append(f"# TYPE kvstore_{section}_{key} gauge")
+                    lines.append(f"kvstore_{section}_{key} {value}")
+        return "\n".join(lines) + "\n"
+
+
+stats = Stats(server_config.slowlog_log_slower_than, server_config.slowlog_max_len)
@@ -1,6 +1,25 @@
-from typing import List, Optional, overload
+import base64
+import binascii
+import time
+from typing import Iterable, List, Optional, Tuple, Union, overload
 
-from ._sqlite import database
+from protocol import ErrorReply
+
+from ._keyspace import field_size, item_size, keyspace
+from ._snapshot import SnapshotError, dump_key, load_key
+
+OOM_MESSAGE = ErrorReply("内存已达到 maxmemory 上限，无法写入!")
+
+
+def _list_range(start: int, end: int, length: int) -> Tuple[int, int]:
+    """
+    将可以为负数的 start、end 换算为链表中的位置，start 不小于 0，end 不超过最后一个位置
+    """
+    if start < 0:
+        start = max(start + length, 0)
+    if end < 0:
+        end += length
+    return start, min(end, length - 1)
 
 
 class String:
@@ -9,41 +28,85 @@ class String:
     """
 
     @staticmethod
-    async def set(key: str, value: str) -> str:
+    async def set(key: str, value: str, ex: Optional[int] = None) -> str:
         """
-        存储 key-value 类型数据
+        存储 key-value 类型数据，key 已存在时覆盖原有的 value 并清除过期时间
+
+        :param ex: 过期时间(秒)
         """
-        return await database.execute(
-            """INSERT INTO STRING (KEY, VALUE) VALUES (?, ?)""",
-            params=(key, value),
-            fetchone=False,
-            fetchall=False,
+        keyspace.touch(key)
+        if not keyspace.reserve():
+            return OOM_MESSAGE
+
+        old = keyspace.strings.get(key)
+        keyspace.strings[key] = value
+        keyspace.dirty_strings.add(key)
+        keyspace.grow(
+            key, item_size(value) - (item_size(old) if old is not None else 0)
         )
+        keyspace.propagate("set", key, value)
+        if ex is not None:
+            when = time.time() + ex
+            keyspace.set_expire(key, when)
+            keyspace.propagate("expireat", key, repr(when))
+        else:
+            keyspace.persist(key)
+        return "1"
 
     @staticmethod
     async def get(key: str) -> str:
         """
         获取 key 对应的 value
         """
-        row = await database.execute(
-            """SELECT * FROM STRING WHERE KEY = ?""",
-            params=(key,),
-            fetchone=True,
-            fetchall=False,
-        )
-        return row[2] if row else f"指定的键 {key} 不存在!"
+        value = keyspace.strings.get(key) if keyspace.touch(key, read=True) else None
+        return value if value is not None else f"指定的键 {key} 不存在!"
+
+    @staticmethod
+    async def mset(items: Iterable[Tuple[str, str]]) -> str:
+        """
+        批量存储 key-value 类型数据
+        """
+        if not keyspace.reserve():
+            return OOM_MESSAGE
+
+        strings = keyspace.strings
+        dirty = keyspace.dirty_strings
+        for key, value in items:
+            keyspace.touch(key)
+            old = strings.get(key)
+            strings[key] = value
+            dirty.add(key)
+            keyspace.grow(
+                key, item_size(value) - (item_size(old) if old is not None else 0)
+            )
+            keyspace.persist(key)
+            keyspace.propagate("set", key, value)
+        return "1"
+
+    @staticmethod
+    async def mget(keys: Iterable[str]) -> List[Optional[str]]:
+        """
+        批量获取多个 key 对应的 value，不存在的 key 对应 None
+        """
+        strings = keyspace.strings
+        values: List[Optional[str]] = []
+        for key in keys:
+            values.append(strings.get(key) if keyspace.touch(key, read=True) else None)
+        return values
 
     @staticmethod
     async def delete(key: str) -> str:
         """
         删除 key 对应的 value
         """
-        return await database.execute(
-            """DELETE FROM STRING WHERE KEY = ?""",
-            params=(key,),
-            fetchone=False,
-            fetchall=False,
-        )
+        keyspace.touch(key)
+        value = keyspace.strings.pop(key, None)
+        if value is not None:
+            keyspace.dirty_strings.add(key)
+            keyspace.grow(key, -item_size(value))
+            keyspace.forget(key)
+            keyspace.propagate("del", key)
+        return "1"
 
 
 class LinkedList:
@@ -52,200 +115,177 @@ class LinkedList:
     """
 
     @staticmethod
-    async def rpush(key: str, value: str) -> str:
+    async def rpush(key: str, *values: str) -> str:
         """
-        放一个数据在左端
+        依次放一个或多个数据在右端
         """
-        # 获得左(上一个)元素的 id
-        last_item = await database.execute(
-            """SELECT ID FROM DLIST WHERE KEY = ? AND NEXT_ID IS NULL LIMIT 1""",
-            params=(key,),
-            fetchone=True,
-        )
-        last_id = last_item[0] if last_item else None
-        # 插入右(新)元素
-        await database.execute(
-            """INSERT INTO DLIST (KEY, VALUE, PREV_ID) VALUES (?, ?, ?);""",
-            params=(key, value, last_id),
-        )
-        # 获取右(新)元素的 id
-        new_item = await database.execute(
-            """SELECT ID FROM DLIST WHERE KEY = ? ORDER BY ID DESC LIMIT 1""",
-            params=(key,),
-            fetchone=True,
-        )
-        new_id = new_item[0]  # type:ignore
-        # 更新左(上一个)一个元素的 next_id
-        if last_id is not None:
-            await database.execute(
-                """UPDATE DLIST SET NEXT_ID = ? WHERE ID = ?""",
-                params=(new_id, last_id),
-            )
+        keyspace.touch(key)
+        if not keyspace.reserve():
+            return OOM_MESSAGE
+
+        items = keyspace.get_list(key)
+        for value in values:
+            items.push_right(value)
+        keyspace.dirty_lists.add(key)
+        keyspace.grow(key, sum(item_size(value) for value in values))
+        keyspace.propagate("rpush", key, *values)
         return "1"
 
     @staticmethod
-    async def lpush(key: str, value: str) -> str:
+    async def lpush(key: str, *values: str) -> str:
         """
-        放一个数据在右端
+        依次放一个或多个数据在左端，最后放入的数据位于最左端
         """
-        # 获得右(第一个插入)元素的 id
-        prev_item = await database.execute(
-            """SELECT ID FROM DLIST WHERE KEY = ? AND PREV_ID IS NULL LIMIT 1""",
-            params=(key,),
-            fetchone=True,
-        )
-        prev_id = prev_item[0] if prev_item else None
-        # 插入新元素
-        await database.execute(
-            """INSERT INTO DLIST (KEY, VALUE, NEXT_ID) VALUES (?, ?, ?);""",
-            params=(key, value, prev_id),
-        )
-        # 获取新元素的 id
-        new_item = await database.execute(
-            """SELECT ID FROM DLIST WHERE KEY = ? ORDER BY ID DESC LIMIT 1""",
-            params=(key,),
-            fetchone=True,
-        )
-        new_id = new_item[0]  # type:ignore
-        # 更新(第一个插入)元素的 next_id
-        if prev_id is not None:
-            await database.execute(
-                """UPDATE DLIST SET PREV_ID = ? WHERE ID = ?""",
-                params=(new_id, prev_id),
-            )
+        keyspace.touch(key)
+        if not keyspace.reserve():
+            return OOM_MESSAGE
+
+        items = keyspace.get_list(key)
+        for value in values:
+            items.push_left(value)
+        keyspace.dirty_lists.add(key)
+        keyspace.grow(key, sum(item_size(value) for value in values))
+        keyspace.propagate("lpush", key, *values)
         return "1"
 
     @staticmethod
-    async def range(key: str, start: int, end: int) -> str:
+    async def range(key: str, start: int, end: int) -> Union[str, List[str]]:
         """
-        将 key 对应 start 到 end 位置的数据全部返回
+        将 key 对应 start 到 end 位置(包含两端)的数据全部返回，负数表示从右端倒数，-1 为最后一个
         """
+        items = keyspace.lists.get(key) if keyspace.touch(key, read=True) else None
+        if not items:
+            msg = f"双向链表 {key} 不存在数据!"
+            return msg
+
+        length = len(items)
+        start, end = _list_range(start, end, length)
+        if start >= length:
+            msg = "超出链表最大长度!"
+            return msg
         if end < start:
             msg = "end 小于 start！"
             return msg
 
-        # 获取链表第一个元素
-        first_item = await database.execute(
-            """SELECT * FROM DLIST WHERE KEY = ? AND PREV_ID IS NULL""",
-            params=(key,),
-            fetchone=True,
-        )
-
-        if first_item is None:
-            msg = f"双向链表 {key} 不存在数据!"
-            return msg
+        return items.slice(start, end + 1)
 
-        next_id = first_item[0]
-        results: List[str] = []
+    @staticmethod
+    async def lindex(key: str, index: int) -> Optional[str]:
+        """
+        获取 key 中第 index 个数据，负数表示从右端倒数，超出范围时返回 None
+        """
+        items = keyspace.lists.get(key) if keyspace.touch(key, read=True) else None
+        if not items or not -len(items) <= index < len(items):
+            return None
+        return items[index]
 
-        while next_id:
-            query_result = await database.execute(
-                """SELECT * FROM DLIST WHERE KEY = ? AND ID = ?""",
-                params=(key, next_id),
-                fetchone=True,
-            )
-            results.append(query_result[2])  # type:ignore
-            next_id = query_result[4]  # type:ignore
+    @staticmethod
+    async def lset(key: str, index: int, value: str) -> str:
+        """
+        替换 key 中第 index 个数据，负数表示从右端倒数
+        """
+        keyspace.touch(key)
+        if not keyspace.reserve():
+            return OOM_MESSAGE
 
-        if end - start - 1 > len(results):
-            msg = "超出链表最大长度!"
+        items = keyspace.lists.get(key)
+        if not items:
+            msg = f"双向链表 {key} 不存在数据!"
             return msg
+        if not -len(items) <= index < len(items):
+            return ErrorReply("超出链表最大长度!")
 
-        return " ".join(results[start : end + 1])
+        old = items.replace(index % len(items), value)
+        keyspace.dirty_lists.add(key)
+        keyspace.grow(key, len(value) - len(old))
+        keyspace.propagate("lset", key, str(index), value)
+        return "1"
+
+    @staticmethod
+    async def ltrim(key: str, start: int, end: int) -> str:
+        """
+        只保留 key 中 start 到 end 位置(包含两端)的数据，负数表示从右端倒数，范围为空时删除 key
+        """
+        keyspace.touch(key)
+        items = keyspace.lists.get(key)
+        if not items:
+            return "1"
+
+        start, end = _list_range(start, end, len(items))
+        if start > end:
+            removed: Iterable[str] = items
+            del keyspace.lists[key]
+        else:
+            removed = items.trim(start, end)
+            if not removed:
+                return "1"
+        keyspace.dirty_lists.add(key)
+        keyspace.grow(key, -sum(item_size(value) for value in removed))
+        keyspace.forget(key)
+        keyspace.propagate("ltrim", key, str(start), str(end))
+        return "1"
 
     @staticmethod
     async def len(key: str) -> str:
         """
         获取 key 存储数据的个数
         """
-        first_item = await database.execute(
-            """SELECT ID FROM DLIST WHERE KEY = ? AND PREV_ID is NULL""",
-            params=(key,),
-            fetchone=True,
-        )
-
-        if first_item is None:
-            return "0"
-
-        next_id = first_item[0]
-        counter = 0
-
-        while next_id:
-            query_result = await database.execute(
-                """SELECT * FROM DLIST WHERE KEY = ? AND ID = ?""",
-                params=(key, next_id),
-                fetchone=True,
-            )
-            next_id = query_result[4]  # type:ignore
-            counter += 1
-
-        return str(counter)
+        items = keyspace.lists.get(key) if keyspace.touch(key, read=True) else None
+        return str(len(items)) if items else "0"
 
     @staticmethod
     async def lpop(key: str) -> str:
         """
         获取key最左端的数据并删除
         """
-        first_item = await database.execute(
-            """SELECT * FROM DLIST WHERE KEY = ? AND PREV_ID IS NULL""",
-            params=(key,),
-            fetchone=True,
-        )
-
-        if first_item is None:
+        keyspace.touch(key)
+        items = keyspace.lists.get(key)
+        if not items:
             msg = f"双向链表 {key} 不存在数据!"
             return msg
 
-        item_id = first_item[0]
-        item_next_id = first_item[4]
-        if item_next_id is not None:
-            await database.execute(
-                """UPDATE DLIST SET PREV_ID = NULL WHERE ID = ?""",
-                params=(item_next_id,),
-            )
-
-        await database.execute("""DELETE FROM DLIST WHERE ID = ?""", params=(item_id,))
-
-        return first_item[2]
+        value = items.pop_left()
+        keyspace.grow(key, -item_size(value))
+        if not items:
+            del keyspace.lists[key]
+            keyspace.forget(key)
+        keyspace.dirty_lists.add(key)
+        keyspace.propagate("lpop", key)
+        return value
 
     @staticmethod
     async def rpop(key: str) -> str:
         """
         获取key最右端的数据并删除
         """
-        last_item = await database.execute(
-            """SELECT * FROM DLIST WHERE KEY = ? AND NEXT_ID IS NULL""",
-            params=(key,),
-            fetchone=True,
-        )
-
-        if last_item is None:
+        keyspace.touch(key)
+        items = keyspace.lists.get(key)
+        if not items:
             msg = f"双向链表 {key} 不存在数据!"
             return msg
 
-        item_id = last_item[0]
-        item_prev_id = last_item[3]
-        if item_prev_id is not None:
-            await database.execute(
-                """UPDATE DLIST SET NEXT_ID = NULL WHERE ID = ?""",
-                params=(item_prev_id,),
-            )
-
-        await database.execute("""DELETE FROM DLIST WHERE ID = ?""", params=(item_id,))
-
-        return last_item[2]
+        value = items.pop_right()
+        keyspace.grow(key, -item_size(value))
+        if not items:
+            del keyspace.lists[key]
+            keyspace.forget(key)
+        keyspace.dirty_lists.add(key)
+        keyspace.propagate("rpop", key)
+        return value
 
     @staticmethod
     async def ldel(key: str) -> str:
         """
         删除key 所有的数据
         """
-        return await database.execute(
-            """DELETE FROM DLIST WHERE KEY = ?""",
-            params=(key,),
-            fetchall=False,
-            fetchone=False,
-        )
+        keyspace.touch(key)
+        items = keyspace.lists.pop(key, None)
+        if items is not None:
+            keyspace.dirty_lists.add(key)
+            keyspace.grow(key, -sum(item_size(value) for value in items))
+            keyspace.forget(key)
+            keyspace.propagate("ldel", key)
+        return "1"
 
 
 class HashMap:
@@ -258,29 +298,86 @@ class HashMap:
         """
         存储key对应的键值对数据
         """
-        return await database.execute(
-            """INSERT INTO HASHMAP (KEY, FIELD, VALUE) VALUES (?, ?, ?);""",
-            params=(key, field, value),
-            fetchall=False,
-            fetchone=False,
+        keyspace.touch(key)
+        if not keyspace.reserve():
+            return OOM_MESSAGE
+
+        fields = keyspace.hashes.get(key)
+        if fields is None:
+            fields = keyspace.hashes[key] = {}
+        old = fields.get(field)
+        fields[field] = value
+        keyspace.mark_hash_field(key, field)
+        keyspace.check_hash_encoding(key, field, value)
+        keyspace.grow(
+            key,
+            field_size(field, value)
+            - (field_size(field, old) if old is not None else 0),
         )
+        keyspace.propagate("hset", key, field, value)
+        return "1"
+
+    @staticmethod
+    async def hmset(key: str, items: Iterable[Tuple[str, str]]) -> str:
+        """
+        批量存储key对应的键值对数据
+        """
+        keyspace.touch(key)
+        if not keyspace.reserve():
+            return OOM_MESSAGE
+
+        fields = keyspace.hashes.get(key)
+        if fields is None:
+            fields = keyspace.hashes[key] = {}
+        size = 0
+        argv = ["hmset", key]
+        for field, value in items:
+            old = fields.get(field)
+            fields[field] = value
+            keyspace.mark_hash_field(key, field)
+            keyspace.check_hash_encoding(key, field, value)
+            size += field_size(field, value) - (
+                field_size(field, old) if old is not None else 0
+            )
+            argv += (field, value)
+        if not fields:
+            del keyspace.hashes[key]
+        else:
+            keyspace.grow(key, size)
+            keyspace.propagate(*argv)
+        return "1"
 
     @staticmethod
     async def hget(key: str, field: str) -> str:
         """
         获取key中field字段的value值
         """
-        item = await database.execute(
-            """SELECT * FROM HASHMAP WHERE KEY = ? AND field = ?""",
-            params=(key, field),
-            fetchone=True,
-        )
+        fields = keyspace.hashes.get(key) if keyspace.touch(key, read=True) else None
+        value = fields.get(field) if fields else None
 
-        if item is None:
+        if value is None:
             msg = f"哈希表 {key} 不存在或者不存在 {field}!"
             return msg
 
-        return item[3]
+        return value
+
+    @staticmethod
+    async def hmget(key: str, fields: Iterable[str]) -> List[Optional[str]]:
+        """
+        获取key中多个field字段的value值，不存在的字段对应 None
+        """
+        values = keyspace.hashes.get(key, {}) if keyspace.touch(key, read=True) else {}
+        return [values.get(field) for field in fields]
+
+    @staticmethod
+    async def hgetall(key: str) -> List[Optional[str]]:
+        """
+        获取key中所有的field字段及其value值，按 field, value 依次排列
+        """
+        fields = keyspace.hashes.get(key) if keyspace.touch(key, read=True) else None
+        if not fields:
+            return []
+        return [item for pair in fields.items() for item in pair]
 
     @overload
     @staticmethod
@@ -300,17 +397,131 @@ class HashMap:
 
     @staticmethod
     async def hdel(key: str, field: Optional[str] = None) -> str:
+        keyspace.touch(key)
+        fields = keyspace.hashes.get(key)
+        if fields is None:
+            return "1"
+
         if field is not None:
-            return await database.execute(
-                """DELETE FROM HASHMAP WHERE KEY = ? AND FIELD = ?""",
-                params=(key, field),
-                fetchall=False,
-                fetchone=False,
-            )
+            value = fields.pop(field, None)
+            if value is None:
+                return "1"
+            keyspace.mark_hash_field(key, field)
+            keyspace.grow(key, -field_size(field, value))
+            keyspace.propagate("hdel", key, field)
+            if fields:
+                return "1"
+        else:
+            keyspace.propagate("hdel", key)
+
+        del keyspace.hashes[key]
+        keyspace.mark_hash_cleared(key)
+        keyspace.grow(key, -sum(field_size(f, v) for f, v in fields.items()))
+        keyspace.forget(key)
+        return "1"
 
-        return await database.execute(
-            """DELETE FROM HASHMAP WHERE KEY = ?""",
-            params=(key,),
-            fetchall=False,
-            fetchone=False,
-        )
+
+class Keys:
+    """
+    键的通用操作方法，作用于同名的所有类型数据
+    """
+
+    @staticmethod
+    async def expire(key: str, seconds: int) -> str:
+        """
+        为 key 设置过期时间(秒)，key 不存在时返回 0
+        """
+        keyspace.touch(key)
+        if not keyspace.exists(key):
+            return "0"
+
+        if seconds <= 0:
+            keyspace.remove(key)
+        else:
+            when = time.time() + seconds
+            keyspace.set_expire(key, when)
+            keyspace.propagate("expireat", key, repr(when))
+        return "1"
+
+    @staticmethod
+    async def ttl(key: str) -> str:
+        """
+        获取 key 的剩余生存时间(秒)，key 不存在时返回 -2，未设置过期时间时返回 -1
+        """
+        if not keyspace.touch(key) or not keyspace.exists(key):
+            return "-2"
+
+        when = keyspace.expires.get(key)
+        if when is None:
+            return "-1"
+        return str(max(0, round(when - time.time())))
+
+    @staticmethod
+    async def persist(key: str) -> str:
+        """
+        移除 key 的过期时间，key 不存在或未设置过期时间时返回 0
+        """
+        keyspace.touch(key)
+        if not keyspace.persist(key):
+            return "0"
+        keyspace.propagate("persist", key)
+        return "1"
+
+    @staticmethod
+    async def encoding(key: str) -> Optional[str]:
+        """
+        key 各类型数据的编码(存储方式)，按字符串、链表、哈希表的顺序以空格分隔，
+        key 不存在时返回 None
+        """
+        if not keyspace.touch(key):
+            return None
+        encodings = []
+        if key in keyspace.strings:
+            encodings.append("raw")
+        if key in keyspace.lists:
+            encodings.append("quicklist")
+        if key in keyspace.hashes:
+            encodings.append(keyspace.hash_encoding(key))
+        return " ".join(encodings) if encodings else None
+
+    @staticmethod
+    async def dump(key: str) -> Optional[str]:
+        """
+        将 key 的所有类型的数据及过期时间序列化为 Base64 文本，key 不存在时返回 None
+        """
+        if not keyspace.touch(key, read=True) or not keyspace.exists(key):
+            return None
+        return base64.b64encode(dump_key(key)).decode()
+
+    @staticmethod
+    async def restore(key: str, payload: str) -> str:
+        """
+        用 dump 的结果替换 key 的所有数据，可用于在服务器之间迁移 key
+        """
+        try:
+            value, items, fields, when = load_key(base64.b64decode(payload))
+        except (binascii.Error, SnapshotError) as e:
+            return ErrorReply(f"无效的 DUMP 数据: {e}")
+
+        keyspace.touch(key)
+        keyspace.remove(key)
+        if when is not None and when <= time.time():
+            return "1"
+
+        # 通过各类型的写方法写入，内存统计、回写、AOF 与普通写命令一致
+        if value is not None:
+            result = await String.set(key, value)
+            if result != "1":
+                return result
+        if items:
+            result = await LinkedList.rpush(key, *items)
+            if result != "1":
+                return result
+        if fields:
+            result = await HashMap.hmset(key, fields.items())
+            if result != "1":
+                return result
+        if when is not None:
+            keyspace.set_expire(key, when)
+            keyspace.propagate("expireat", key, repr(when))
+        return "1"
@@ -1,19 +1,233 @@
+import atexit
 import logging
 import os
+import queue
+import random
+import threading
 import time
+from logging.handlers import QueueHandler
+from typing import Iterable, List, Optional, Union
 
 import colorlog
 
+from config import log_config
 
-def _init_logger(console_handler_level: int = logging.INFO) -> logging.Logger:
+LOG_BATCH_SIZE = 1024
+"""写日志线程每次最多合并写入的日志条数"""
+
+# 日志格式不使用线程、进程信息，不收集以减少调用线程创建日志记录的开销
+logging.logThreads = False
+logging.logProcesses = False
+logging.logMultiprocessing = False
+
+
+class Joined:
+    """
+    以空格连接的参数，格式化日志时才拼接字符串，用于 %s 占位符
+    """
+
+    __slots__ = ("items",)
+
+    def __init__(self, items: Iterable[str]) -> None:
+        self.items = items
+
+    def __str__(self) -> str:
+        return " ".join(self.items)
+
+
+class _RotatingFileHandler(logging.FileHandler):
+    """
+    按日期和大小轮转的日志文件
+
+    日志写入 <directory>/<日期>.log，日期变化时换用新文件；文件超过 max_bytes 时重命名为
+    <日期>.<序号>.log 后重新打开。历史日志文件超过 backup_count 个时删除最旧的文件
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 0, backup_count: int = 0):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.date = self._today()
+        os.makedirs(directory, exist_ok=True)
+        super().__init__(self._path(self.date), encoding="utf-8", delay=True)
+
+    @staticmethod
+    def _today() -> str:
+        return time.strftime("%Y-%m-%d", time.localtime())
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, f"{name}.log")
+
+    def get_stream(self):
+        """
+        需要轮转时先轮转，返回当前日志文件
+        """
+        if self._today() != self.date or (
+            self.stream is not None
+            and self.max_bytes
+            and os.fstat(self.stream.fileno()).st_size >= self.max_bytes
+        ):
+            self._rollover()
+        if self.stream is None:
+            self.stream = self._open()
+        return self.stream
+
+    def _rollover(self) -> None:
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None  # type: ignore[assignment]
+        date = self._today()
+        if date == self.date:
+            index = 1
+            while os.path.exists(self._path(f"{date}.{index}")):
+                index += 1
+            try:
+                os.rename(self.baseFilename, self._path(f"{date}.{index}"))
+            except FileNotFoundError:  # 已被其他工作进程轮转
+                pass
+        self.date = date
+        self.baseFilename = os.path.abspath(self._path(date))
+
+        if self.backup_count:
+            files = sorted(
+                (
+                    entry
+                    for entry in os.scandir(self.directory)
+                    if entry.name.endswith(".log")
+                ),
+                key=lambda entry: entry.stat().st_mtime,
+            )
+            for entry in files[: -self.backup_count]:
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.get_stream()
+        super().emit(record)
+
+
+def _emit_batch(handler: logging.StreamHandler, records: List[logging.LogRecord]):
+    """
+    格式化一批日志后合并为一次写入，只 flush 一次
+    """
+    lines = []
+    for record in records:
+        if record.levelno < handler.level:
+            continue
+        try:
+            lines.append(handler.format(record))
+        except Exception:
+            handler.handleError(record)
+    if not lines:
+        return
+
+    handler.acquire()
+    try:
+        if isinstance(handler, _RotatingFileHandler):
+            stream = handler.get_stream()
+        else:
+            stream = handler.stream
+        stream.write("\n".join(lines) + "\n")
+        stream.flush()
+    except Exception:
+        handler.handleError(records[-1])
+    finally:
+        handler.release()
+
+
+_QueueItem = Union[logging.LogRecord, threading.Event, None]
+"""日志记录；flush 时放入 Event，写入之前的日志后通知；stop 时放入 None"""
+
+
+class _QueueHandler(QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 不在调用线程中格式化，日志参数在写日志线程中才格式化为字符串
+        return record
+
+
+class _LogWriter:
+    """
+    写日志线程
+
+    调用线程(事件循环)只把日志记录放入队列，由该线程取出队列中积累的全部记录，
+    格式化后每个处理器合并为一次写入
+    """
+
+    def __init__(self, handlers: List[logging.StreamHandler]) -> None:
+        self.handlers = handlers
+        self.queue: "queue.SimpleQueue[_QueueItem]" = queue.SimpleQueue()
+        self.handler = _QueueHandler(self.queue)
+        self._thread: Optional[threading.Thread] = None
+        self.start()
+
+    def start(self) -> None:
+        self._thread = threading.Thread(
+            target=self._run, name="log-writer", daemon=True
+        )
+        self._thread.start()
+
+    def _run(self) -> None:
+        log_queue = self.queue
+        while True:
+            records = [log_queue.get()]
+            while len(records) < LOG_BATCH_SIZE:
+                try:
+                    records.append(log_queue.get_nowait())
+                except queue.Empty:
+                    break
+            batch = [item for item in records if isinstance(item, logging.LogRecord)]
+            for handler in self.handlers:
+                _emit_batch(handler, batch)
+            for item in records:
+                if isinstance(item, threading.Event):
+                    item.set()
+            if any(item is None for item in records):
+                return
+
+    def flush(self) -> None:
+        """
+        等待队列中已有的日志写入完成
+        """
+        if self._thread is not None and self._thread.is_alive():
+            done = threading.Event()
+            self.queue.put_nowait(done)
+            done.wait()
+
+    def stop(self) -> None:
+        """
+        写入队列中剩余的日志后停止线程
+        """
+        if self._thread is not None and self._thread.is_alive():
+            self.queue.put_nowait(None)
+            self._thread.join()
+        self._thread = None
+
+    def after_fork(self) -> None:
+        # 子进程中没有写日志线程，队列中 fork 前的日志由父进程写入
+        self.queue = self.handler.queue = queue.SimpleQueue()
+        self.start()
+
+
+_writers: List[_LogWriter] = []
+
+
+def _init_logger(
+    console_handler_level: Union[int, str] = logging.INFO,
+    name: str = __name__,
+    directory: str = log_config.dir,
+    asynchronous: bool = log_config.async_write,
+) -> logging.Logger:
     """
     初始化一个 logger 以供全局使用
 
     :param console_handler_level: 控制台日志等级
     (日志文件日志等级为 Debug)
+    :param asynchronous: 是否由写日志线程格式化并批量写入，否则在调用线程中逐条写入
     """
     # 创建logger对象
-    logger = logging.getLogger(__name__)
+    logger = logging.getLogger(name)
     logger.setLevel(logging.DEBUG)
 
     # 创建控制台日志处理器
@@ -21,10 +235,8 @@ def _init_logger(console_handler_level: int = logging.INFO) -> logging.Logger:
     console_handler.setLevel(console_handler_level)
 
     # 创建文件日志处理器
-    if not os.path.exists("logs"):
-        os.mkdir("logs")
-    file_handler = logging.FileHandler(
-        f'logs/{time.strftime("%Y-%m-%d", time.localtime())}.log', encoding="utf-8"
+    file_handler = _RotatingFileHandler(
+        directory, log_config.max_bytes, log_config.backup_count
     )
     file_handler.setLevel(logging.DEBUG)
     file_handler.setFormatter(
@@ -47,14 +259,55 @@ def _init_logger(console_handler_level: int = logging.INFO) -> logging.Logger:
     console_handler.setFormatter(color_formatter)
 
     # 移除默认的handler
-    for handler in logger.handlers:
+    for handler in logger.handlers[:]:
         logger.removeHandler(handler)
     logger.propagate = False
 
     # 添加处理器对象
-    logger.addHandler(console_handler)
-    logger.addHandler(file_handler)
+    if asynchronous:
+        writer = _LogWriter([console_handler, file_handler])
+        _writers.append(writer)
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=writer.after_fork)
+        logger.addHandler(writer.handler)
+    else:
+        logger.addHandler(console_handler)
+        logger.addHandler(file_handler)
     return logger
 
 
-logger = _init_logger()
+def flush_logger() -> None:
+    """
+    等待已经记录的日志写入完成，交互式程序在输出提示符前调用，避免日志与提示符交错
+    """
+    for writer in _writers:
+        writer.flush()
+
+
+def shutdown_logger() -> None:
+    """
+    写入队列中剩余的日志并停止写日志线程，进程通过 os._exit 退出前需要调用
+    """
+    for writer in _writers:
+        writer.stop()
+
+
+def sample_request(command: str) -> bool:
+    """
+    按指令的采样率决定是否记录一条请求日志(收到消息/发送消息)
+    """
+    rate = log_config.request_sample_rates.get(
+        command.lower(), log_config.request_sample_rate
+    )
+    return rate >= 1 or rate > random.random()
+
+
+logger = _init_logger(log_config.level)
+atexit.register(shutdown_logger)
+
+# database 包中的模块使用各自的 logger，与全局 logger 共用处理器
+_database_logger = logging.getLogger("database")
+_database_logger.setLevel(logging.DEBUG)
+_database_logger.propagate = False
+for _handler in logger.handlers:
+    _database_logger.addHandler(_handler)
@@ -0,0 +1,243 @@
+import asyncio
+from typing import Any, List, Optional, Sequence, Union
+
+BUFSIZE = 65536
+CRLF = b"\r\n"
+MAX_ARGC = 1024 * 1024
+"""一条命令最多的参数个数"""
+MAX_BULK_LEN = 512 * 1024 * 1024
+"""单个参数的最大字节数(与 Redis 的 proto-max-bulk-len 默认值相同)，避免按声明的长度分配过大的缓冲区"""
+
+
+class ProtocolError(Exception):
+    """
+    客户端发送的数据不符合 RESP 协议
+    """
+
+
+class ReplyError(Exception):
+    """
+    服务器返回了 RESP 错误
+    """
+
+
+class ErrorReply(str):
+    """
+    表示执行失败的指令结果，RESP 连接中编码为错误，纯文本模式下与普通结果相同
+    """
+
+
+class IntegerReply(str):
+    """
+    表示整数的指令结果，RESP 连接中编码为整数，纯文本模式下与普通结果相同
+    """
+
+
+class RespParser:
+    """
+    增量式 RESP2 请求解析器
+
+    数据通过 feed() 追加到缓冲区，get_command() 每次取出一条完整的命令。
+    数据不足时返回 None 并保留已经解析出的参数，收到更多数据后从中断处继续解析
+    """
+
+    def __init__(self) -> None:
+        self._buffer = bytearray()
+        self._pos = 0
+        """缓冲区中尚未解析部分的起始位置"""
+        self._base = 0
+        """缓冲区起始位置在整个数据流中的偏移量"""
+        self.offset = 0
+        """最后一条完整命令结束位置在整个数据流中的偏移量"""
+        self._argc: Optional[int] = None
+        """当前命令的参数个数"""
+        self._argv: List[str] = []
+        """当前命令已经解析出的参数"""
+        self._bulk_len: Optional[int] = None
+        """当前参数的字节长度"""
+
+    def feed(self, data: bytes) -> None:
+        """
+        向缓冲区追加数据
+        """
+        if self._pos:
+            # bytearray 从头部删除只移动起始指针，不会复制剩余数据
+            del self._buffer[: self._pos]
+            self._base += self._pos
+            self._pos = 0
+        self._buffer += data
+
+    def missing(self) -> int:
+        """
+        解析当前参数还需要的字节数，未知时返回 0
+        """
+        if self._bulk_len is None:
+            return 0
+        return max(0, self._pos + self._bulk_len + 2 - len(self._buffer))
+
+    def get_command(self) -> Optional[List[str]]:
+        """
+        从缓冲区取出一条完整的命令，数据不足时返回 None；跳过不含参数的空命令
+        """
+        while True:
+            if self._argc is None:
+                argc = self._read_int(b"*", MAX_ARGC)
+                if argc is None:
+                    return None
+                self._argc = argc
+
+            while len(self._argv) < self._argc:
+                if self._bulk_len is None:
+                    bulk_len = self._read_int(b"$", MAX_BULK_LEN)
+                    if bulk_len is None:
+                        return None
+                    self._bulk_len = bulk_len
+
+                end = self._pos + self._bulk_len
+                if len(self._buffer) < end + 2:
+                    return None
+                if self._buffer[end : end + 2] != CRLF:
+                    raise ProtocolError("参数长度与内容不符")
+
+                with memoryview(self._buffer) as view:
+                    try:
+                        self._argv.append(str(view[self._pos : end], "utf-8"))
+                    except UnicodeDecodeError:
+                        raise ProtocolError("参数不是有效的 UTF-8 文本")
+                self._pos = end + 2
+                self._bulk_len = None
+
+            argv = self._argv
+            self._argc = None
+            self._argv = []
+            self.offset = self._base + self._pos
+            if argv:
+                return argv
+
+    def _read_int(self, prefix: bytes, limit: int) -> Optional[int]:
+        """
+        读取形如 `*3\\r\\n` / `$5\\r\\n` 的长度行，长度不能超过 limit
+        """
+        end = self._buffer.find(CRLF, self._pos)
+        if end == -1:
+            if len(self._buffer) - self._pos > 64:
+                raise ProtocolError("长度行过长")
+            return None
+
+        line = self._buffer[self._pos : end]
+        if line[:1] != prefix:
+            raise ProtocolError(f"期望 {prefix.decode()}，实际收到 {bytes(line[:1])!r}")
+        try:
+            value = int(line[1:])
+        except ValueError:
+            raise ProtocolError(f"无效的长度: {bytes(line[1:])!r}")
+        if value < 0:
+            raise ProtocolError(f"无效的长度: {value}")
+        if value > limit:
+            raise ProtocolError(f"长度 {value} 超过上限 {limit}")
+
+        self._pos = end + 2
+        return value
+
+
+class RespReader:
+    """
+    在 asyncio.StreamReader 上按 RESP2 协议逐条读取命令
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, data: bytes = b"") -> None:
+        self._reader = reader
+        self._parser = RespParser()
+        self._parser.feed(data)
+
+    async def read_commands(self) -> Optional[List[List[str]]]:
+        """
+        读取缓冲区中所有完整的命令(客户端流水线发送的一批命令)，至少返回一条，
+        连接关闭时返回 None
+        """
+        while True:
+            commands: List[List[str]] = []
+            command = self._parser.get_command()
+            while command is not None:
+                commands.append(command)
+                command = self._parser.get_command()
+            if commands:
+                return commands
+
+            # 大参数一次读取剩余的全部内容，避免缓冲区多次扩容
+            data = await self._reader.read(max(BUFSIZE, self._parser.missing()))
+            if not data:
+                return None
+            self._parser.feed(data)
+
+
+async def read_reply(
+    reader: asyncio.StreamReader,
+) -> Union[None, str, List[Any]]:
+    """
+    读取一条服务器响应：批量字符串、简单字符串或整数返回字符串，数组返回列表(可以嵌套)，空值返回 None
+
+    :raises ReplyError: 服务器返回错误
+    :raises asyncio.IncompleteReadError: 连接已关闭
+    """
+    line = await reader.readuntil(CRLF)
+    prefix, body = line[:1], line[1:-2]
+    if prefix == b"$":
+        length = int(body)
+        if length < 0:
+            return None
+        return (await reader.readexactly(length + 2))[:-2].decode()
+    if prefix == b"*":
+        return [await read_reply(reader) for _ in range(int(body))]
+    if prefix in (b"+", b":"):
+        return body.decode()
+    if prefix == b"-":
+        raise ReplyError(body.decode())
+    raise ProtocolError(f"无法识别的响应: {bytes(line)!r}")
+
+
+def encode_bulk(value: str) -> bytes:
+    """
+    编码为 RESP 批量字符串
+    """
+    data = value.encode()
+    return b"$%d\r\n%b\r\n" % (len(data), data)
+
+
+def encode_integer(value: int) -> bytes:
+    """
+    编码为 RESP 整数
+    """
+    return b":%d\r\n" % value
+
+
+def encode_reply(result: Union[None, str, Sequence[Any]]) -> bytes:
+    """
+    编码指令执行结果：单个字符串编码为批量字符串，多个值编码为数组(列表中的列表编码为嵌套的数组)，
+    None 编码为空值，ErrorReply 编码为错误，IntegerReply 编码为整数
+    """
+    if isinstance(result, ErrorReply):
+        return encode_error(result)
+    if isinstance(result, IntegerReply):
+        return encode_integer(int(result))
+    if isinstance(result, str):
+        return encode_bulk(result)
+    if result is None:
+        return b"$-1\r\n"
+
+    parts = [b"*%d\r\n" % len(result)]
+    for value in result:
+        if isinstance(value, str):
+            parts.append(encode_bulk(value))
+        elif value is None:
+            parts.append(b"$-1\r\n")
+        else:
+            parts.append(encode_reply(value))
+    return b"".join(parts)
+
+
+def encode_error(message: str) -> bytes:
+    """
+    编码为 RESP 错误
+    """
+    return b"-ERR %b\r\n" % " ".join(message.splitlines()).encode()
@@ -0,0 +1,318 @@
+import asyncio
+from typing import Dict, Iterable, Iterator, List, Optional, Pattern, Set, Tuple
+
+from config import server_config
+from database import compile_pattern
+from logger import logger
+from protocol import encode_bulk, encode_integer
+
+OUTPUT_BUFFER_LIMIT = server_config.pubsub_output_buffer_limit
+"""订阅连接发送缓冲区的上限(字节)，0 表示不限制"""
+WILDCARDS = "*?[\\"
+"""模式中的通配符(及转义符)，模式在第一个通配符之前的部分为其字面前缀"""
+SUBSCRIBE_COMMANDS = frozenset(
+    {"subscribe", "unsubscribe", "psubscribe", "punsubscribe"}
+)
+"""改变连接订阅状态的指令，由连接自身执行"""
+PUSH_MODE_COMMANDS = SUBSCRIBE_COMMANDS | {"ping"}
+"""订阅模式下允许执行的指令"""
+
+
+def literal_prefix(pattern: str) -> str:
+    """
+    模式的字面前缀：能与该模式匹配的频道一定以它开头
+    """
+    for i, c in enumerate(pattern):
+        if c in WILDCARDS:
+            return pattern[:i]
+    return pattern
+
+
+def _encode_event(kind: str, name: Optional[str], count: int) -> bytes:
+    """
+    编码订阅状态变化的响应：[类型, 频道或模式, 当前订阅数]
+    """
+    return b"*3\r\n%b%b%b" % (
+        encode_bulk(kind),
+        b"$-1\r\n" if name is None else encode_bulk(name),
+        encode_integer(count),
+    )
+
+
+class Subscriber:
+    """
+    一个订阅了频道或模式的客户端连接
+
+    推送的消息先暂存，事件循环本轮结束时一次写入连接的发送缓冲区(同一轮中的多条消息只需一次系统调用)，
+    不等待对方读取；缓冲区超过上限说明对方消费过慢，此时断开连接，而不是让服务器内存无限增长
+    """
+
+    def __init__(self, writer: asyncio.StreamWriter, address: str) -> None:
+        self.writer = writer
+        self.address = address
+        self.channels: Set[str] = set()
+        self.patterns: Set[str] = set()
+        self.closed = False
+        self._pending: List[bytes] = []
+        """尚未写入连接的消息"""
+        self._pending_size = 0
+
+    @property
+    def subscriptions(self) -> int:
+        """
+        订阅的频道与模式总数，不为 0 时连接处于订阅模式
+        """
+        return len(self.channels) + len(self.patterns)
+
+    def send(self, data: bytes) -> bool:
+        """
+        推送一条已编码的消息，连接已断开或因消费过慢被断开时返回 False
+        """
+        if self.closed:
+            return False
+        transport = self.writer.transport
+        if transport.is_closing():
+            self.closed = True
+            return False
+        if not self._pending:
+            pubsub.schedule_flush(self)
+        self._pending.append(data)
+        self._pending_size += len(data)
+        if (
+            OUTPUT_BUFFER_LIMIT
+            and transport.get_write_buffer_size() + self._pending_size
+            > OUTPUT_BUFFER_LIMIT
+        ):
+            logger.warning(
+                f"[{self.address}] 订阅者发送缓冲区超过 {OUTPUT_BUFFER_LIMIT} 字节，断开连接"
+            )
+            self.closed = True
+            self._pending.clear()
+            transport.abort()
+            pubsub.slow_disconnects += 1
+            return False
+        return True
+
+    def flush(self) -> None:
+        """
+        将暂存的消息写入连接；连接自身写入响应前也需调用，保证消息与响应的顺序
+        """
+        if not self._pending:
+            return
+        transport = self.writer.transport
+        if not self.closed and not transport.is_closing():
+            # writelines 将各条消息直接加入发送缓冲区，不先拼接复制为一个字节串
+            transport.writelines(self._pending)
+        self._pending.clear()
+        self._pending_size = 0
+
+
+class PubSub:
+    """
+    发布/订阅
+
+    频道按名称索引订阅者；模式按字面前缀索引，发布时只需用频道名的前几个字符查找
+    前缀相同的模式再逐个匹配，开销与订阅的模式总数无关，只与不同前缀长度的种数及
+    前缀命中的模式数有关。同一条消息只编码一次，所有订阅者共享同一个字节串
+    """
+
+    def __init__(self) -> None:
+        self.channels: Dict[str, Set[Subscriber]] = {}
+        """频道 -> 订阅者"""
+        self.patterns: Dict[str, Tuple[Pattern[str], Set[Subscriber]]] = {}
+        """模式 -> (编译后的正则表达式, 订阅者)"""
+        self._prefixes: Dict[str, Set[str]] = {}
+        """字面前缀 -> 具有该前缀的模式"""
+        self._prefix_lengths: Dict[int, int] = {}
+        """字面前缀的长度 -> 该长度的前缀数量"""
+        self.slow_disconnects = 0
+        """因消费过慢被断开的订阅者数量"""
+        self._flush_queue: List[Subscriber] = []
+        """有暂存消息的订阅者"""
+
+    def schedule_flush(self, subscriber: Subscriber) -> None:
+        """
+        在事件循环本轮结束时写入订阅者暂存的消息
+        """
+        if not self._flush_queue:
+            asyncio.get_running_loop().call_soon(self._flush)
+        self._flush_queue.append(subscriber)
+
+    def _flush(self) -> None:
+        queue, self._flush_queue = self._flush_queue, []
+        for subscriber in queue:
+            subscriber.flush()
+
+    def subscribe(self, subscriber: Subscriber, channels: Iterable[str]) -> bytes:
+        """
+        订阅频道，返回每个频道的订阅确认
+        """
+        replies: List[bytes] = []
+        for channel in channels:
+            if channel not in subscriber.channels:
+                subscriber.channels.add(channel)
+                self.channels.setdefault(channel, set()).add(subscriber)
+            replies.append(
+                _encode_event("subscribe", channel, subscriber.subscriptions)
+            )
+        return b"".join(replies)
+
+    def unsubscribe(self, subscriber: Subscriber, channels: List[str]) -> bytes:
+        """
+        退订频道，未指定频道时退订全部频道
+        """
+        if not channels:
+            if not subscriber.channels:
+                return _encode_event("unsubscribe", None, subscriber.subscriptions)
+            channels = sorted(subscriber.channels)
+        replies: List[bytes] = []
+        for channel in channels:
+            if channel in subscriber.channels:
+                subscriber.channels.discard(channel)
+                self._remove_channel(subscriber, channel)
+            replies.append(
+                _encode_event("unsubscribe", channel, subscriber.subscriptions)
+            )
+        return b"".join(replies)
+
+    def psubscribe(self, subscriber: Subscriber, patterns: Iterable[str]) -> bytes:
+        """
+        订阅模式，返回每个模式的订阅确认
+        """
+        replies: List[bytes] = []
+        for pattern in patterns:
+            if pattern not in subscriber.patterns:
+                subscriber.patterns.add(pattern)
+                self._add_pattern(subscriber, pattern)
+            replies.append(
+                _encode_event("psubscribe", pattern, subscriber.subscriptions)
+            )
+        return b"".join(replies)
+
+    def punsubscribe(self, subscriber: Subscriber, patterns: List[str]) -> bytes:
+        """
+        退订模式，未指定模式时退订全部模式
+        """
+        if not patterns:
+            if not subscriber.patterns:
+                return _encode_event("punsubscribe", None, subscriber.subscriptions)
+            patterns = sorted(subscriber.patterns)
+        replies: List[bytes] = []
+        for pattern in patterns:
+            if pattern in subscriber.patterns:
+                subscriber.patterns.discard(pattern)
+                self._remove_pattern(subscriber, pattern)
+            replies.append(
+                _encode_event("punsubscribe", pattern, subscriber.subscriptions)
+            )
+        return b"".join(replies)
+
+    def remove(self, subscriber: Subscriber) -> None:
+        """
+        连接断开时退订其全部频道和模式
+        """
+        for channel in subscriber.channels:
+            self._remove_channel(subscriber, channel)
+        for pattern in subscriber.patterns:
+            self._remove_pattern(subscriber, pattern)
+        subscriber.channels.clear()
+        subscriber.patterns.clear()
+
+    def publish(self, channel: str, message: str) -> int:
+        """
+        向频道发布消息，返回收到消息的订阅者数量(通过多个模式收到的订阅者重复计数)
+        """
+        receivers = 0
+        dropped: List[Subscriber] = []
+
+        subscribers = self.channels.get(channel)
+        if subscribers:
+            data = b"*3\r\n$7\r\nmessage\r\n%b%b" % (
+                encode_bulk(channel),
+                encode_bulk(message),
+            )
+            for subscriber in subscribers:
+                if subscriber.send(data):
+                    receivers += 1
+                else:
+                    dropped.append(subscriber)
+
+        matched = list(self._match(channel))
+        if matched:
+            tail = encode_bulk(channel) + encode_bulk(message)
+            for pattern, pattern_subscribers in matched:
+                data = b"*4\r\n$8\r\npmessage\r\n%b%b" % (encode_bulk(pattern), tail)
+                for subscriber in pattern_subscribers:
+                    if subscriber.send(data):
+                        receivers += 1
+                    else:
+                        dropped.append(subscriber)
+
+        # 遍历结束后再移除被断开的订阅者，避免遍历过程中修改集合
+        for subscriber in dropped:
+            self.remove(subscriber)
+        return receivers
+
+    def info(self) -> Dict[str, object]:
+        """
+        发布/订阅统计信息
+        """
+        return {
+            "pubsub_channels": len(self.channels),
+            "pubsub_patterns": len(self.patterns),
+            "pubsub_slow_disconnects": self.slow_disconnects,
+        }
+
+    def _match(self, channel: str) -> Iterator[Tuple[str, Set[Subscriber]]]:
+        """
+        与频道匹配的模式及其订阅者
+        """
+        for length in self._prefix_lengths:
+            if length > len(channel):
+                continue
+            for pattern in self._prefixes.get(channel[:length], ()):
+                regex, subscribers = self.patterns[pattern]
+                if regex.fullmatch(channel):
+                    yield pattern, subscribers
+
+    def _remove_channel(self, subscriber: Subscriber, channel: str) -> None:
+        subscribers = self.channels.get(channel)
+        if subscribers is None:
+            return
+        subscribers.discard(subscriber)
+        if not subscribers:
+            del self.channels[channel]
+
+    def _add_pattern(self, subscriber: Subscriber, pattern: str) -> None:
+        entry = self.patterns.get(pattern)
+        if entry is None:
+            entry = self.patterns[pattern] = (compile_pattern(pattern), set())
+            prefix = literal_prefix(pattern)
+            patterns = self._prefixes.setdefault(prefix, set())
+            if not patterns:
+                self._prefix_lengths[len(prefix)] = (
+                    self._prefix_lengths.get(len(prefix), 0) + 1
+                )
+            patterns.add(pattern)
+        entry[1].add(subscriber)
+
+    def _remove_pattern(self, subscriber: Subscriber, pattern: str) -> None:
+        entry = self.patterns.get(pattern)
+        if entry is None:
+            return
+        entry[1].discard(subscriber)
+        if entry[1]:
+            return
+        del self.patterns[pattern]
+
+        prefix = literal_prefix(pattern)
+        patterns = self._prefixes[prefix]
+        patterns.discard(pattern)
+        if not patterns:
+            del self._prefixes[prefix]
+            self._prefix_lengths[len(prefix)] -= 1
+            if not self._prefix_lengths[len(prefix)]:
+                del self._prefix_lengths[len(prefix)]
+
+
+pubsub = PubSub()
@@ -1,48 +1,375 @@
 import asyncio
+import os
+import shlex
+import signal
+import socket
+import time
+from typing import Dict, List, Optional
 
-from command import parse_command_string
+from command import (
+    INFO_SECTIONS,
+    Reply,
+    execute_command,
+    parse_command_string,
+    text_reply,
+)
 from config import server_config
-from logger import logger
+from database import database, stats
+from logger import Joined, logger, sample_request, shutdown_logger
+from protocol import BUFSIZE, ProtocolError, RespReader, encode_error, encode_reply
+from pubsub import PUSH_MODE_COMMANDS, SUBSCRIBE_COMMANDS, Subscriber, pubsub
+from shard import ShardRouter, shard_socket
 
 HOST = server_config.host
 PORT = server_config.port
 BACKLOG = server_config.backlog
-BUFSIZE = 1024
+WORKERS = server_config.workers
+IPC_DIR = server_config.ipc_dir
+METRICS_PORT = server_config.metrics_port
+METRICS_TIMEOUT = 5
+"""读取指标请求的超时时间(秒)"""
+GAUGE_SECTIONS = ("memory", "persistence", "replication", "stats", "pubsub")
+"""作为 Prometheus gauge 输出的 info 类别"""
+IPC_CLIENT = "ipc"
+"""其他分片转发指令的连接在日志中的地址"""
 
+router: Optional[ShardRouter] = None
+"""多进程模式下本进程的指令路由，单进程模式下为 None"""
 
-async def handle_client(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
-    addr = writer.get_extra_info("peername")
-    client_address = ":".join(str(x) for x in addr)
-    logger.info(f"[{client_address}] 已建立连接")
+
+async def execute_text(message: str) -> str:
+    """
+    执行一条纯文本指令，多进程模式下涉及其他分片的指令按 RESP 参数转发
+    """
+    if router is not None:
+        try:
+            argv = (
+                shlex.split(message)
+                if "'" in message or '"' in message
+                else message.split()
+            )
+        except ValueError:
+            argv = []
+        if argv and not router.is_local(argv):
+            return text_reply(await router.execute(argv))
+    return await parse_command_string(message)
+
+
+async def execute_batch(
+    commands: List[List[str]], forwarded: bool = False
+) -> List[Reply]:
+    """
+    按顺序执行同一批到达的 RESP 指令
+
+    :param forwarded: 是否为其他分片转发的指令，转发的指令都由本分片执行，不再路由
+    """
+    if router is not None and not forwarded:
+        return await router.execute_batch(commands)
+    return [await execute_command(argv) for argv in commands]
+
+
+def execute_subscribe(subscriber: Subscriber, argv: List[str]) -> bytes:
+    """
+    执行一条订阅相关的指令，返回编码后的响应(每个频道或模式一条)
+    """
+    name = argv[0].lower()
+    if name in ("subscribe", "psubscribe") and len(argv) < 2:
+        stats.record_error(name)
+        return encode_error("命令参数有误!")
+    start = time.perf_counter()
+    reply = getattr(pubsub, name)(subscriber, argv[1:])
+    stats.record_command(name, argv, start)
+    return reply
+
+
+async def execute_pubsub(
+    subscriber: Subscriber, commands: List[List[str]], forwarded: bool = False
+) -> List[bytes]:
+    """
+    按顺序执行包含订阅指令的一批指令，返回编码后的响应
+
+    订阅了频道或模式的连接处于订阅模式，只能执行订阅相关的指令及 ping，
+    退订全部频道和模式后恢复正常
+    """
+    replies: List[bytes] = []
+    for argv in commands:
+        name = argv[0].lower()
+        if name in SUBSCRIBE_COMMANDS:
+            replies.append(execute_subscribe(subscriber, argv))
+        elif not subscriber.subscriptions:
+            results = await execute_batch([argv], forwarded)
+            replies.append(encode_reply(results[0]))
+        elif name == "ping":
+            replies.append(encode_reply(["pong", argv[1] if len(argv) > 1 else ""]))
+        else:
+            stats.record_error(name)
+            replies.append(
+                encode_error(
+                    f"订阅模式下只能执行 {', '.join(sorted(PUSH_MODE_COMMANDS))} 指令"
+                )
+            )
+    return replies
+
+
+async def serve_text(
+    reader: asyncio.StreamReader,
+    writer: asyncio.StreamWriter,
+    client_address: str,
+    data: bytes,
+):
+    """
+    纯文本模式：每次读取到的数据视为一条以空白分隔参数的指令
+    """
+    while data:
+        message = data.decode().strip()
+        sampled = sample_request(message.split(None, 1)[0] if message else "")
+        if sampled:
+            logger.info("[%s] 收到消息：%s", client_address, message)
+
+        result = await execute_text(message)
+        await database.commit()
+        if sampled:
+            logger.info("[%s] 发送消息：%s", client_address, result)
+        writer.write(result.encode())
+        await writer.drain()
+
+        data = await reader.read(BUFSIZE)
+
+
+async def serve_resp(
+    reader: asyncio.StreamReader,
+    writer: asyncio.StreamWriter,
+    client_address: str,
+    data: bytes,
+):
+    """
+    RESP2 模式：按长度前缀切分命令，参数可以包含空白字符且不受缓冲区大小限制。
+
+    客户端可以流水线发送多条命令，同一批到达的命令按顺序执行后合并为一次写入。
+    执行订阅指令后连接进入订阅模式，发布的消息由 pubsub 直接写入该连接
+    """
+    resp_reader = RespReader(reader, data)
+    subscriber: Optional[Subscriber] = None
     try:
         while True:
-            data = await reader.read(BUFSIZE)
-            if not data:
+            commands = await resp_reader.read_commands()
+            if commands is None:
+                break
+            if commands[0][0].lower() == "psync":
+                # 副本发起复制，此后该连接只用于向副本发送写命令
+                logger.info(
+                    "[%s] 副本请求同步：%s", client_address, Joined(commands[0])
+                )
+                await database.replication.serve_replica(
+                    resp_reader, writer, commands[0], client_address
+                )
                 break
 
-            message = data.decode().strip()
-            logger.info(f"[{client_address}] 收到消息：{message}")
+            # 日志参数在写日志线程中才格式化，事件循环中只按采样率决定是否记录
+            sampled = [i for i, argv in enumerate(commands) if sample_request(argv[0])]
+            for i in sampled:
+                logger.info("[%s] 收到消息：%s", client_address, Joined(commands[i]))
+            forwarded = client_address == IPC_CLIENT
+            if (subscriber is not None and subscriber.subscriptions) or any(
+                argv[0].lower() in SUBSCRIBE_COMMANDS for argv in commands
+            ):
+                if subscriber is None:
+                    subscriber = Subscriber(writer, client_address)
+                replies = await execute_pubsub(subscriber, commands, forwarded)
+                for i in sampled:
+                    logger.info("[%s] 发送消息：%r", client_address, replies[i])
+            else:
+                results = await execute_batch(commands, forwarded)
+                for i in sampled:
+                    logger.info("[%s] 发送消息：%s", client_address, results[i])
+                replies = [encode_reply(result) for result in results]
 
-            result = await parse_command_string(message)
-            logger.info(f"[{client_address}] 发送消息：{result}")
-            writer.write(result.encode())
+            # 整批命令只写入(落盘)一次 AOF
+            await database.commit()
+            if subscriber is not None:
+                subscriber.flush()
+            writer.write(b"".join(replies))
             await writer.drain()
+    except ProtocolError as e:
+        logger.warning(f"[{client_address}] 协议错误：{e}")
+        writer.write(encode_error(f"Protocol error: {e}"))
+        await writer.drain()
+    finally:
+        if subscriber is not None:
+            pubsub.remove(subscriber)
+
+
+async def handle_client(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    addr = writer.get_extra_info("peername")
+    # Unix 套接字没有对端地址，是其他分片转发指令的连接
+    client_address = ":".join(str(x) for x in addr) if addr else IPC_CLIENT
+    logger.info("[%s] 已建立连接", client_address)
+    try:
+        # 根据首个字节判断客户端使用的协议
+        data = await reader.read(BUFSIZE)
+        if data.startswith(b"*"):
+            await serve_resp(reader, writer, client_address, data)
+        else:
+            await serve_text(reader, writer, client_address, data)
     except Exception as e:
         logger.error(f"[{client_address}] 连接出错：{e}")
     finally:
         writer.close()
         await writer.wait_closed()
-        logger.info(f"[{client_address}] 已断开连接")
+        logger.info("[%s] 已断开连接", client_address)
+
+
+async def handle_metrics(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """
+    Prometheus 指标：GET /metrics 返回文本格式的指标，与客户端共用事件循环
+    """
+    try:
+        request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), METRICS_TIMEOUT)
+        if request.split(b" ", 2)[:2] == [b"GET", b"/metrics"]:
+            status = b"200 OK"
+            body = stats.prometheus(
+                {name: INFO_SECTIONS[name]() for name in GAUGE_SECTIONS}
+            ).encode()
+        else:
+            status, body = b"404 Not Found", b"not found\n"
+        writer.write(
+            b"HTTP/1.1 %b\r\n"
+            b"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            b"Content-Length: %d\r\nConnection: close\r\n\r\n%b"
+            % (status, len(body), body)
+        )
+        await writer.drain()
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError) as e:
+        logger.warning(f"无效的指标请求: {e}")
+    except (asyncio.TimeoutError, OSError):
+        pass
+    finally:
+        writer.close()
+
+
+async def main(shard: Optional[int] = None):
+    """
+    :param shard: 多进程模式下本进程负责的分片，单进程模式下为 None
+    """
+    global router
+    if shard is not None:
+        database.use_shard(shard, WORKERS)
+        router = ShardRouter(shard, WORKERS, IPC_DIR)
+    await database.connect()
+
+    # 收到 SIGINT/SIGTERM 时正常退出，确保内存中的脏数据写回数据库
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:  # Windows
+            pass
+
+    ipc_server: Optional[asyncio.AbstractServer] = None
+    metrics_server: Optional[asyncio.AbstractServer] = None
+    try:
+        if router is not None:
+            path = shard_socket(IPC_DIR, router.shard)
+            path.unlink(missing_ok=True)
+            ipc_server = await asyncio.start_unix_server(handle_client, path)
+        if METRICS_PORT:
+            # 多进程模式下每个工作进程的统计数据独立，各自使用一个端口
+            metrics_port = METRICS_PORT + (router.shard if router is not None else 0)
+            metrics_server = await asyncio.start_server(
+                handle_metrics, HOST, metrics_port
+            )
+            logger.info(f"Prometheus 指标：http://{HOST}:{metrics_port}/metrics")
+        # 多进程模式下所有工作进程监听同一个端口，由内核将新连接分配给各个进程
+        server = await asyncio.start_server(
+            handle_client, HOST, PORT, reuse_port=router is not None
+        )
+        if router is not None:
+            logger.info(f"工作进程 {router.shard} 已启动：{HOST}:{PORT}")
+        else:
+            logger.info(f"服务器已启动：{HOST}:{PORT}")
+        logger.info("等待客户端连接...")
+
+        async with server:
+            await stop.wait()
+        logger.info("服务器正在关闭...")
+    finally:
+        if ipc_server is not None:
+            ipc_server.close()
+        if metrics_server is not None:
+            metrics_server.close()
+        if router is not None:
+            await router.close()
+        await database.close()
+
+
+def _spawn_worker(shard: int) -> int:
+    """
+    fork 一个工作进程运行分片 shard，返回其 pid
+    """
+    pid = os.fork()
+    if pid != 0:
+        return pid
+
+    # 子进程不继承主进程的信号处理函数，由事件循环重新注册
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    code = 1
+    try:
+        asyncio.run(main(shard))
+        code = 0
+    except BaseException as e:
+        logger.error(f"工作进程 {shard} 异常退出：{e}", exc_info=True)
+    finally:
+        # os._exit 不执行 atexit，需要先写入队列中剩余的日志
+        shutdown_logger()
+        os._exit(code)
+
+
+def run_workers(count: int) -> None:
+    """
+    主进程：fork count 个工作进程并监督其运行，异常退出的工作进程会被重新启动；
+    收到 SIGINT/SIGTERM 时通知所有工作进程退出
+    """
+    os.makedirs(IPC_DIR, exist_ok=True)
+    # 事件循环、数据库连接均在 fork 之后由工作进程各自创建
+    workers: Dict[int, int] = {_spawn_worker(shard): shard for shard in range(count)}
+    logger.info(f"已启动 {count} 个工作进程")
+
+    stopping = False
 
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
 
-async def main():
-    server = await asyncio.start_server(handle_client, HOST, PORT)
-    logger.info(f"服务器已启动：{HOST}:{PORT}")
-    logger.info("等待客户端连接...")
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
 
-    async with server:
-        await server.serve_forever()
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        shard = workers.pop(pid, None)
+        if shard is None:
+            continue
+        if not stopping:
+            logger.error(
+                f"工作进程 {shard} 异常退出(退出码 {os.waitstatus_to_exitcode(status)})，正在重新启动..."
+            )
+            workers[_spawn_worker(shard)] = shard
+    logger.info("所有工作进程已退出")
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    if WORKERS > 1 and hasattr(os, "fork") and hasattr(socket, "SO_REUSEPORT"):
+        run_workers(WORKERS)
+    else:
+        if WORKERS > 1:
+            logger.warning("当前平台不支持 fork 或 SO_REUSEPORT，以单进程模式运行")
+        asyncio.run(main())
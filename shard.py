@@ -0,0 +1,369 @@
+import asyncio
+import zlib
+from collections import deque
+from pathlib import Path
+from typing import Deque, Dict, List, Optional, Union
+
+from command import Reply, execute_command
+from logger import logger
+from protocol import ErrorReply, IntegerReply, ReplyError, encode_reply, read_reply
+
+KEY_COMMANDS = frozenset(
+    {
+        "set",
+        "setex",
+        "get",
+        "del",
+        "lpush",
+        "rpush",
+        "range",
+        "len",
+        "lpop",
+        "rpop",
+        "ldel",
+        "lindex",
+        "lset",
+        "ltrim",
+        "hset",
+        "hget",
+        "hdel",
+        "hmset",
+        "hmget",
+        "hgetall",
+        "hscan",
+        "expire",
+        "ttl",
+        "persist",
+        "dump",
+        "restore",
+    }
+)
+"""第一个参数为 key 的指令，由 key 所在的分片执行"""
+SUBCOMMAND_KEY_COMMANDS = frozenset({"object"})
+"""第一个参数为子指令、第二个参数为 key 的指令"""
+
+CONNECT_ATTEMPTS = 50
+"""连接其他分片的最大尝试次数，工作进程同时启动时对方可能还在载入数据"""
+CONNECT_RETRY_DELAY = 0.1
+"""连接失败后的重试间隔(秒)"""
+WRITE_HIGH_WATER = 1 << 20
+"""发送缓冲区超过多少字节时等待对方读取"""
+
+
+def command_key(argv: List[str]) -> Optional[str]:
+    """
+    单个 key 的指令涉及的 key，其他指令返回 None
+    """
+    name = argv[0].lower()
+    if name in KEY_COMMANDS and len(argv) > 1:
+        return argv[1]
+    if name in SUBCOMMAND_KEY_COMMANDS and len(argv) > 2:
+        return argv[2]
+    return None
+
+
+def shard_of(key: str, count: int) -> int:
+    """
+    计算 key 所在的分片，同一个 key 在任何进程、任何时刻都落在同一个分片上
+    """
+    return zlib.crc32(key.encode()) % count
+
+
+def shard_socket(ipc_dir: str, shard: int) -> Path:
+    """
+    分片之间转发指令使用的 Unix 套接字路径
+    """
+    return Path(ipc_dir) / f"shard-{shard}.sock"
+
+
+class ShardUnavailable(Exception):
+    """
+    无法连接到其他分片
+    """
+
+
+class ShardConnection:
+    """
+    到另一个分片的长连接
+
+    请求不等待响应直接发送(流水线)，对方按顺序执行并按顺序返回，
+    因此响应依次交给等待队列中最早的请求
+    """
+
+    def __init__(self, shard: int, path: Path) -> None:
+        self.shard = shard
+        self.path = path
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._pending: Deque[asyncio.Future] = deque()
+        self._connect_lock = asyncio.Lock()
+        self._read_task: Optional[asyncio.Task] = None
+
+    async def send(self, argv: List[str]) -> asyncio.Future:
+        """
+        发送一条指令，返回等待其响应的 Future
+        """
+        if self._writer is None:
+            await self._connect()
+        writer = self._writer
+        assert writer is not None
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append(future)
+        writer.write(encode_reply(argv))
+        if writer.transport.get_write_buffer_size() > WRITE_HIGH_WATER:
+            await writer.drain()
+        return future
+
+    async def _connect(self) -> None:
+        async with self._connect_lock:
+            if self._writer is not None:
+                return
+            for _ in range(CONNECT_ATTEMPTS):
+                try:
+                    reader, writer = await asyncio.open_unix_connection(self.path)
+                    break
+                except OSError:
+                    await asyncio.sleep(CONNECT_RETRY_DELAY)
+            else:
+                raise ShardUnavailable(f"无法连接到分片 {self.shard}")
+
+            self._writer = writer
+            self._read_task = asyncio.create_task(self._read_loop(reader, writer))
+            logger.info(f"已连接到分片 {self.shard}")
+
+    async def _read_loop(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        error: Exception = ShardUnavailable(f"与分片 {self.shard} 的连接已断开")
+        try:
+            while True:
+                try:
+                    reply: object = await read_reply(reader)
+                except ReplyError as e:
+                    reply = e
+                future = self._pending.popleft()
+                if not future.done():
+                    if isinstance(reply, Exception):
+                        future.set_exception(reply)
+                    else:
+                        future.set_result(reply)
+        except (asyncio.IncompleteReadError, OSError) as e:
+            logger.warning(f"与分片 {self.shard} 的连接已断开: {e}")
+        except asyncio.CancelledError:
+            error = ShardUnavailable(f"与分片 {self.shard} 的连接已关闭")
+            raise
+        finally:
+            # 尚未收到响应的请求无法确定是否已执行，直接报错；下次发送时重新连接
+            self._writer = None
+            while self._pending:
+                future = self._pending.popleft()
+                if not future.done():
+                    future.set_exception(error)
+            writer.close()
+
+    async def close(self) -> None:
+        if self._read_task is not None:
+            self._read_task.cancel()
+            try:
+                await self._read_task
+            except asyncio.CancelledError:
+                pass
+            self._read_task = None
+
+
+class ShardRouter:
+    """
+    多进程模式下的指令路由
+
+    每个工作进程只保存 key 哈希到自身分片的数据，其他分片的 key 通过 Unix 套接字
+    转发到所属的工作进程执行；不涉及 key 的指令在本进程执行
+    """
+
+    def __init__(self, shard: int, count: int, ipc_dir: str) -> None:
+        self.shard = shard
+        self.count = count
+        self._peers: Dict[int, ShardConnection] = {
+            i: ShardConnection(i, shard_socket(ipc_dir, i))
+            for i in range(count)
+            if i != shard
+        }
+
+    def owner(self, key: str) -> int:
+        return shard_of(key, self.count)
+
+    def is_local(self, argv: List[str]) -> bool:
+        """
+        指令涉及的 key 是否都在本分片
+        """
+        if len(argv) < 2:
+            return True
+        key = command_key(argv)
+        if key is not None:
+            return self.owner(key) == self.shard
+        name = argv[0].lower()
+        if name in ("scan", "publish"):
+            return False
+        if name == "mget":
+            return all(self.owner(key) == self.shard for key in argv[1:])
+        if name == "mset":
+            return all(self.owner(key) == self.shard for key in argv[1::2])
+        return True
+
+    async def execute(self, argv: List[str]) -> Reply:
+        """
+        执行一条指令，key 不在本分片时转发给所属分片
+        """
+        return (await self.execute_batch([argv]))[0]
+
+    async def execute_batch(self, commands: List[List[str]]) -> List[Reply]:
+        """
+        按顺序执行一批指令
+
+        转发的指令先全部发出再依次等待响应，同一批中不同分片的指令并行执行；
+        同一个 key 总是由同一个分片按到达顺序执行，因此不会乱序
+        """
+        results: List[Union[Reply, asyncio.Future]] = []
+        for argv in commands:
+            name = argv[0].lower()
+            key = command_key(argv)
+            if key is not None:
+                shard = self.owner(key)
+                if shard != self.shard:
+                    results.append(await self._send(shard, argv))
+                    continue
+            if name == "mset" and len(argv) > 1 and len(argv) % 2 == 1:
+                results.append(await self._mset(argv))
+            elif name == "mget" and len(argv) > 1:
+                results.append(await self._mget(argv))
+            elif name == "scan" and len(argv) > 1:
+                results.append(await self._scan(argv))
+            elif name == "publish" and len(argv) == 3:
+                results.append(await self._publish(argv))
+            else:
+                results.append(await execute_command(argv))
+
+        return [
+            (
+                await self._resolve(result)
+                if isinstance(result, asyncio.Future)
+                else result
+            )
+            for result in results
+        ]
+
+    async def _send(self, shard: int, argv: List[str]) -> Union[Reply, asyncio.Future]:
+        try:
+            return await self._peers[shard].send(argv)
+        except ShardUnavailable as e:
+            logger.error(str(e))
+            return ErrorReply(f"{e}!")
+
+    @staticmethod
+    async def _resolve(future: asyncio.Future) -> Reply:
+        try:
+            return await future
+        except ShardUnavailable as e:
+            logger.error(str(e))
+            return ErrorReply(f"{e}!")
+        except ReplyError as e:
+            # 分片返回的错误原样返回给客户端，去掉编码时添加的错误类型
+            return ErrorReply(str(e).removeprefix("ERR "))
+
+    async def _gather(self, groups: Dict[int, List[str]]) -> Dict[int, Reply]:
+        """
+        将拆分后的指令发往各自的分片并等待全部完成
+        """
+        futures = {
+            shard: await self._send(shard, argv)
+            for shard, argv in groups.items()
+            if shard != self.shard
+        }
+        replies: Dict[int, Reply] = {}
+        if self.shard in groups:
+            replies[self.shard] = await execute_command(groups[self.shard])
+        for shard, result in futures.items():
+            replies[shard] = (
+                await self._resolve(result)
+                if isinstance(result, asyncio.Future)
+                else result
+            )
+        return replies
+
+    async def _mset(self, argv: List[str]) -> Reply:
+        """
+        按分片拆分 mset，全部成功时返回 1，否则返回第一个错误
+        """
+        groups: Dict[int, List[str]] = {}
+        for key, value in zip(argv[1::2], argv[2::2]):
+            groups.setdefault(self.owner(key), ["mset"]).extend((key, value))
+        for reply in (await self._gather(groups)).values():
+            if reply != "1":
+                return reply
+        return "1"
+
+    async def _mget(self, argv: List[str]) -> Reply:
+        """
+        按分片拆分 mget，再按原有的顺序合并各分片的结果
+        """
+        groups: Dict[int, List[str]] = {}
+        positions: Dict[int, List[int]] = {}
+        for i, key in enumerate(argv[1:]):
+            shard = self.owner(key)
+            groups.setdefault(shard, ["mget"]).append(key)
+            positions.setdefault(shard, []).append(i)
+
+        values: List[Optional[str]] = [None] * (len(argv) - 1)
+        for shard, reply in (await self._gather(groups)).items():
+            if not isinstance(reply, list):
+                return reply
+            for i, value in zip(positions[shard], reply):
+                values[i] = value
+        return values
+
+    async def _scan(self, argv: List[str]) -> Reply:
+        """
+        依次遍历各个分片：游标为 分片内的游标 * 分片数 + 分片编号，
+        每批只发往当前分片，该分片遍历完成后从下一个分片的开头继续
+        """
+        try:
+            cursor = int(argv[1])
+        except ValueError:
+            cursor = -1
+        if cursor < 0:
+            return ErrorReply("无效的游标!")
+        position, shard = divmod(cursor, self.count)
+        command = ["scan", str(position), *argv[2:]]
+        if shard == self.shard:
+            reply = await execute_command(command)
+        else:
+            result = await self._send(shard, command)
+            reply = (
+                await self._resolve(result)
+                if isinstance(result, asyncio.Future)
+                else result
+            )
+        if not isinstance(reply, list):
+            return reply
+
+        position = int(reply[0])
+        if position:
+            cursor = position * self.count + shard
+        else:
+            cursor = shard + 1 if shard + 1 < self.count else 0
+        return [str(cursor), reply[1]]
+
+    async def _publish(self, argv: List[str]) -> Reply:
+        """
+        订阅者可能连接到任意一个工作进程，因此在所有分片上发布，返回收到消息的订阅者总数
+        """
+        replies = await self._gather({shard: argv for shard in range(self.count)})
+        receivers = 0
+        for reply in replies.values():
+            if not isinstance(reply, str) or not reply.isdigit():
+                return reply
+            receivers += int(reply)
+        return IntegerReply(receivers)
+
+    async def close(self) -> None:
+        for peer in self._peers.values():
+            await peer.close()
@@ -0,0 +1,32 @@
+import os
+import sys
+from pathlib import Path
+from typing import Any, Callable, Iterator, List
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+# 配置文件使用相对路径，与服务器一样在项目根目录下导入各模块
+os.chdir(ROOT)
+sys.path.insert(0, str(ROOT))
+
+from helpers import Server  # noqa: E402
+
+
+@pytest.fixture
+def start_server(tmp_path: Path) -> Iterator[Callable[..., Server]]:
+    """
+    在临时目录中启动服务器，name 相同的服务器共用同一个数据目录；测试结束时停止全部服务器
+    """
+    started: List[Server] = []
+
+    def start(name: str = "server", **options: Any) -> Server:
+        directory = tmp_path / name
+        directory.mkdir(exist_ok=True)
+        server = Server(str(directory), **options).start()
+        started.append(server)
+        return server
+
+    yield start
+    for server in started:
+        server.stop()
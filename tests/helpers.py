@@ -0,0 +1,78 @@
+import asyncio
+import subprocess
+from typing import Any, Optional
+
+from bench import start_server, stop_server
+from protocol import encode_reply, read_reply
+
+
+class Server:
+    """
+    在 directory 中运行的 server.py，停止后可以用目录中的数据重新启动(端口会改变)
+    """
+
+    def __init__(self, directory: str, **options: Any) -> None:
+        self.directory = directory
+        self.options = options
+        """覆盖配置文件的 server 配置项"""
+        self.process: Optional[subprocess.Popen] = None
+        self.port = 0
+
+    def start(self) -> "Server":
+        self.process, self.port = start_server(
+            self.directory, None, request_log=False, options=self.options
+        )
+        return self
+
+    def stop(self) -> None:
+        """
+        发送 SIGTERM 正常关闭，等待内存中的数据写回
+        """
+        if self.process is not None:
+            stop_server(self.process)
+            self.process = None
+
+    def restart(self) -> "Server":
+        self.stop()
+        return self.start()
+
+
+class Client:
+    """
+    按请求、响应的顺序收发 RESP 命令的连接
+    """
+
+    def __init__(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def connect(cls, port: int) -> "Client":
+        return cls(*await asyncio.open_connection("127.0.0.1", port))
+
+    async def call(self, *argv: str) -> Any:
+        """
+        发送一条命令并读取其响应
+
+        :raises ReplyError: 服务器返回错误
+        """
+        self.writer.write(encode_reply(argv))
+        await self.writer.drain()
+        return await read_reply(self.reader)
+
+    async def close(self) -> None:
+        self.writer.close()
+        await self.writer.wait_closed()
+
+
+async def call(port: int, *argv: str) -> Any:
+    """
+    用一个新连接执行一条命令
+    """
+    client = await Client.connect(port)
+    try:
+        return await client.call(*argv)
+    finally:
+        await client.close()
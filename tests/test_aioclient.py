@@ -0,0 +1,34 @@
+import asyncio
+from typing import List
+
+import pytest
+
+from aioclient import AsyncClient
+
+
+async def _execute_during_disconnect() -> List[bytes]:
+    """
+    服务器收到指令后不响应直接断开连接，返回服务器收到的数据
+    """
+    received: List[bytes] = []
+
+    async def handle(
+        reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        received.append(await reader.read(1024))
+        writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    try:
+        async with AsyncClient(port=port) as client:
+            with pytest.raises(ConnectionError):
+                await client.execute("rpush", "list", "a")
+    finally:
+        server.close()
+    return received
+
+
+def test_write_not_resent_after_disconnect():
+    # 断开前服务器可能已经执行了 rpush，默认不能在新连接上重复发送
+    assert len(asyncio.run(_execute_during_disconnect())) == 1
@@ -0,0 +1,91 @@
+import asyncio
+import random
+import re
+from collections import Counter
+from typing import Dict, List, Tuple
+
+from helpers import Client, call
+
+CLIENTS = 50
+OPERATIONS = 200
+KEY = "stress:list"
+VALUE = re.compile(r"^[lr]\d+:\d+$")
+"""推入的数据：l/r 表示从左/右端推入，后接客户端编号和序号"""
+
+
+async def _worker(port: int, client_id: int) -> Tuple[List[str], List[str]]:
+    """
+    随机从两端推入、弹出数据，返回推入和弹出的数据
+    """
+    rng = random.Random(client_id)
+    pushed: List[str] = []
+    popped: List[str] = []
+    client = await Client.connect(port)
+    try:
+        for i in range(OPERATIONS):
+            roll = rng.random()
+            if roll < 0.4:
+                values = [f"r{client_id}:{i}"]
+                await client.call("rpush", KEY, *values)
+            elif roll < 0.8:
+                # 一次推入多个数据，检查单条指令内的数据不会与其他连接交错
+                values = [f"l{client_id}:{i * 3 + j}" for j in range(3)]
+                await client.call("lpush", KEY, *values)
+            else:
+                reply = await client.call("lpop" if roll < 0.9 else "rpop", KEY)
+                # 链表为空时返回提示信息
+                if VALUE.match(reply):
+                    popped.append(reply)
+                continue
+            pushed.extend(values)
+            # 让出事件循环，使各连接的请求在服务器端交错执行
+            await asyncio.sleep(0)
+    finally:
+        await client.close()
+    return pushed, popped
+
+
+async def _run(port: int) -> Tuple[List[str], List[str]]:
+    results = await asyncio.gather(
+        *(_worker(port, client_id) for client_id in range(CLIENTS))
+    )
+    pushed = [value for values, _ in results for value in values]
+    popped = [value for _, values in results for value in values]
+    return pushed, popped
+
+
+async def _items(port: int) -> List[str]:
+    return await call(port, "range", KEY, "0", "-1")
+
+
+def _check_order(items: List[str]) -> None:
+    """
+    同一客户端从右端推入的数据从左到右递增，从左端推入的数据从左到右递减；
+    弹出只发生在两端，不会改变剩余数据的相对顺序
+    """
+    last: Dict[str, int] = {}
+    for value in items:
+        owner, index = value.split(":")
+        if owner in last:
+            if owner[0] == "r":
+                assert int(index) > last[owner], value
+            else:
+                assert int(index) < last[owner], value
+        last[owner] = int(index)
+
+
+def test_concurrent_push_pop(start_server):
+    server = start_server(list_chunk_size=8)
+    pushed, popped = asyncio.run(_run(server.port))
+
+    items = asyncio.run(_items(server.port))
+    assert all(VALUE.match(value) for value in items)
+    # 每个推入的数据恰好被弹出一次或仍在链表中，没有丢失或重复
+    assert Counter(pushed) == Counter(popped) + Counter(items)
+    assert asyncio.run(call(server.port, "len", KEY)) == str(len(items))
+    _check_order(items)
+
+    # 重启后链表从数据库完整恢复
+    server.options["snapshot_on_shutdown"] = False
+    server.restart()
+    assert asyncio.run(_items(server.port)) == items
@@ -0,0 +1,91 @@
+import asyncio
+import time
+
+import pytest
+from helpers import Client
+
+from protocol import ReplyError
+
+
+async def _calls(port: int, *commands: tuple) -> list:
+    client = await Client.connect(port)
+    try:
+        return [await client.call(*argv) for argv in commands]
+    finally:
+        await client.close()
+
+
+def test_aof_replay_keeps_expired_keys_expired(start_server):
+    server = start_server(appendonly=True, snapshot_on_shutdown=False)
+    asyncio.run(
+        _calls(
+            server.port,
+            ("rpush", "list", "a"),
+            ("expire", "list", "1"),
+            ("rpush", "list", "b"),
+        )
+    )
+    server.stop()
+    # 停机期间过期，重放 AOF 时后一条 rpush 不能让 key 以未过期的状态复活
+    time.sleep(1.5)
+    server.start()
+    assert asyncio.run(_calls(server.port, ("ttl", "list"), ("len", "list"))) == [
+        "-2",
+        "0",
+    ]
+
+
+def test_aof_replay_keeps_ttl(start_server):
+    server = start_server(appendonly=True, snapshot_on_shutdown=False)
+    asyncio.run(
+        _calls(
+            server.port,
+            ("rpush", "list", "a"),
+            ("expire", "list", "100"),
+            ("rpush", "list", "b"),
+        )
+    )
+    server.restart()
+    ttl, items = asyncio.run(
+        _calls(server.port, ("ttl", "list"), ("range", "list", "0", "-1"))
+    )
+    assert 0 < int(ttl) <= 100
+    assert items == ["a", "b"]
+
+
+def test_aof_replay_ignores_maxmemory(start_server):
+    server = start_server(appendonly=True, snapshot_on_shutdown=False)
+    keys = [f"key:{i}" for i in range(100)]
+    asyncio.run(_calls(server.port, *(("set", key, "x" * 100) for key in keys)))
+
+    # 重放 AOF 时不能因内存上限丢弃命令，载入完成后才拒绝写入
+    server.options.update(maxmemory=1000, maxmemory_policy="noeviction")
+    server.restart()
+    assert asyncio.run(_calls(server.port, *(("get", key) for key in keys))) == [
+        "x" * 100
+    ] * len(keys)
+    with pytest.raises(ReplyError):
+        asyncio.run(_calls(server.port, ("set", "new", "x")))
+
+
+def test_stale_snapshot_not_loaded_into_emptied_database(start_server):
+    server = start_server(snapshot_on_shutdown=False)
+    asyncio.run(_calls(server.port, ("set", "a", "1"), ("save",), ("del", "a")))
+    # 数据库中的数据被全部删除，但 save 保存的快照仍包含 a
+    server.restart()
+    assert asyncio.run(_calls(server.port, ("get", "a"))) != ["1"]
+
+
+def test_snapshot_loaded_into_new_database(start_server, tmp_path):
+    server = start_server("source", snapshot_on_shutdown=False)
+    asyncio.run(_calls(server.port, ("set", "a", "1"), ("save",)))
+    server.stop()
+
+    # 复制到其他节点的快照在新建数据库时载入
+    target = tmp_path / "target"
+    target.mkdir()
+    (target / "dump.snapshot").write_bytes(
+        (tmp_path / "source" / "dump.snapshot").read_bytes()
+    )
+    server = start_server("target", snapshot_on_shutdown=False)
+    assert asyncio.run(_calls(server.port, ("get", "a"))) == ["1"]
@@ -0,0 +1,26 @@
+import pytest
+
+from protocol import MAX_BULK_LEN, ProtocolError, RespParser
+
+
+def test_skips_empty_commands():
+    parser = RespParser()
+    # 大量空命令不会导致递归过深
+    parser.feed(b"*0\r\n" * 100000 + b"*1\r\n$4\r\nping\r\n")
+    assert parser.get_command() == ["ping"]
+    assert parser.get_command() is None
+
+
+def test_incomplete_command_resumes():
+    parser = RespParser()
+    parser.feed(b"*2\r\n$3\r\nget\r\n$1")
+    assert parser.get_command() is None
+    parser.feed(b"\r\na\r\n")
+    assert parser.get_command() == ["get", "a"]
+
+
+def test_rejects_oversized_bulk():
+    parser = RespParser()
+    parser.feed(b"*1\r\n$%d\r\n" % (MAX_BULK_LEN + 1))
+    with pytest.raises(ProtocolError):
+        parser.get_command()
@@ -0,0 +1,50 @@
+import asyncio
+
+from helpers import Client
+
+from protocol import read_reply
+
+
+async def _publish_batch(port: int) -> list:
+    subscriber = await Client.connect(port)
+    publisher = await Client.connect(port)
+    try:
+        assert await subscriber.call("subscribe", "news") == ["subscribe", "news", "1"]
+        # 同一批发布的多条消息在事件循环的同一轮中推送给订阅者
+        await publisher.call("publish", "news", "1")
+        for i in range(2, 6):
+            publisher.writer.write(
+                b"*3\r\n$7\r\npublish\r\n$4\r\nnews\r\n$1\r\n%d\r\n" % i
+            )
+        for _ in range(2, 6):
+            assert await read_reply(publisher.reader) == "1"
+        return [await read_reply(subscriber.reader) for _ in range(5)]
+    finally:
+        await subscriber.close()
+        await publisher.close()
+
+
+def test_messages_delivered_in_order(start_server):
+    server = start_server()
+    messages = asyncio.run(_publish_batch(server.port))
+    assert messages == [["message", "news", str(i)] for i in range(1, 6)]
+
+
+async def _publish_raw(port: int) -> bytes:
+    subscriber = await Client.connect(port)
+    publisher = await Client.connect(port)
+    try:
+        await subscriber.call("subscribe", "news")
+        publisher.writer.write(b"*3\r\n$7\r\npublish\r\n$4\r\nnews\r\n$1\r\n1\r\n")
+        return await publisher.reader.readuntil(b"\r\n")
+    finally:
+        await subscriber.close()
+        await publisher.close()
+
+
+def test_publish_returns_integer(start_server):
+    # 与 subscribe 的确认消息相同，订阅者数量编码为 RESP 整数
+    assert asyncio.run(_publish_raw(start_server().port)) == b":1\r\n"
+    assert asyncio.run(_publish_raw(start_server("workers", workers=2).port)) == (
+        b":1\r\n"
+    )
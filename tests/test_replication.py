@@ -0,0 +1,226 @@
+import asyncio
+import random
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from helpers import Client, call
+
+from database import keyspace
+from database._aof import REPLAY_COMMANDS
+from database._replication import Replication
+from database._snapshot import Snapshot
+from protocol import CRLF
+
+KEYS = 40
+OPERATIONS = 2000
+CONVERGE_TIMEOUT = 10
+
+
+def _expired_list(key: str) -> None:
+    keyspace.get_list(key).push_right("a")
+    keyspace.grow(key, 1)
+    keyspace.set_expire(key, time.time() - 1)
+
+
+def test_replica_hides_expired_keys_without_deleting():
+    key = "test:replica:hidden"
+    _expired_list(key)
+    keyspace.replica = True
+    try:
+        assert not keyspace.touch(key, read=True)
+        # 等待主节点同步删除
+        assert key in keyspace.lists and key in keyspace.expires
+    finally:
+        keyspace.replica = False
+    assert keyspace.touch(key)
+    assert not keyspace.exists(key)
+
+
+def test_replica_stream_applies_to_expired_keys():
+    key = "test:replica:stream"
+    _expired_list(key)
+    keyspace.replica = keyspace.loading = True
+    try:
+        # 主节点执行 rpush 时 key 尚未过期，副本上追加到原有数据，保留过期时间
+        asyncio.run(REPLAY_COMMANDS["rpush"](key, "b"))
+        assert list(keyspace.lists[key]) == ["a", "b"]
+        assert key in keyspace.expires
+        asyncio.run(REPLAY_COMMANDS["remove"](key))
+        assert not keyspace.exists(key)
+    finally:
+        keyspace.replica = keyspace.loading = False
+        keyspace.remove(key)
+
+
+async def _reconnect_after_bad_sync(tmp_path: Path) -> List[bytes]:
+    """
+    主节点第一次返回格式错误的 +FULLRESYNC，返回副本每次连接发送的 psync 命令
+    """
+    requests: List[bytes] = []
+
+    async def handle(
+        reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        requests.append(await reader.read(1024))
+        if len(requests) == 1:
+            writer.write(b"+FULLRESYNC bad" + CRLF)
+        writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+
+    async def load_snapshot(path: Path) -> None:
+        pass
+
+    replication = Replication(Snapshot(str(tmp_path / "dump.snapshot")), load_snapshot)
+    replication.replicaof("127.0.0.1", port)
+    try:
+        deadline = time.monotonic() + CONVERGE_TIMEOUT
+        while len(requests) < 2:
+            assert time.monotonic() < deadline, "副本未能重连主节点"
+            await asyncio.sleep(0.1)
+    finally:
+        replication.promote()
+        await replication.close()
+        server.close()
+    return requests
+
+
+def test_replica_reconnects_after_unexpected_error(tmp_path):
+    # 解析 +FULLRESYNC 时的 ValueError 不能终止复制，重连后重新全量同步
+    requests = asyncio.run(_reconnect_after_bad_sync(tmp_path))
+    assert all(request.endswith(b"$2\r\n-1\r\n") for request in requests)
+
+
+def _random_command(rng: random.Random) -> List[str]:
+    key = f"key:{rng.randrange(KEYS)}"
+    value = str(rng.randrange(1000))
+    return rng.choice(
+        [
+            ["set", key, value],
+            ["setex", key, "1", value],
+            ["rpush", key, value],
+            ["lpush", key, value, value],
+            ["lpop", key],
+            ["ltrim", key, "0", "3"],
+            ["hset", key, f"f{rng.randrange(5)}", value],
+            ["hdel", key, f"f{rng.randrange(5)}"],
+            ["expire", key, str(rng.choice([1, 1, 100]))],
+            ["persist", key],
+            ["del", key],
+        ]
+    )
+
+
+async def _state(client: Client) -> Dict[str, Optional[str]]:
+    """
+    节点上全部 key 的 dump 结果(不含已过期、尚未删除的 key)
+    """
+    keys: List[str] = []
+    cursor = "0"
+    while True:
+        cursor, batch = await client.call("scan", cursor, "COUNT", "100")
+        keys.extend(batch)
+        if cursor == "0":
+            break
+    return {key: await client.call("dump", key) for key in sorted(set(keys))}
+
+
+async def _offset(client: Client, name: str) -> int:
+    info = await client.call("info", "replication")
+    for line in info.splitlines():
+        if line.startswith(f"{name}:"):
+            return int(line.split(":", 1)[1])
+    raise AssertionError(f"info replication 中没有 {name}")
+
+
+async def _converge(primary: Client, replicas: List[Client]) -> None:
+    """
+    等待副本执行完主节点产生的全部写命令后比较数据；比较期间可能有 key 过期，
+    不一致时等待主节点同步删除后重新比较
+    """
+    deadline = time.monotonic() + CONVERGE_TIMEOUT
+    while True:
+        offset = await _offset(primary, "master_repl_offset")
+        offsets = [await _offset(replica, "slave_repl_offset") for replica in replicas]
+        if all(value == offset for value in offsets):
+            expected = await _state(primary)
+            states = [await _state(replica) for replica in replicas]
+            if all(state == expected for state in states):
+                return
+        assert time.monotonic() < deadline, f"副本未能与主节点一致: {offset} {offsets}"
+        await asyncio.sleep(0.1)
+
+
+async def _wait_link_up(replica: Client) -> None:
+    """
+    等待全量同步完成
+    """
+    deadline = time.monotonic() + CONVERGE_TIMEOUT
+    while "master_link_status:up" not in await replica.call("info", "replication"):
+        assert time.monotonic() < deadline, "副本未能连接到主节点"
+        await asyncio.sleep(0.1)
+
+
+async def _workload(primary_port: int, replica_ports: List[int]) -> None:
+    rng = random.Random(0)
+    primary = await Client.connect(primary_port)
+    replicas = [await Client.connect(port) for port in replica_ports]
+    try:
+        for replica in replicas:
+            await _wait_link_up(replica)
+
+        for i in range(OPERATIONS):
+            await primary.call(*_random_command(rng))
+            if i % 500 == 499:
+                await _converge(primary, replicas)
+            if i % 100 == 99:
+                # 让设置了过期时间的 key 陆续过期
+                await asyncio.sleep(0.2)
+
+        # 全部短期 key 过期后，主节点删除它们并同步给副本
+        await asyncio.sleep(1.5)
+        await _converge(primary, replicas)
+        for replica in replicas:
+            assert "role:slave" in await replica.call("info", "replication")
+    finally:
+        for client in [primary, *replicas]:
+            await client.close()
+
+
+async def _fill_and_converge(primary_port: int, replica_port: int) -> None:
+    primary = await Client.connect(primary_port)
+    replica = await Client.connect(replica_port)
+    try:
+        await _wait_link_up(replica)
+        for i in range(100):
+            await primary.call("set", f"key:{i}", "x" * 100)
+            await primary.call("rpush", "list", "x" * 100)
+        await _converge(primary, [replica])
+        assert len(await _state(replica)) == 102
+    finally:
+        await primary.close()
+        await replica.close()
+
+
+def test_replica_ignores_maxmemory(start_server):
+    primary = start_server("primary")
+    asyncio.run(call(primary.port, "set", "before", "x" * 1000))
+    # 全量同步载入的数据及之后同步的写命令都超出副本的内存上限
+    replica = start_server(
+        "replica",
+        replicaof=f"127.0.0.1:{primary.port}",
+        maxmemory=1000,
+        maxmemory_policy="allkeys-lru",
+    )
+    asyncio.run(_fill_and_converge(primary.port, replica.port))
+
+
+def test_replicas_converge(start_server):
+    primary = start_server("primary")
+    replicas = [
+        start_server(f"replica{i}", replicaof=f"127.0.0.1:{primary.port}")
+        for i in range(2)
+    ]
+    asyncio.run(_workload(primary.port, [replica.port for replica in replicas]))
@@ -0,0 +1,25 @@
+import asyncio
+
+import pytest
+from helpers import call
+
+from protocol import ReplyError
+
+
+def test_range_returns_array(start_server):
+    server = start_server()
+    asyncio.run(call(server.port, "rpush", "list", "a b", "c"))
+    # 数据中含有空格时也能区分各个元素
+    assert asyncio.run(call(server.port, "range", "list", "0", "-1")) == ["a b", "c"]
+
+
+def test_errors_are_resp_errors(start_server):
+    server = start_server()
+    with pytest.raises(ReplyError, match="^ERR 命令参数有误!$"):
+        asyncio.run(call(server.port, "setex", "key", "0", "value"))
+    with pytest.raises(ReplyError, match="^ERR 未知的指令"):
+        asyncio.run(call(server.port, "nosuchcommand"))
+    # 不存在的 key 不是错误
+    assert asyncio.run(call(server.port, "hget", "missing", "field")).startswith(
+        "哈希表"
+    )
@@ -0,0 +1,141 @@
+import asyncio
+import random
+from typing import Dict, List, Set, Tuple
+
+from helpers import Client
+
+from database._keyspace import SlotList, scan_slots
+
+
+def _scan_all(
+    slots: SlotList, count: int, rng: random.Random
+) -> Tuple[Set[str], Set[str]]:
+    """
+    遍历期间随机删除、添加元素，返回遍历期间一直存在的元素和返回的元素
+    """
+    stable = set(slots.items)
+    returned: Set[str] = set()
+    cursor, added = 0, 0
+    while True:
+        cursor, batch = scan_slots(slots.items, cursor, count)
+        returned.update(batch)
+        for _ in range(3):
+            if slots.items and rng.random() < 0.5:
+                item = rng.choice(slots.items)
+                slots.discard(item)
+                stable.discard(item)
+            slots.add(f"new{added}")
+            added += 1
+        if cursor == 0:
+            return stable, returned
+
+
+def test_scan_slots_returns_stable_items():
+    rng = random.Random(0)
+    for count in (1, 3, 10, 1000):
+        slots = SlotList(f"item{i}" for i in range(500))
+        stable, returned = _scan_all(slots, count, rng)
+        assert stable <= returned
+        assert all(slots.items[slots.slots[item]] == item for item in slots.items)
+
+
+async def _scan_keys(client: Client, *options: str) -> List[str]:
+    keys: List[str] = []
+    cursor = "0"
+    while True:
+        cursor, batch = await client.call("scan", cursor, *options)
+        keys.extend(batch)
+        if cursor == "0":
+            return keys
+
+
+async def _scan_during_writes(port: int) -> None:
+    client = await Client.connect(port)
+    try:
+        for i in range(300):
+            await client.call("set", f"key:{i}", "x")
+        await client.call("rpush", "list:0", "a")
+
+        stable = {f"key:{i}" for i in range(300)} | {"list:0"}
+        returned: Set[str] = set()
+        cursor = "0"
+        deleted = 1
+        while True:
+            cursor, batch = await client.call("scan", cursor, "COUNT", "7")
+            returned.update(batch)
+            # 遍历期间删除、新建 key
+            await client.call("del", f"key:{deleted}")
+            stable.discard(f"key:{deleted}")
+            deleted += 3
+            await client.call("set", f"new:{deleted}", "x")
+            if cursor == "0":
+                break
+        assert stable <= returned
+
+        assert set(await _scan_keys(client, "TYPE", "list")) == {"list:0"}
+        assert set(await _scan_keys(client, "MATCH", "key:1?")) == {
+            f"key:{i}" for i in range(10, 20)
+        } - {f"key:{i}" for i in range(1, deleted, 3)}
+    finally:
+        await client.close()
+
+
+def test_scan(start_server):
+    server = start_server()
+    asyncio.run(_scan_during_writes(server.port))
+
+
+async def _hscan_during_writes(port: int) -> None:
+    client = await Client.connect(port)
+    try:
+        pairs = [arg for i in range(300) for arg in (f"f{i}", str(i))]
+        await client.call("hmset", "hash", *pairs)
+        assert await client.call("object", "encoding", "hash") == "hashtable"
+
+        stable = {f"f{i}" for i in range(300)}
+        returned: Dict[str, str] = {}
+        cursor = "0"
+        i = 0
+        while True:
+            cursor, items = await client.call("hscan", "hash", cursor, "COUNT", "11")
+            returned.update(zip(items[::2], items[1::2]))
+            await client.call("hdel", "hash", f"f{i}")
+            stable.discard(f"f{i}")
+            await client.call("hset", "hash", f"new{i}", "x")
+            i += 7
+            if cursor == "0":
+                break
+        assert stable <= returned.keys()
+        assert all(returned[field] == field[1:] for field in stable)
+
+        # 紧凑编码的哈希表一次返回全部字段
+        await client.call("hmset", "small", "a", "1", "b", "2")
+        assert await client.call("hscan", "small", "0", "COUNT", "1") == [
+            "0",
+            ["a", "1", "b", "2"],
+        ]
+    finally:
+        await client.close()
+
+
+def test_hscan(start_server):
+    server = start_server()
+    asyncio.run(_hscan_during_writes(server.port))
+
+
+async def _scan_shards(port: int) -> None:
+    client = await Client.connect(port)
+    try:
+        keys = {f"key:{i}" for i in range(200)}
+        for key in keys:
+            await client.call("set", key, "x")
+        returned = await _scan_keys(client, "COUNT", "9")
+        assert set(returned) == keys
+        assert len(returned) == len(keys)
+    finally:
+        await client.close()
+
+
+def test_scan_across_shards(start_server):
+    server = start_server(workers=2)
+    asyncio.run(_scan_shards(server.port))